@@ -0,0 +1,533 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from os import path
+
+from getsub.metrics import metrics
+
+
+def default_cache_dir():
+    """
+    缓存目录，优先使用环境变量 GETSUB_CACHE_DIR
+    """
+    if os.environ.get("GETSUB_CACHE_DIR"):
+        return os.environ["GETSUB_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or path.join(
+        path.expanduser("~"), ".cache"
+    )
+    return path.join(base, "getsub")
+
+
+def connect(db_path):
+    """
+    打开缓存数据库，PageCache、NegativeCache 和 ArchiveStore 使用同一文件，
+    使用 WAL 且写入冲突时等待，多线程同时读写时不会出现 database is locked
+
+    return:
+        conn: sqlite3.Connection, can be used by other threads
+    """
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class PageCache:
+    """
+    基于 SQLite 的网页缓存，按下载器设置过期时间，超过容量时删除最久未使用的页面
+
+    params:
+        cache_dir: str, directory of the database, default_cache_dir() if empty
+        max_size: int, maximum bytes of cached pages
+        ttls: dict, {downloader name: seconds}, update default_ttls
+        enabled: bool, False to disable reading and writing
+        refresh: bool, True to ignore cached pages but still save new pages
+    """
+
+    default_ttls = {
+        "zimuku": 12 * 3600,
+        "zimuzu": 6 * 3600,
+        "guessit": 30 * 24 * 3600,
+    }
+    default_ttl = 3600
+    db_name = "cache.sqlite3"
+
+    def __init__(
+        self,
+        cache_dir="",
+        max_size=64 * 1024 * 1024,
+        ttls=None,
+        enabled=True,
+        refresh=False,
+    ):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = max_size
+        self.ttls = dict(PageCache.default_ttls)
+        self.ttls.update(ttls or {})
+        self.enabled = enabled
+        self.refresh = refresh
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # 首次读写时才创建数据库
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = connect(path.join(self.cache_dir, PageCache.db_name))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "provider TEXT, key TEXT, value TEXT, size INTEGER, "
+                "created REAL, accessed REAL, PRIMARY KEY (provider, key))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, provider, key):
+        """
+        return:
+            value: str, None if not cached or expired
+        """
+        if not self.enabled or self.refresh:
+            return None
+        ttl = self.ttls.get(provider, PageCache.default_ttl)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created FROM pages WHERE provider = ? AND key = ?",
+                (provider, key),
+            ).fetchone()
+            if row is None:
+                metrics.incr("cache.page.misses")
+                return None
+            if now - row[1] > ttl:
+                conn.execute(
+                    "DELETE FROM pages WHERE provider = ? AND key = ?", (provider, key)
+                )
+                conn.commit()
+                metrics.incr("cache.page.misses")
+                return None
+            conn.execute(
+                "UPDATE pages SET accessed = ? WHERE provider = ? AND key = ?",
+                (now, provider, key),
+            )
+            conn.commit()
+        metrics.incr("cache.page.hits")
+        return row[0]
+
+    def set(self, provider, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (provider, key, value, size, now, now),
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def delete(self, provider, key):
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "DELETE FROM pages WHERE provider = ? AND key = ?", (provider, key)
+            )
+            conn.commit()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_size:
+            return
+        # 删除最久未使用的页面直到容量降至上限的 90%
+        target = total - self.max_size * 0.9
+        removed, keys = 0, []
+        for provider, key, size in conn.execute(
+            "SELECT provider, key, size FROM pages ORDER BY accessed"
+        ):
+            if removed >= target:
+                break
+            keys.append((provider, key))
+            removed += size
+        conn.executemany("DELETE FROM pages WHERE provider = ? AND key = ?", keys)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class NegativeCache:
+    """
+    记录没有搜索结果的视频，按剧集名、季、集（电影按名称和年份）记录，
+    重新搜索的间隔每次加倍
+
+    params:
+        cache_dir: str, directory of the database, default_cache_dir() if empty
+        interval: int, seconds before the first re-check
+        max_interval: int, maximum seconds between two re-checks
+        enabled: bool, False to disable reading and writing
+        refresh: bool, True to search again but still record new results
+    """
+
+    db_name = PageCache.db_name
+
+    def __init__(
+        self,
+        cache_dir="",
+        interval=12 * 3600,
+        max_interval=30 * 24 * 3600,
+        enabled=True,
+        refresh=False,
+    ):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.interval = interval
+        self.max_interval = max_interval
+        self.enabled = enabled
+        self.refresh = refresh
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def key(cls, info):
+        """
+        params:
+            info: dict, result of guessit
+        return:
+            key: str, e.g. "the expanse:s01e02", "pulp fiction:1994"
+        """
+        title = " ".join(str(info.get("title", "")).lower().split())
+        if info.get("type") == "episode":
+            return "%s:s%se%s" % (title, info.get("season"), info.get("episode"))
+        return "%s:%s" % (title, info.get("year"))
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = connect(path.join(self.cache_dir, NegativeCache.db_name))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS negative ("
+                "key TEXT PRIMARY KEY, attempts INTEGER, "
+                "checked REAL, next_check REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def next_check(self, key, now=None):
+        """
+        return:
+            next_check: float, timestamp of next search,
+                        None if the key can be searched now
+        """
+        if not self.enabled or self.refresh:
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT next_check FROM negative WHERE key = ?", (key,))
+                .fetchone()
+            )
+        if row is None or row[0] <= now:
+            return None
+        return row[0]
+
+    def add(self, key):
+        """ 记录一次没有结果的搜索 """
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT attempts FROM negative WHERE key = ?", (key,)
+            ).fetchone()
+            attempts = row[0] + 1 if row is not None else 1
+            interval = min(self.interval * 2 ** (attempts - 1), self.max_interval)
+            conn.execute(
+                "INSERT OR REPLACE INTO negative VALUES (?, ?, ?, ?)",
+                (key, attempts, now, now + interval),
+            )
+            conn.commit()
+
+    def remove(self, key):
+        if not self.enabled:
+            return
+        self.purge([key])
+
+    def list(self):
+        """
+        return:
+            entries: list, [(key, attempts, checked, next_check), ...]
+        """
+        with self._lock:
+            return (
+                self._connect()
+                .execute("SELECT * FROM negative ORDER BY next_check")
+                .fetchall()
+            )
+
+    def purge(self, keys=None):
+        """
+        删除记录，keys 为 None 时删除所有记录
+
+        return:
+            count: int, number of removed entries
+        """
+        with self._lock:
+            conn = self._connect()
+            if keys is None:
+                count = conn.execute("DELETE FROM negative").rowcount
+            else:
+                count = sum(
+                    conn.execute("DELETE FROM negative WHERE key = ?", (k,)).rowcount
+                    for k in keys
+                )
+            conn.commit()
+        return count
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ArchiveStore:
+    """
+    按内容哈希保存下载的字幕包，候选链接和解析后的下载链接都指向保存的字幕包，
+    同一季的字幕包只下载一次，相同内容只保存一份
+    超过容量时删除最久未使用的字幕包，字幕清单保存在字幕包旁
+
+    params:
+        cache_dir: str, archives are saved in its "archives" directory,
+                   default_cache_dir() if empty
+        max_size: int, maximum bytes of saved archives
+        ttl: int, seconds a download link is mapped to its archive
+        enabled: bool, False to disable reading and writing
+        refresh: bool, True to download again but still save new archives
+    """
+
+    db_name = PageCache.db_name
+    dir_name = "archives"
+
+    def __init__(
+        self,
+        cache_dir="",
+        max_size=256 * 1024 * 1024,
+        ttl=7 * 24 * 3600,
+        enabled=True,
+        refresh=False,
+    ):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.archive_dir = path.join(self.cache_dir, ArchiveStore.dir_name)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled and max_size > 0
+        self.refresh = refresh
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self._conn = connect(path.join(self.cache_dir, ArchiveStore.db_name))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS archive_links ("
+                "link TEXT PRIMARY KEY, digest TEXT, created REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS archives ("
+                "digest TEXT PRIMARY KEY, datatype TEXT, size INTEGER, "
+                "accessed REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _path(self, digest, datatype):
+        return path.join(self.archive_dir, digest + datatype)
+
+    def _manifest_path(self, digest):
+        return path.join(self.archive_dir, digest + ".json")
+
+    def get(self, link):
+        """
+        return:
+            archive: tuple, (digest, datatype, file), None if not saved,
+                     file is the saved archive opened in binary mode,
+                     closed by the caller
+        """
+        if not self.enabled or self.refresh:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT archives.digest, datatype, created FROM archive_links "
+                "JOIN archives ON archive_links.digest = archives.digest "
+                "WHERE link = ?",
+                (link,),
+            ).fetchone()
+            if row is None:
+                metrics.incr("cache.archive.misses")
+                return None
+            digest, datatype, created = row
+            try:
+                if now - created > self.ttl:
+                    raise FileNotFoundError
+                file = open(self._path(digest, datatype), "rb")
+            except OSError:
+                conn.execute("DELETE FROM archive_links WHERE link = ?", (link,))
+                conn.commit()
+                metrics.incr("cache.archive.misses")
+                return None
+            conn.execute(
+                "UPDATE archives SET accessed = ? WHERE digest = ?", (now, digest)
+            )
+            conn.commit()
+        metrics.incr("cache.archive.hits")
+        return digest, datatype, file
+
+    def put(self, link, datatype, data):
+        """
+        params:
+            data: bytes-like, or a binary file
+        return:
+            digest: str, sha256 of data, None if disabled
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            digest, size = self._save(datatype, data)
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?)",
+                (digest, datatype, size, now),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO archive_links VALUES (?, ?, ?)",
+                (link, digest, now),
+            )
+            self._evict(conn)
+            conn.commit()
+        return digest
+
+    def add_link(self, link, digest):
+        """ 另一个链接指向已保存的字幕包 """
+        if not self.enabled or digest is None:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO archive_links VALUES (?, ?, ?)",
+                (link, digest, time.time()),
+            )
+            conn.commit()
+
+    def _save(self, datatype, data):
+        """ 边写入临时文件边计算哈希，相同内容已保存时不替换 """
+        sha256 = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.archive_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if hasattr(data, "read"):
+                    data.seek(0)
+                    for chunk in iter(lambda: data.read(1024 * 1024), b""):
+                        sha256.update(chunk)
+                        f.write(chunk)
+                    data.seek(0)
+                else:
+                    sha256.update(data)
+                    f.write(data)
+                size = f.tell()
+            digest = sha256.hexdigest()
+            archive_path = self._path(digest, datatype)
+            if path.exists(archive_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, archive_path)
+        except BaseException:
+            if path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest, size
+
+    def get_manifest(self, digest):
+        """
+        return:
+            manifest: list, saved by set_manifest, None if not saved
+        """
+        if not self.enabled or digest is None:
+            return None
+        try:
+            with open(self._manifest_path(digest), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set_manifest(self, digest, manifest):
+        """
+        params:
+            manifest: list, JSON serializable, e.g. member list of the archive
+        """
+        if not self.enabled or digest is None:
+            return
+        manifest_path = self._manifest_path(digest)
+        temp_path = "%s.%s.tmp" % (manifest_path, threading.get_ident())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, manifest_path)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM archives").fetchone()[
+            0
+        ]
+        if total <= self.max_size:
+            return
+        # 删除最久未使用的字幕包直到容量降至上限的 90%
+        target = total - self.max_size * 0.9
+        removed = 0
+        for digest, datatype, size in conn.execute(
+            "SELECT digest, datatype, size FROM archives ORDER BY accessed"
+        ).fetchall():
+            if removed >= target:
+                break
+            for file_path in (
+                self._path(digest, datatype),
+                self._manifest_path(digest),
+            ):
+                try:
+                    os.remove(file_path)
+                except OSError:  # removed already, or still open on Windows
+                    pass
+            conn.execute("DELETE FROM archives WHERE digest = ?", (digest,))
+            conn.execute("DELETE FROM archive_links WHERE digest = ?", (digest,))
+            removed += size
+
+    def clear(self):
+        """ 删除所有保存的字幕包 """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM archives")
+            conn.execute("DELETE FROM archive_links")
+            conn.commit()
+            shutil.rmtree(self.archive_dir, ignore_errors=True)
+            os.makedirs(self.archive_dir, exist_ok=True)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -45,3 +45,6 @@ VIDEO_FORMATS = [
     ".f4a",
     ".f4b",
 ]
+
+# 扩展名查找使用集合，比较时扩展名转为小写
+VIDEO_EXTENSIONS = frozenset(VIDEO_FORMATS)
@@ -1,6 +1,28 @@
 # coding: utf-8
 
-from requests.utils import quote
+import re
+import asyncio
+from functools import partial
+from contextlib import asynccontextmanager
+
+from requests import exceptions
+from requests.utils import quote, unquote
+
+from getsub.constants import SUB_FORMATS, ARCHIVE_TYPES
+from getsub.session import SessionManager, RETRY_STATUSES
+from getsub.util import MAX_DOWNLOAD_SIZE
+from getsub.metrics import metrics
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed by the async interface
+    aiohttp = None
+
+
+# 网络异常，出现时换下一个站点搜索
+NETWORK_ERRORS = (exceptions.Timeout, exceptions.ConnectionError, asyncio.TimeoutError)
+if aiohttp is not None:
+    NETWORK_ERRORS += (aiohttp.ClientError,)
 
 
 class Downloader(object):
@@ -15,16 +37,53 @@ class Downloader(object):
 
     service_short_names = {"amazon prime": "amzn"}
 
+    # connection pools shared by all downloaders
+    sessions = SessionManager(headers=header)
+    # (requests per second, burst) sent to site_url, None for no limit
+    rate_limit = None
+
+    # timeout of each request in the async interface, in seconds
+    atimeout = 10
+    # maximum concurrent requests to one host
+    max_host_connections = 4
+    # downloads larger than this are aborted, in bytes, 0 for no limit
+    max_download_size = MAX_DOWNLOAD_SIZE
+
+    # PageCache shared by downloaders, None to disable caching
+    cache = None
+    # SharedResults of one run, videos of the same batch share search results
+    batch = None
+
+    def __init__(self):
+        if self.rate_limit:
+            self.sessions.limit(self.site_url, *self.rate_limit)
+
+    def get_session(self):
+
+        """ 下载器共享的 requests.Session
+        Return:
+            session: requests.Session
+        """
+
+        return self.sessions.session()
+
     @classmethod
     def get_keywords(cls, video):
-
-        """ 解析视频名
+        """解析视频名
         Args:
             video: Video 对象
         Return:
             keywords: list
         """
 
+        # 同一视频的关键字只解析一次，返回副本供调用方修改
+        if video.keywords is None:
+            video.keywords = cls._parse_keywords(video)
+        return list(video.keywords)
+
+    @classmethod
+    def _parse_keywords(cls, video):
+
         keywords = []
 
         info_dict = video.info
@@ -55,27 +114,101 @@ class Downloader(object):
         keywords = [quote(_keyword) for _keyword in keywords]
         return keywords
 
-    def get_subtitles(self, video, sub_num=5):
+    @classmethod
+    def search_cache_key(cls, keyword):
 
-        """ 搜索字幕
+        """ 搜索页缓存键，由 get_keywords 结果组成的搜索词标准化得到
+        Args:
+            keyword: str, 搜索词
+        Return:
+            key: str
+        """
+
+        keyword = re.sub(r"[\s.]+", ".", unquote(keyword).lower()).strip(".")
+        return "search:" + keyword
+
+    def get_cached(self, key):
+        if self.cache is None:
+            return None
+        return self.cache.get(self.name, key)
+
+    def set_cached(self, key, value):
+        if self.cache is not None:
+            self.cache.set(self.name, key, value)
+
+    def delete_cached(self, key):
+        if self.cache is not None:
+            self.cache.delete(self.name, key)
+
+    def get_parsed(self, key, fetch, parse):
+        """读取并解析页面，页面解析成功后才缓存
+        缓存的页面无法解析（验证码、网站改版等）时删除并重新下载，
+        新下载的页面无法解析时不缓存，异常抛给调用方
+        Args:
+            key: str, 缓存键
+            fetch: 无参数函数，返回页面 html
+            parse: 参数为 html 的函数
+        Return:
+            parse(html) 的结果
+        """
+
+        html = self.get_cached(key)
+        if html is not None:
+            try:
+                return parse(html)
+            except Exception:
+                self.delete_cached(key)
+        html = fetch()
+        result = parse(html)
+        self.set_cached(key, html)
+        return result
+
+    async def aget_parsed(self, key, afetch, parse):
+        """get_parsed 的异步版本，afetch 为返回页面 html 的无参数协程函数"""
+
+        html = self.get_cached(key)
+        if html is not None:
+            try:
+                return parse(html)
+            except Exception:
+                self.delete_cached(key)
+        html = await afetch()
+        result = parse(html)
+        self.set_cached(key, html)
+        return result
+
+    def get_subtitles(self, video, sub_num=5):
+        """搜索字幕
         Args:
             video：Video 对象
             sub_num: 字幕结果数，默认为5
         Return：
             字幕字典: 按语言值降序排列
             eg: {'字幕名': {'lan': '语言值', 'link': '字幕链接', 'session': '查询session'}}
+            'session' 可为 requests.Session 或 RequestContext
             字幕包含语言值：英文加1， 繁体加2， 简体加4， 双语加8
         """
 
         raise NotImplementedError
 
-    def download_file(self, file_name, sub_url, session=None):
+    def resolve_link(self, sub_url, session=None):
+        """解析候选字幕的最终下载链接，不同候选指向同一字幕包时下载链接相同
+        Args:
+            sub_url: 'get_subtitles' 返回结果中 'link' 值
+            session: 查询session
+        Return:
+            download_link: str, 可传给 download_file，解析失败时返回 sub_url
+        """
+
+        return sub_url
 
-        """ 下载字幕包
+    def download_file(self, file_name, sub_url, session=None, cancel=None):
+        """下载字幕包，下载到网页、过大的文件或 cancel 被设置时中止下载
         Args:
             file_name: 字幕包名
             sub_url: 下载链接，为 'get_subtitles' 返回结果中 'link' 值
             session: 查询session
+            cancel: threading.Event 或 None，由其他线程设置以取消下载
         Return:
             data_type: 压缩文件类型，如 '.rar', '.zip', '.7z'
             sub_data_bytes: 字幕包二进制数据
@@ -83,3 +216,131 @@ class Downloader(object):
         """
 
         raise NotImplementedError
+
+    @classmethod
+    def check_content(cls, content_type, guessed):
+        """ 根据下载内容判断文件类型，无法判断时使用由文件名或链接猜测的类型
+        Args:
+            content_type: ContentType, 'read_response' 返回值
+            guessed: str, 由文件名或链接猜测的类型
+        Return:
+            data_type: str
+            err_msg: str, 下载到网页时返回错误消息，否则为 ''
+        """
+
+        if content_type.datatype == "html":
+            return None, "got a web page instead of subtitles"
+        if content_type.datatype in ARCHIVE_TYPES + SUB_FORMATS:
+            return content_type.datatype, ""
+        return guessed, ""
+
+    @classmethod
+    def new_aclient(cls, **kwargs):
+        """新建异步接口使用的 aiohttp.ClientSession，需在事件循环中调用
+        Args:
+            kwargs: aiohttp.ClientSession 参数
+        Return:
+            client: aiohttp.ClientSession
+        """
+
+        if aiohttp is None:
+            raise ImportError("aiohttp is required, try 'pip install getsub[async]'")
+        kwargs.setdefault("headers", Downloader.header)
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=cls.atimeout))
+        kwargs.setdefault(
+            "connector", aiohttp.TCPConnector(limit_per_host=cls.max_host_connections)
+        )
+        kwargs.setdefault("trace_configs", [cls.sessions.trace_config()])
+        return aiohttp.ClientSession(**kwargs)
+
+    @classmethod
+    async def aretry(cls, request):
+        """异步请求失败时重试，重试次数和等待时间与同步接口的 session 相同
+        Args:
+            request: 无参数协程函数，出现 NETWORK_ERRORS 时重试
+        Return:
+            request() 的结果，重试后仍失败时抛出最后一次的异常
+        """
+
+        retry = 0
+        while True:
+            try:
+                return await request()
+            except NETWORK_ERRORS:
+                retry += 1
+                if retry > cls.sessions.retries:
+                    raise
+                metrics.incr("http.retries")
+                await asyncio.sleep(cls.sessions.backoff(retry))
+
+    @classmethod
+    async def aget_text(cls, client, url, headers=None):
+        """异步读取网页，网络错误和 429、5xx 响应按 aretry 重试
+        Args:
+            client: aiohttp.ClientSession
+            url: str
+            headers: dict, 本次请求额外的请求头
+        Return:
+            html: str
+        """
+
+        async def get():
+            async with client.get(url, headers=headers) as r:
+                if r.status in RETRY_STATUSES:
+                    r.raise_for_status()
+                return await r.text()
+
+        return await cls.aretry(get)
+
+    @asynccontextmanager
+    async def aclient(self, client=None):
+        # 使用传入的 client，未传入时新建并在结束后关闭
+        if client is not None:
+            yield client
+            return
+        client = self.new_aclient()
+        try:
+            yield client
+        finally:
+            await client.close()
+
+    async def aget_subtitles(self, video, sub_num=5, client=None):
+        """异步搜索字幕，默认在线程池中执行 get_subtitles
+        Args:
+            video：Video 对象
+            sub_num: 字幕结果数，默认为5
+            client: aiohttp.ClientSession，为 None 时新建
+        Return：
+            字幕字典: 同 get_subtitles，原生实现中 'session' 为下载需要的请求头
+        """
+
+        loop = asyncio.get_event_loop()
+        func = partial(self.get_subtitles, video, sub_num=sub_num)
+        return await loop.run_in_executor(None, func)
+
+    async def aresolve_link(self, sub_url, session=None, client=None):
+        """异步解析下载链接，默认在线程池中执行 resolve_link
+        Args:
+            同 resolve_link，client: aiohttp.ClientSession，为 None 时新建
+        Return:
+            同 resolve_link
+        """
+
+        loop = asyncio.get_event_loop()
+        func = partial(self.resolve_link, sub_url, session=session)
+        return await loop.run_in_executor(None, func)
+
+    async def adownload_file(self, file_name, sub_url, session=None, client=None):
+        """异步下载字幕包，默认在线程池中执行 download_file
+        Args:
+            file_name: 字幕包名
+            sub_url: 下载链接，为 'aget_subtitles' 返回结果中 'link' 值
+            session: 'aget_subtitles' 返回结果中 'session' 值
+            client: aiohttp.ClientSession，为 None 时新建
+        Return:
+            同 download_file
+        """
+
+        loop = asyncio.get_event_loop()
+        func = partial(self.download_file, file_name, sub_url, session=session)
+        return await loop.run_in_executor(None, func)
@@ -1,18 +1,22 @@
 # coding: utf-8
 
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
+from functools import partial
 from contextlib import closing
 from collections import OrderedDict
 
 import re
-import copy
+import asyncio
 import requests
 from bs4 import BeautifulSoup
-from guessit import guessit
 
 from getsub.constants import SUB_FORMATS
 from getsub.downloader.downloader import Downloader
-from getsub.util import ProgressBar, extract_name, compute_subtitle_score, num_to_cn
+from getsub.session import RequestContext
+from getsub.util import extract_name, compute_subtitle_score, num_to_cn
+from getsub.util import read_response, aread_response, guess_info
+from getsub.util import DownloadAborted
+from getsub.metrics import metrics
 
 
 """ Zimuku 字幕下载器
@@ -25,6 +29,9 @@ class ZimukuDownloader(Downloader):
     choice_prefix = "[ZIMUKU]"
     site_url = "http://www.zimuku.la"
     search_url = "http://www.zimuku.la/search?q="
+    redirect_pattern = r"url\s*=\s*'([^']*)'\s*\+\s*url"
+    detail_path = "/detail/"
+    rate_limit = (5, 5)
 
     def get_keywords(self, video):
         if video.info["type"] == "episode":
@@ -33,41 +40,52 @@ class ZimukuDownloader(Downloader):
         else:  # TODO: examine movies' search results
             return super().get_keywords(video)
 
-    def _parse_episode_page(self, session, link, info, match_episode=True):
+    @classmethod
+    def _parse_redirect(cls, html):
         """
-        compute scores for each subtitle in the episode page
+        parse window.location in html
+        return:
+            redirect_url: str, None if no redirection
+        """
+        parts = re.findall(ZimukuDownloader.redirect_pattern, html)
+        if not parts:
+            return None
+        parts.reverse()
+        return urljoin(ZimukuDownloader.site_url, "".join(parts))
+
+    @classmethod
+    @metrics.timed("zimuku.parse")
+    def _parse_down_page_link(cls, html):
+        bs_obj = BeautifulSoup(html, "html.parser")
+        down_page_link = bs_obj.find("a", {"id": "down1"}).attrs["href"]
+        return urljoin(ZimukuDownloader.site_url, down_page_link)
+
+    @classmethod
+    @metrics.timed("zimuku.parse")
+    def _parse_archive_link(cls, html):
+        bs_obj = BeautifulSoup(html, "html.parser")
+        download_link = bs_obj.find("a", {"rel": "nofollow"})
+        download_link = download_link.attrs["href"]
+        return urljoin(ZimukuDownloader.site_url, download_link)
+
+    @classmethod
+    @metrics.timed("zimuku.parse")
+    def _parse_episode_table(cls, html):
+        """
+        parse subtitles in the episode page
         params:
-            session: request.Session
-            link: str, episode page link
-            info: dict, result of guessit
+            html: str, episode page
         return:
-            subs: OrderedDict, format same as get_subtitles
-                  sorted in ascending order of scores
-        """
-
-        def _get_archive_dowload_link(sub_page_link):
-            r = session.get(sub_page_link)
-            bs_obj = BeautifulSoup(r.text, "html.parser")
-            down_page_link = bs_obj.find("a", {"id": "down1"}).attrs["href"]
-            down_page_link = urljoin(ZimukuDownloader.site_url, down_page_link)
-            r = session.get(down_page_link)
-            bs_obj = BeautifulSoup(r.text, "html.parser")
-            download_link = bs_obj.find("a", {"rel": "nofollow"})
-            download_link = download_link.attrs["href"]
-            download_link = urljoin(ZimukuDownloader.site_url, download_link)
-            return download_link
-
-        r = session.get(link)
-        bs_obj = BeautifulSoup(r.text, "html.parser")
+            rows: list, [<name, type_score, sub_page_link>, ...]
+        """
+
+        bs_obj = BeautifulSoup(html, "html.parser")
         subs_body = bs_obj.find("div", class_="subs box clearfix").find("tbody")
-        subs = dict()
+        rows = []
         for sub in subs_body.find_all("tr"):
             a = sub.find("a")
             name = extract_name(a.text, en=True)
 
-            score = compute_subtitle_score(info, name, match_episode=match_episode)
-            if score == -1:
-                continue
             type_score = 0
             for img in sub.find("td", class_="tac lang").find_all("img"):
                 if "uk" in img.attrs["src"]:
@@ -80,25 +98,37 @@ class ZimukuDownloader(Downloader):
                     type_score += 8
 
             sub_page_link = urljoin(ZimukuDownloader.site_url, a.attrs["href"])
-            download_link = _get_archive_dowload_link(sub_page_link)
-
-            backup_session = copy.deepcopy(session)
-            backup_session.headers["Referer"] = link
+            rows.append((name, type_score, sub_page_link))
+        return rows
 
-            # TODO: consider download times when computing scores
-            subs[ZimukuDownloader.choice_prefix + name] = {
-                "link": download_link,
-                "lan": type_score,
-                "session": backup_session,
-                "score": score,
-            }
+    @classmethod
+    def _score_rows(cls, rows, info, match_episode=True):
+        """
+        compute scores for each subtitle in the episode page
+        params:
+            rows: list, result of _parse_episode_table
+            info: dict, result of guessit
+        return:
+            rows: list, [<name, type_score, sub_page_link, score>, ...]
+        """
 
-        return subs
+        scored_rows = []
+        for name, type_score, sub_page_link in rows:
+            score = compute_subtitle_score(info, name, match_episode=match_episode)
+            if score == -1:
+                continue
+            scored_rows.append((name, type_score, sub_page_link, score))
+        return scored_rows
 
-    def _parse_shooter_episode_page(self, session, title, link):
-        sub = dict()
-        r = session.get(link)
-        bs_obj = BeautifulSoup(r.text, "html.parser")
+    @classmethod
+    @metrics.timed("zimuku.parse")
+    def _parse_shooter_page(cls, html):
+        """
+        return:
+            type_score: int
+            download_link: str
+        """
+        bs_obj = BeautifulSoup(html, "html.parser")
         lang_box = bs_obj.find("ul", {"class": "subinfo"}).find("li")
         type_score = 0
         text = lang_box.text
@@ -111,15 +141,176 @@ class ZimukuDownloader(Downloader):
         elif "双语" in text:
             type_score += 8
         download_link = bs_obj.find("a", {"id": "down1"}).attrs["href"]
-        backup_session = copy.deepcopy(session)
-        backup_session.headers["Referer"] = link
+        return type_score, download_link
+
+    @classmethod
+    @metrics.timed("zimuku.parse")
+    def _parse_search_page(cls, html, info_dict):
+        """
+        parse search result page
+        params:
+            html: str, search result page
+            info_dict: dict, result of guessit
+        return:
+            page_type: str, "episode" or "shooter"
+            items: list, episode page links if page_type is "episode",
+                   [<title, link>, ...] if page_type is "shooter"
+        """
+
+        bs_obj = BeautifulSoup(html, "html.parser")
+
+        # 综合搜索页面
+        if bs_obj.find("div", {"class": "item"}):
+            episode_links = []
+            for item in bs_obj.find_all("div", {"class": "item"}):
+                title_a = item.find("p", class_="tt clearfix").find("a")
+                if info_dict["type"] == "episode":
+                    title = title_a.text
+                    try:
+                        season_cn1 = re.search("第(.*)季", title).group(1).strip()
+                    except AttributeError:
+                        # try getting season from subtitles
+                        sample_title = (
+                            item.find("td", class_="first").find("a").get("title")
+                        )
+                        sample_dict = guess_info(extract_name(sample_title, en=True))
+                        season_cn1 = num_to_cn(str(sample_dict["season"]))
+                    season_cn2 = num_to_cn(str(info_dict["season"]))
+                    if season_cn1 != season_cn2:
+                        continue
+                episode_links.append(ZimukuDownloader.site_url + title_a.attrs["href"])
+            return "episode", episode_links
+
+        # 射手字幕页面
+        elif bs_obj.find("div", {"class": "persub"}):
+            shooter_items = []
+            for persub in bs_obj.find_all("div", {"class": "persub"}):
+                title = persub.h1.text.split("/")[-1]
+                link = ZimukuDownloader.site_url + persub.h1.a.attrs["href"]
+                shooter_items.append((title, link))
+            return "shooter", shooter_items
+
+        else:
+            raise ValueError("zimuku downloader needs updates")
+
+    @classmethod
+    def _sort_subs(cls, sub_dict, sub_num):
+        sub_dict = OrderedDict(
+            sorted(sub_dict.items(), key=lambda e: e[1]["score"], reverse=True)
+        )
+        keys = list(sub_dict.keys())[:sub_num]
+        return {key: sub_dict[key] for key in keys}
+
+    @classmethod
+    def _guess_datatype(cls, filename):
+        if ".rar" in filename:
+            return ".rar"
+        elif ".zip" in filename:
+            return ".zip"
+        elif ".7z" in filename:
+            return ".7z"
+        for sub_type in SUB_FORMATS:
+            if sub_type in filename:
+                return sub_type
+        return "Unknown"
+
+    @classmethod
+    def _is_detail_link(cls, link):
+        # 字幕详情页链接，需要解析出下载链接
+        return urlparse(link).path.startswith(ZimukuDownloader.detail_path)
+
+    def _get_page(self, session, link, parse):
+        return self.get_parsed("page:" + link, lambda: session.get(link).text, parse)
+
+    @metrics.timed("zimuku.resolve")
+    def _get_archive_dowload_link(self, session, sub_page_link):
+        r = session.get(sub_page_link)
+        down_page_link = self._parse_down_page_link(r.text)
+        r = session.get(down_page_link)
+        return self._parse_archive_link(r.text)
+
+    def _build_episode_subs(self, session, link, rows, info, match_episode=True):
+        """
+        compute scores for each subtitle in the episode page
+        params:
+            session: request.Session
+            link: str, episode page link
+            rows: list, result of _parse_episode_table
+            info: dict, result of guessit
+        return:
+            subs: dict, format same as get_subtitles
+        """
+
+        subs = dict()
+        for name, type_score, sub_page_link, score in self._score_rows(
+            rows, info, match_episode=match_episode
+        ):
+            # TODO: consider download times when computing scores
+            # download link is resolved when the subtitle is chosen
+            subs[ZimukuDownloader.choice_prefix + name] = {
+                "link": sub_page_link,
+                "lan": type_score,
+                "session": RequestContext(session, referer=link),
+                "score": score,
+            }
+
+        return subs
+
+    def _parse_shooter_episode_page(self, session, title, link):
+        sub = dict()
+        type_score, download_link = self._get_page(
+            session, link, self._parse_shooter_page
+        )
         sub[ZimukuDownloader.choice_prefix + title] = {
             "lan": type_score,
             "link": download_link,
-            "session": backup_session,
+            "session": RequestContext(session, referer=link),
         }
         return sub
 
+    def _search(self, session, keyword):
+        r = session.get(ZimukuDownloader.search_url + keyword, timeout=10)
+        html = r.text
+        redirect_url = self._parse_redirect(html)
+        while redirect_url:
+            r = session.get(redirect_url, timeout=10)
+            html = r.text
+            redirect_url = self._parse_redirect(html)
+        return html
+
+    @classmethod
+    def _parse_search_result(cls, html, info_dict):
+        if "搜索不到相关字幕" in html:
+            return None, []
+        return cls._parse_search_page(html, info_dict)
+
+    @classmethod
+    def _batch_key(cls, keyword, info_dict):
+        # 同一搜索词、同一季的视频共享搜索结果
+        return ZimukuDownloader.search_cache_key(keyword), info_dict.get("season")
+
+    def _search_pages(self, session, keyword, info_dict):
+        """
+        search and parse all result pages
+        return:
+            page_type: str, "episode", "shooter" or None if no results
+            items: list, [<episode_link, rows>, ...] if page_type is "episode",
+                   [<title, link>, ...] if page_type is "shooter"
+        """
+
+        page_type, items = self.get_parsed(
+            self.search_cache_key(keyword),
+            partial(self._search, session, keyword),
+            partial(self._parse_search_result, info_dict=info_dict),
+        )
+        if page_type == "episode":
+            items = [
+                (link, self._get_page(session, link, self._parse_episode_table))
+                for link in items
+            ]
+        return page_type, items
+
+    @metrics.timed("zimuku.get_subtitles")
     def get_subtitles(self, video, sub_num=10):
 
         print("Searching ZIMUKU...", end="\r")
@@ -127,110 +318,241 @@ class ZimukuDownloader(Downloader):
         keywords = self.get_keywords(video)
         info_dict = video.info
 
-        s = requests.session()
-        s.headers.update(Downloader.header)
+        s = self.get_session()
 
         sub_dict = dict()
-        pattern = r"url\s*=\s*'([^']*)'\s*\+\s*url"
         for i in range(len(keywords), 1, -1):
             keyword = ".".join(keywords[:i])
-            r = s.get(ZimukuDownloader.search_url + keyword, timeout=10)
-            html = r.text
-
-            # parse window.location
-            parts = re.findall(pattern, html)
-            while parts:
-                parts.reverse()
-                redirect_url = urljoin(ZimukuDownloader.site_url, "".join(parts))
-                r = s.get(redirect_url, timeout=10)
-                html = r.text
-                parts = re.findall(pattern, html)
-
-            if "搜索不到相关字幕" in html:
-                continue
+            if self.batch is not None:
+                page_type, items = self.batch.get(
+                    self._batch_key(keyword, info_dict),
+                    self._search_pages,
+                    s,
+                    keyword,
+                    info_dict,
+                )
+            else:
+                page_type, items = self._search_pages(s, keyword, info_dict)
 
-            bs_obj = BeautifulSoup(r.text, "html.parser")
-
-            # 综合搜索页面
-            if bs_obj.find("div", {"class": "item"}):
-                for item in bs_obj.find_all("div", {"class": "item"}):
-                    title_a = item.find("p", class_="tt clearfix").find("a")
-                    if info_dict["type"] == "episode":
-                        title = title_a.text
-                        try:
-                            season_cn1 = re.search("第(.*)季", title).group(1).strip()
-                        except AttributeError:
-                            # try getting season from subtitles
-                            sample_title = (
-                                item.find("td", class_="first").find("a").get("title")
-                            )
-                            sample_dict = guessit(extract_name(sample_title, en=True))
-                            season_cn1 = num_to_cn(str(sample_dict["season"]))
-                        season_cn2 = num_to_cn(str(info_dict["season"]))
-                        if season_cn1 != season_cn2:
-                            continue
-                    episode_link = ZimukuDownloader.site_url + title_a.attrs["href"]
-                    new_subs = self._parse_episode_page(s, episode_link, info_dict)
+            if page_type == "episode":
+                for episode_link, rows in items:
+                    new_subs = self._build_episode_subs(
+                        s, episode_link, rows, info_dict
+                    )
                     if not new_subs:
-                        new_subs = self._parse_episode_page(
-                            s, episode_link, info_dict, match_episode=False
+                        new_subs = self._build_episode_subs(
+                            s, episode_link, rows, info_dict, match_episode=False
                         )
                     sub_dict.update(new_subs)
-
-            # 射手字幕页面
-            elif bs_obj.find("div", {"class": "persub"}):
-                for persub in bs_obj.find_all("div", {"class": "persub"}):
-                    title = persub.h1.text.split("/")[-1]
+            elif page_type == "shooter":
+                for title, link in items:
                     # NOTE: this will filter out all subtitle packages
                     score = compute_subtitle_score(info_dict, title)
                     if score == -1:
                         continue
-                    link = ZimukuDownloader.site_url + persub.h1.a.attrs["href"]
                     sub = self._parse_shooter_episode_page(s, title, link)
                     sub[list(sub.keys())[0]]["score"] = score
                     sub_dict.update(sub)
 
-            else:
-                raise ValueError("zimuku downloader needs updates")
-
             if len(sub_dict) >= sub_num:
-                del keywords[:]
                 break
 
-        sub_dict = OrderedDict(
-            sorted(sub_dict.items(), key=lambda e: e[1]["score"], reverse=True)
-        )
-        keys = list(sub_dict.keys())[:sub_num]
-        return {key: sub_dict[key] for key in keys}
+        sub_dict = self._sort_subs(sub_dict, sub_num)
+        return sub_dict
+
+    def resolve_link(self, sub_url, session=None):
+        if not self._is_detail_link(sub_url):
+            return sub_url
+        try:
+            return self._get_archive_dowload_link(
+                session or self.get_session(), sub_url
+            )
+        except requests.Timeout:
+            return sub_url
 
-    def download_file(self, file_name, download_link, session=None):
+    @metrics.timed("zimuku.download_file")
+    def download_file(self, file_name, download_link, session=None, cancel=None):
 
         try:
             if not session:
-                session = requests.session()
+                session = self.get_session()
+            if self._is_detail_link(download_link):
+                download_link = self._get_archive_dowload_link(session, download_link)
             with closing(session.get(download_link, stream=True)) as response:
-                filename = response.headers["Content-Disposition"]
-                chunk_size = 1024  # 单次请求最大值
-                # 内容体总大小
-                content_size = int(response.headers["content-length"])
-                bar = ProgressBar("Get", file_name.strip(), content_size)
-                sub_data_bytes = b""
-                for data in response.iter_content(chunk_size=chunk_size):
-                    sub_data_bytes += data
-                    bar.refresh(len(sub_data_bytes))
+                filename = response.headers.get("Content-Disposition", "")
+                content_type, sub_data_bytes = read_response(
+                    response,
+                    file_name,
+                    max_size=self.max_download_size,
+                    cancel=cancel,
+                )
         except requests.Timeout:
             return None, None, "false"
-        if ".rar" in filename:
-            datatype = ".rar"
-        elif ".zip" in filename:
-            datatype = ".zip"
-        elif ".7z" in filename:
-            datatype = ".7z"
-        else:
-            datatype = "Unknown"
-            for sub_type in SUB_FORMATS:
-                if sub_type in filename:
-                    datatype = sub_type
+        except DownloadAborted as e:
+            return None, None, str(e)
+
+        datatype, error = self.check_content(
+            content_type, self._guess_datatype(filename)
+        )
+        if error:
+            return None, None, error
+        return datatype, sub_data_bytes, ""
+
+    async def _aget_page(self, client, link, parse):
+        return await self.aget_parsed(
+            "page:" + link, partial(self.aget_text, client, link), parse
+        )
+
+    async def _asearch(self, client, keyword):
+        html = await self.aget_text(client, ZimukuDownloader.search_url + keyword)
+        redirect_url = self._parse_redirect(html)
+        while redirect_url:
+            html = await self.aget_text(client, redirect_url)
+            redirect_url = self._parse_redirect(html)
+        return html
+
+    @metrics.timed("zimuku.resolve")
+    async def _aget_archive_dowload_link(self, client, sub_page_link, headers=None):
+        # 与同步接口相同，每个请求都带 Referer，否则下载页被拒绝
+        html = await self.aget_text(client, sub_page_link, headers=headers)
+        down_page_link = self._parse_down_page_link(html)
+        html = await self.aget_text(client, down_page_link, headers=headers)
+        return self._parse_archive_link(html)
+
+    async def aresolve_link(self, sub_url, session=None, client=None):
+        if not self._is_detail_link(sub_url):
+            return sub_url
+        async with self.aclient(client) as client:
+            try:
+                return await self._aget_archive_dowload_link(
+                    client, sub_url, headers=session
+                )
+            except asyncio.TimeoutError:
+                return sub_url
+
+    def _abuild_episode_subs(self, link, rows, info):
+        subs = dict()
+        scored_rows = self._score_rows(rows, info)
+        if not scored_rows:
+            scored_rows = self._score_rows(rows, info, match_episode=False)
+        for name, type_score, sub_page_link, score in scored_rows:
+            subs[ZimukuDownloader.choice_prefix + name] = {
+                "link": sub_page_link,
+                "lan": type_score,
+                "session": {"Referer": link},
+                "score": score,
+            }
+        return subs
+
+    async def _aparse_shooter_episode_page(self, client, title, link, score):
+        type_score, download_link = await self._aget_page(
+            client, link, self._parse_shooter_page
+        )
+        return {
+            ZimukuDownloader.choice_prefix
+            + title: {
+                "lan": type_score,
+                "link": download_link,
+                "session": {"Referer": link},
+                "score": score,
+            }
+        }
+
+    async def _asearch_pages(self, client, keyword, info_dict):
+        """
+        _search_pages 的异步版本
+        """
+
+        page_type, items = await self.aget_parsed(
+            self.search_cache_key(keyword),
+            partial(self._asearch, client, keyword),
+            partial(self._parse_search_result, info_dict=info_dict),
+        )
+        if page_type == "episode":
+            tables = await asyncio.gather(
+                *[
+                    self._aget_page(client, link, self._parse_episode_table)
+                    for link in items
+                ]
+            )
+            items = list(zip(items, tables))
+        return page_type, items
+
+    @metrics.timed("zimuku.aget_subtitles")
+    async def aget_subtitles(self, video, sub_num=10, client=None):
+
+        keywords = self.get_keywords(video)
+        info_dict = video.info
+
+        sub_dict = dict()
+        async with self.aclient(client) as client:
+            for i in range(len(keywords), 1, -1):
+                keyword = ".".join(keywords[:i])
+                if self.batch is not None:
+                    page_type, items = await self.batch.aget(
+                        self._batch_key(keyword, info_dict),
+                        self._asearch_pages,
+                        client,
+                        keyword,
+                        info_dict,
+                    )
+                else:
+                    page_type, items = await self._asearch_pages(
+                        client, keyword, info_dict
+                    )
+
+                if page_type == "episode":
+                    for episode_link, rows in items:
+                        sub_dict.update(
+                            self._abuild_episode_subs(episode_link, rows, info_dict)
+                        )
+                elif page_type == "shooter":
+                    tasks = []
+                    for title, link in items:
+                        score = compute_subtitle_score(info_dict, title)
+                        if score == -1:
+                            continue
+                        tasks.append(
+                            self._aparse_shooter_episode_page(
+                                client, title, link, score
+                            )
+                        )
+                    for new_subs in await asyncio.gather(*tasks):
+                        sub_dict.update(new_subs)
+
+                if len(sub_dict) >= sub_num:
                     break
 
+            sub_dict = self._sort_subs(sub_dict, sub_num)
+        return sub_dict
+
+    @metrics.timed("zimuku.adownload_file")
+    async def adownload_file(self, file_name, download_link, session=None, client=None):
+
+        async with self.aclient(client) as client:
+            if self._is_detail_link(download_link):
+                download_link = await self._aget_archive_dowload_link(
+                    client, download_link, headers=session
+                )
+
+            async def download():
+                async with client.get(download_link, headers=session) as response:
+                    filename = response.headers.get("Content-Disposition", "")
+                    content_type, data = await aread_response(
+                        response, max_size=self.max_download_size
+                    )
+                return filename, content_type, data
+
+            try:
+                filename, content_type, sub_data_bytes = await self.aretry(download)
+            except asyncio.TimeoutError:
+                return None, None, "false"
+            except DownloadAborted as e:
+                return None, None, str(e)
+
+        datatype, error = self.check_content(
+            content_type, self._guess_datatype(filename)
+        )
+        if error:
+            return None, None, error
         return datatype, sub_data_bytes, ""
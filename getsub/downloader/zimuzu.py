@@ -3,12 +3,15 @@
 from collections import OrderedDict as order_dict
 from contextlib import closing
 import json
+import asyncio
+from functools import partial
 
 import requests
 from bs4 import BeautifulSoup
 
 from getsub.downloader.downloader import Downloader
-from getsub.util import ProgressBar
+from getsub.util import read_response, aread_response, DownloadAborted
+from getsub.metrics import metrics
 
 
 """ Zimuzu 字幕下载器
@@ -21,102 +24,63 @@ class ZimuzuDownloader(Downloader):
     choice_prefix = "[ZIMUZU]"
     site_url = "http://www.rrys2020.com"
     search_url = "http://www.rrys2020.com/search?keyword={0}&type=subtitle"
+    ajax_url = "http://got002.com/api/v1/static/subtitle/detail?"
+    rate_limit = (5, 5)
 
-    def get_subtitles(self, video, sub_num=5):
-
-        print("Searching ZIMUZU...", end="\r")
-
-        keywords = Downloader.get_keywords(video)
-        keyword = " ".join(keywords)
-
-        sub_dict = order_dict()
-        s = requests.session()
-        while True:
-            # 当前关键字查询
-            r = s.get(
-                ZimuzuDownloader.search_url.format(keyword),
-                headers=Downloader.header,
-                timeout=10,
+    @classmethod
+    @metrics.timed("zimuzu.parse")
+    def _parse_search_page(cls, html, video):
+        """
+        return:
+            subs: list, [<sub_name, type_score, sub_url>, ...]
+        """
+        bs_obj = BeautifulSoup(html, "html.parser")
+        tab_text = bs_obj.find("div", {"class": "article-tab"}).text
+        if "字幕(0)" in tab_text:
+            return []
+        subs = []
+        for one_box in bs_obj.find_all("div", {"class": "search-item"}):
+            sub_name = (
+                ZimuzuDownloader.choice_prefix
+                + one_box.find("strong", {"class": "list_title"}).text
             )
-            bs_obj = BeautifulSoup(r.text, "html.parser")
-            tab_text = bs_obj.find("div", {"class": "article-tab"}).text
-            if "字幕(0)" not in tab_text:
-                for one_box in bs_obj.find_all("div", {"class": "search-item"}):
-                    sub_name = (
-                        ZimuzuDownloader.choice_prefix
-                        + one_box.find("strong", {"class": "list_title"}).text
-                    )
 
-                    if video.info["type"] == "movie" and "美剧字幕" in sub_name:
-                        continue
-
-                    a = one_box.find("a")
-                    text = a.text
-                    sub_url = ZimuzuDownloader.site_url + a.attrs["href"]
-                    type_score = 0
-                    type_score += ("英文" in text) * 1
-                    type_score += ("繁体" in text) * 2
-                    type_score += ("简体" in text) * 4
-                    type_score += ("中英" in text) * 8
-                    sub_dict[sub_name] = {
-                        "lan": type_score,
-                        "link": sub_url,
-                        "session": None,
-                    }
-                    if len(sub_dict) >= sub_num:
-                        del keywords[:]  # 字幕条数达到上限，清空keywords
-                        break
-
-            if len(keywords) > 1:  # 字幕数未满，更换关键词继续查询
-                keyword = keyword.replace(keywords[-1], "")
-                keywords.pop(-1)
+            if video.info["type"] == "movie" and "美剧字幕" in sub_name:
                 continue
 
-            break
-
-        # 第一个候选字幕没有双语
-        if len(sub_dict.items()) > 0 and list(sub_dict.items())[0][1]["lan"] < 8:
-            sub_dict = order_dict(
-                sorted(sub_dict.items(), key=lambda e: e[1]["lan"], reverse=True)
-            )
-        return sub_dict
+            a = one_box.find("a")
+            text = a.text
+            sub_url = ZimuzuDownloader.site_url + a.attrs["href"]
+            type_score = 0
+            type_score += ("英文" in text) * 1
+            type_score += ("繁体" in text) * 2
+            type_score += ("简体" in text) * 4
+            type_score += ("中英" in text) * 8
+            subs.append((sub_name, type_score, sub_url))
+        return subs
 
-    def download_file(self, file_name, sub_url, session=None):
-
-        s = requests.session()
-        header = Downloader.header.copy()
-        r = s.get(sub_url, headers=Downloader.header)
-        bs_obj = BeautifulSoup(r.text, "html.parser")
+    @classmethod
+    @metrics.timed("zimuzu.parse")
+    def _parse_subtitle_page(cls, html):
+        """
+        return:
+            ajax_url: str, url to get subtitle detail
+            referer: str
+        """
+        bs_obj = BeautifulSoup(html, "html.parser")
         a = bs_obj.find("div", {"class": "subtitle-links"}).a
         download_link = a.attrs["href"]
-        header["Referer"] = download_link
-        ajax_url = "http://got002.com/api/v1/static/subtitle/detail?"
-        ajax_url += download_link.split("?")[-1]
-        r = s.get(ajax_url, headers=header)
-        json_obj = json.loads(r.text)
-        download_link = json_obj["data"]["info"]["file"]
+        ajax_url = ZimuzuDownloader.ajax_url + download_link.split("?")[-1]
+        return ajax_url, download_link
 
-        try:
-            with closing(requests.get(download_link, stream=True)) as response:
-                chunk_size = 1024  # 单次请求最大值
-                if response.headers.get("content-length"):
-                    # 内容体总大小
-                    content_size = int(response.headers["content-length"])
-                    bar = ProgressBar("Get", file_name.strip(), content_size)
-                    sub_data_bytes = b""
-                    for data in response.iter_content(chunk_size=chunk_size):
-                        sub_data_bytes += data
-                        bar.refresh(len(sub_data_bytes))
-                else:
-                    bar = ProgressBar("Get", file_name.strip())
-                    sub_data_bytes = b""
-                    for data in response.iter_content(chunk_size=chunk_size):
-                        sub_data_bytes += data
-                        bar.point_wait()
-                    bar.point_wait(end=True)
-            # sub_data_bytes = requests.get(download_link, timeout=10).content
-        except requests.Timeout:
-            return None, None
+    @classmethod
+    @metrics.timed("zimuzu.parse")
+    def _parse_detail(cls, text):
+        json_obj = json.loads(text)
+        return json_obj["data"]["info"]["file"]
+
+    @classmethod
+    def _guess_datatype(cls, download_link, file_name):
         if "rar" in download_link:
             datatype = ".rar"
         elif "zip" in download_link:
@@ -132,5 +96,181 @@ class ZimuzuDownloader(Downloader):
                 datatype = ".7z"
             else:
                 datatype = "Unknown"
+        return datatype
+
+    @classmethod
+    def _is_subtitle_page(cls, link):
+        # 搜索结果中的字幕页，下载链接需解析字幕页得到
+        return link.startswith(ZimuzuDownloader.site_url)
+
+    @classmethod
+    def _iter_keywords(cls, video):
+        # 字幕数未满时，逐个去除末尾关键词继续查询
+        keywords = Downloader.get_keywords(video)
+        keyword = " ".join(keywords)
+        while True:
+            yield keyword
+            if len(keywords) <= 1:
+                break
+            keyword = keyword.replace(keywords[-1], "")
+            keywords.pop(-1)
+
+    @classmethod
+    def _add_subs(cls, sub_dict, subs, sub_num):
+        """
+        add search results to sub_dict
+        return:
+            full: bool, True if sub_num reached
+        """
+        for sub_name, type_score, sub_url in subs:
+            sub_dict[sub_name] = {
+                "lan": type_score,
+                "link": sub_url,
+                "session": None,
+            }
+            if len(sub_dict) >= sub_num:
+                return True
+        return False
+
+    @classmethod
+    def _sort_subs(cls, sub_dict):
+        # 第一个候选字幕没有双语
+        if len(sub_dict.items()) > 0 and list(sub_dict.items())[0][1]["lan"] < 8:
+            sub_dict = order_dict(
+                sorted(sub_dict.items(), key=lambda e: e[1]["lan"], reverse=True)
+            )
+        return sub_dict
+
+    @classmethod
+    def _search(cls, session, keyword):
+        r = session.get(
+            ZimuzuDownloader.search_url.format(keyword),
+            headers=Downloader.header,
+            timeout=10,
+        )
+        return r.text
+
+    @classmethod
+    async def _asearch(cls, client, keyword):
+        return await cls.aget_text(client, ZimuzuDownloader.search_url.format(keyword))
+
+    @metrics.timed("zimuzu.get_subtitles")
+    def get_subtitles(self, video, sub_num=5):
+
+        print("Searching ZIMUZU...", end="\r")
+
+        sub_dict = order_dict()
+        s = self.get_session()
+        for keyword in self._iter_keywords(video):
+            # 当前关键字查询
+            subs = self.get_parsed(
+                self.search_cache_key(keyword),
+                partial(self._search, s, keyword),
+                partial(self._parse_search_page, video=video),
+            )
+            if self._add_subs(sub_dict, subs, sub_num):
+                break
+
+        return self._sort_subs(sub_dict)
+
+    def _resolve(self, session, sub_url):
+        header = Downloader.header.copy()
+        r = session.get(sub_url, headers=Downloader.header)
+        ajax_url, header["Referer"] = self._parse_subtitle_page(r.text)
+        r = session.get(ajax_url, headers=header)
+        return self._parse_detail(r.text)
+
+    def resolve_link(self, sub_url, session=None):
+        if not self._is_subtitle_page(sub_url):
+            return sub_url
+        try:
+            return self._resolve(self.get_session(), sub_url)
+        except requests.Timeout:
+            return sub_url
+
+    @metrics.timed("zimuzu.download_file")
+    def download_file(self, file_name, sub_url, session=None, cancel=None):
+
+        s = self.get_session()
+        download_link = sub_url
+        if self._is_subtitle_page(sub_url):
+            download_link = self._resolve(s, sub_url)
+
+        try:
+            with closing(s.get(download_link, stream=True)) as response:
+                content_type, sub_data_bytes = read_response(
+                    response,
+                    file_name,
+                    max_size=self.max_download_size,
+                    cancel=cancel,
+                )
+        except requests.Timeout:
+            return None, None, "false"
+        except DownloadAborted as e:
+            return None, None, str(e)
+
+        datatype, error = self.check_content(
+            content_type, self._guess_datatype(download_link, file_name)
+        )
+        if error:
+            return None, None, error
+        return datatype, sub_data_bytes, ""
+
+    @metrics.timed("zimuzu.aget_subtitles")
+    async def aget_subtitles(self, video, sub_num=5, client=None):
+
+        sub_dict = order_dict()
+        async with self.aclient(client) as client:
+            for keyword in self._iter_keywords(video):
+                subs = await self.aget_parsed(
+                    self.search_cache_key(keyword),
+                    partial(self._asearch, client, keyword),
+                    partial(self._parse_search_page, video=video),
+                )
+                if self._add_subs(sub_dict, subs, sub_num):
+                    break
+
+        return self._sort_subs(sub_dict)
+
+    async def _aresolve(self, client, sub_url):
+        html = await self.aget_text(client, sub_url)
+        ajax_url, referer = self._parse_subtitle_page(html)
+        html = await self.aget_text(client, ajax_url, headers={"Referer": referer})
+        return self._parse_detail(html)
+
+    async def aresolve_link(self, sub_url, session=None, client=None):
+        if not self._is_subtitle_page(sub_url):
+            return sub_url
+        async with self.aclient(client) as client:
+            try:
+                return await self._aresolve(client, sub_url)
+            except asyncio.TimeoutError:
+                return sub_url
+
+    @metrics.timed("zimuzu.adownload_file")
+    async def adownload_file(self, file_name, sub_url, session=None, client=None):
+
+        async with self.aclient(client) as client:
+            download_link = sub_url
+            if self._is_subtitle_page(sub_url):
+                download_link = await self._aresolve(client, sub_url)
+
+            async def download():
+                async with client.get(download_link) as response:
+                    return await aread_response(
+                        response, max_size=self.max_download_size
+                    )
+
+            try:
+                content_type, sub_data_bytes = await self.aretry(download)
+            except asyncio.TimeoutError:
+                return None, None, "false"
+            except DownloadAborted as e:
+                return None, None, str(e)
 
+        datatype, error = self.check_content(
+            content_type, self._guess_datatype(download_link, file_name)
+        )
+        if error:
+            return None, None, error
         return datatype, sub_data_bytes, ""
@@ -0,0 +1,152 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import threading
+from os import path
+
+from getsub.cache import default_cache_dir, connect
+
+
+class LibraryIndex:
+    """
+    视频库扫描索引，记录目录修改时间和每个视频的处理结果
+    定时运行时跳过未修改的目录，没有结果的视频按指数退避重试，
+    记录时可指定下次重试时间，例如没有搜索结果时使用 NegativeCache 的下次搜索时间
+
+    params:
+        cache_dir: str, directory of the database, default_cache_dir() if empty
+        backoff: int, seconds to wait before retrying a video without results,
+                 doubled after every attempt
+        max_backoff: int, maximum seconds to wait
+    """
+
+    db_name = "index.sqlite3"
+
+    DONE = "done"  # subtitle downloaded or already exists
+    NO_RESULT = "no_result"  # no search results or no match, retried with backoff
+    FAILED = "failed"  # other errors, retried next run
+
+    def __init__(self, cache_dir="", backoff=6 * 3600, max_backoff=7 * 24 * 3600):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = connect(path.join(self.cache_dir, LibraryIndex.db_name))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS dirs ("
+                "path TEXT PRIMARY KEY, mtime REAL, videos TEXT, sub_dirs TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS videos ("
+                "path TEXT PRIMARY KEY, dir TEXT, status TEXT, "
+                "attempts INTEGER, last_attempt REAL, next_attempt REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS videos_dir ON videos (dir)")
+            self._conn.commit()
+        return self._conn
+
+    def get_dir(self, dir_path, mtime):
+        """
+        return:
+            listing: tuple, (video_names, sub_dirs) recorded for the directory,
+                     None if not recorded or modified since
+        """
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT mtime, videos, sub_dirs FROM dirs WHERE path = ?",
+                    (dir_path,),
+                )
+                .fetchone()
+            )
+        if row is None or row[0] != mtime:
+            return None
+        return json.loads(row[1]), json.loads(row[2])
+
+    def set_dir(self, dir_path, mtime, video_names, sub_dirs):
+        """
+        记录目录内容，目录有变化时之前成功的视频需重新检查字幕是否存在
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                (dir_path, mtime, json.dumps(video_names), json.dumps(sub_dirs)),
+            )
+            conn.execute(
+                "DELETE FROM videos WHERE dir = ? AND status = ?",
+                (dir_path, LibraryIndex.DONE),
+            )
+            conn.commit()
+
+    def is_due(self, video_path, now=None):
+        """
+        return:
+            due: bool, False if the video is done or waiting for backoff
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT status, next_attempt FROM videos WHERE path = ?",
+                    (video_path,),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return True
+        status, next_attempt = row
+        if status == LibraryIndex.DONE:
+            return False
+        if status == LibraryIndex.NO_RESULT:
+            return next_attempt is None or now >= next_attempt
+        return True
+
+    def record(self, video_path, status, next_attempt=None):
+        """
+        记录视频处理结果
+
+        params:
+            video_path: str
+            status: str, LibraryIndex.DONE, NO_RESULT or FAILED
+            next_attempt: float, timestamp to retry a NO_RESULT video,
+                          the backoff of the index is used if None
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT status, attempts FROM videos WHERE path = ?", (video_path,)
+            ).fetchone()
+            attempts = row[1] + 1 if row is not None and row[0] == status else 1
+            if status == LibraryIndex.NO_RESULT and next_attempt is None:
+                wait = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+                next_attempt = now + wait
+            conn.execute(
+                "INSERT OR REPLACE INTO videos (path, dir, status, attempts, "
+                "last_attempt, next_attempt) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    video_path,
+                    path.dirname(video_path),
+                    status,
+                    attempts,
+                    now,
+                    next_attempt,
+                ),
+            )
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
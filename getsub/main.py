@@ -2,19 +2,196 @@
 
 import os
 import sys
+import json
+import time
+import asyncio
 import rarfile
 import argparse
+import threading
+import contextvars
 from os import path
+from functools import partial
+from contextlib import contextmanager, nullcontext
+from itertools import groupby
 from collections import OrderedDict
 from traceback import format_exc
-
-from requests import exceptions
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from getsub.__version__ import __version__
-from getsub.constants import SUB_FORMATS, VIDEO_FORMATS, ARCHIVE_TYPES
+from getsub.cache import PageCache, NegativeCache, ArchiveStore
+from getsub.index import LibraryIndex
+from getsub.metrics import metrics, MetricsServer, StatsdExporter
+from getsub.constants import SUB_FORMATS, VIDEO_EXTENSIONS, ARCHIVE_TYPES
 from getsub.downloader import DownloaderManager
-from getsub.util import choose_archive, choose_subtitle, get_file_list, guess_subtitle
-from getsub.models import Video
+from getsub.downloader.downloader import Downloader, NETWORK_ERRORS
+from getsub.util import choose_archive, choose_subtitle, guess_subtitle, ArchiveIndex
+from getsub.util import assign_subtitles
+from getsub.util import GroupedOutput, SharedResults, write_data, guessit_cache
+from getsub.models import Video, plan_batches
+from getsub.scanner import LibraryScanner
+from getsub.watch import WatchDaemon, new_watcher
+
+
+class SearchResults(OrderedDict):
+    """
+    搜索结果，有站点搜索出错或超时时 complete 为 False
+    """
+
+    complete = True
+
+
+class DownloadPrefetcher:
+    """
+    自动模式下解压当前字幕包时，提前下载排在其后的 size 个候选字幕包，
+    找到字幕后取消未完成的下载
+    下载结果不保存至 ArchiveStore，由取用结果的调用方保存，取消或未使用的字幕包不保存
+
+    params:
+        download: callable, GetSubtitles.download_result for get,
+                  GetSubtitles.adownload_result for aget
+        size: int, number of candidates downloaded ahead
+        client: aiohttp.ClientSession used by aget
+    """
+
+    def __init__(self, download, size, client=None):
+        self.download = download
+        self.size = size
+        self.client = client
+        self.cancel = threading.Event()
+        self._futures = dict()  # {name: Future or asyncio.Task}
+        self._executor = None
+
+    def _download(self, name, result):
+        # 下载进度暂存，取用结果时再打印，被取消的下载不输出
+        output = sys.stdout
+        if not isinstance(output, GroupedOutput):
+            return "", self._download_result(name, result)
+        with output.capture() as buff:
+            downloaded = self._download_result(name, result)
+        return buff.getvalue(), downloaded
+
+    def _download_result(self, name, result):
+        return self.download(
+            name, result["link"], result["session"], cancel=self.cancel, store=False
+        )
+
+    async def _adownload(self, name, result):
+        downloaded = await self.download(
+            name, result["link"], result["session"], client=self.client, store=False
+        )
+        return "", downloaded
+
+    def _start_thread(self, name, result):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size + 1)
+        return self._executor.submit(
+            contextvars.copy_context().run, self._download, name, result
+        )
+
+    def _start_task(self, name, result):
+        return asyncio.ensure_future(self._adownload(name, result))
+
+    def _submit(self, sub_dict, names, start):
+        for one in names:
+            if one not in self._futures:
+                self._futures[one] = start(one, sub_dict[one])
+
+    def ahead(self, sub_dict, name):
+        """ 开始下载 name 之后的 size 个候选字幕包，在解压 name 之前调用 """
+        if asyncio.iscoroutinefunction(self.download):
+            start = self._start_task
+        else:
+            start = self._start_thread
+        names = list(sub_dict.keys())
+        index = names.index(name)
+        self._submit(sub_dict, names[index + 1 : index + self.size + 1], start)
+
+    def get(self, sub_dict, name):
+        """
+        下载 name，已提前开始下载时等待其完成
+
+        return:
+            同 GetSubtitles.download_result，字幕包未保存时 digest 为 None
+        """
+        self._submit(sub_dict, [name], self._start_thread)
+        text, downloaded = self._futures.pop(name).result()
+        sys.stdout.write(text)
+        return downloaded
+
+    async def aget(self, sub_dict, name):
+        """ get 的异步版本 """
+        self._submit(sub_dict, [name], self._start_task)
+        _, downloaded = await self._futures.pop(name)
+        return downloaded
+
+    def close(self):
+        """ 取消未完成的下载 """
+        self.cancel.set()
+        for future in self._futures.values():
+            if future.done() and not future.cancelled():
+                future.exception()  # results are discarded, errors too
+            future.cancel()
+        self._futures.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class PendingVideos:
+    """
+    本次运行中尚未开始处理的视频，分发字幕包时从中查找同一季的其他剧集
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()  # {video path: Video}
+        self._done = dict()  # {video path: archive name}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(video):
+        return path.join(video.path, video.name + video.type)
+
+    def add(self, video):
+        with self._lock:
+            if PendingVideos.key(video) not in self._done:
+                self._pending[PendingVideos.key(video)] = video
+
+    def start(self, video):
+        """
+        开始处理视频，之后不再分配字幕
+
+        return:
+            archive: str, name of the archive the subtitle was extracted from,
+                     None if the video needs processing
+        """
+        with self._lock:
+            self._pending.pop(PendingVideos.key(video), None)
+            return self._done.get(PendingVideos.key(video))
+
+    def same_season(self, video):
+        """
+        return:
+            videos: list of Video, pending videos of the same show and season
+        """
+        key = video.batch_key
+        if key is None:
+            return []
+        with self._lock:
+            videos = list(self._pending.values())
+        return [one for one in videos if one.batch_key == key]
+
+    def claim(self, video, archive):
+        """
+        将视频标记为已由 archive 完成
+
+        return:
+            claimed: bool, False if the video has started processing
+        """
+        with self._lock:
+            if self._pending.pop(PendingVideos.key(video), None) is None:
+                return False
+            self._done[PendingVideos.key(video)] = archive
+            return True
 
 
 class GetSubtitles(object):
@@ -31,6 +208,21 @@ class GetSubtitles(object):
         sub_num,
         downloader,
         sub_path,
+        jobs=1,
+        parallel_search=False,
+        search_timeout=None,
+        cache_dir="",
+        no_cache=False,
+        refresh=False,
+        pool_size=None,
+        follow_symlinks=False,
+        scan_workers=1,
+        index=False,
+        max_size=None,
+        prefetch=0,
+        archive_cache_size=256,
+        fan_out=False,
+        negative_cache=False,
     ):
         self.arg_name = name
         self.both = both
@@ -42,8 +234,16 @@ class GetSubtitles(object):
             self.sub_num = int(sub_num)
         self.plex = plex
         self.debug = debug
-        self.s_error = ""
-        self.f_error = ""
+        self.jobs = max(int(jobs or 1), 1)
+        if self.jobs > 1 and (self.query or self.single):
+            print("query/single mode is interactive, jobs is set to 1.")
+            self.jobs = 1
+        self.parallel_search = parallel_search
+        # subtitles are chosen by hand in single mode, one video at a time
+        self.pending = PendingVideos() if fan_out and not self.single else None
+        # query mode chooses candidates one by one, nothing to download ahead
+        self.prefetch = 0 if self.query else max(int(prefetch or 0), 0)
+        self.search_timeout = float(search_timeout) if search_timeout else None
         if not downloader:
             self.downloader = DownloaderManager.downloaders
         else:
@@ -56,6 +256,40 @@ class GetSubtitles(object):
                 )
                 sys.exit(1)
             self.downloader = [DownloaderManager.get_downloader_by_name(downloader)]
+        self.cache = PageCache(cache_dir, enabled=not no_cache, refresh=refresh)
+        # 一次性运行默认不跳过之前没有结果的视频，使用索引或监视目录时启用
+        self.negative = NegativeCache(
+            cache_dir,
+            enabled=(negative_cache or index) and not no_cache,
+            refresh=refresh,
+        )
+        self.archives = ArchiveStore(
+            cache_dir,
+            max_size=int(float(archive_cache_size) * 1024 * 1024),
+            enabled=not no_cache,
+            refresh=refresh,
+        )
+        self._resolved = dict()  # {candidate link: download link}
+        # 同一下载链接或字幕包同时只由一个线程下载、列出
+        self._archive_locks = dict()
+        self._archive_locks_lock = threading.Lock()
+        self._aarchive_locks = dict()
+        # keep one connection per concurrent video by default
+        pool_size = int(pool_size) if pool_size else max(self.jobs, 10)
+        if pool_size != Downloader.sessions.pool_maxsize:
+            Downloader.sessions.configure(pool_maxsize=pool_size)
+        for one_downloader in self.downloader:
+            one_downloader.cache = self.cache
+        if max_size is not None:
+            Downloader.max_download_size = int(float(max_size) * 1024 * 1024)
+        guessit_cache.store = self.cache if not no_cache else None
+        self.index = LibraryIndex(cache_dir) if index else None
+        self.scanner = LibraryScanner(
+            follow_symlinks=follow_symlinks,
+            workers=scan_workers,
+            # replacing subtitles needs a full scan
+            index=self.index if not self.over else None,
+        )
         self.failed_list = []  # [{'name', 'path', 'error', 'trace_back'}
         self.sub_identifier = "" if not self.plex else ".zh"
         self.sub_store_path = sub_path.replace('"', "")
@@ -77,70 +311,246 @@ class GetSubtitles(object):
             videos: list of "Video" objects
         """
 
-        raw_path = raw_path.replace('"', "")
+        return list(self.iter_videos(raw_path))
 
-        videos = []
+    def iter_videos(self, raw_path):
+        """
+        get_videos 的生成器版本，扫描目录时边扫描边返回视频
+        """
+
+        raw_path = raw_path.replace('"', "")
 
         if path.isdir(raw_path):  # directory
-            for root, dirs, files in os.walk(raw_path):
-                for file in files:
-                    v_type = path.splitext(file)[-1]
-                    if v_type not in VIDEO_FORMATS:
+            for root, video_names, file_names in self.scanner.scan(raw_path):
+                for file in video_names:
+                    video_path = path.join(root, file)
+                    if self.scanner.index is not None and not self.index.is_due(
+                        video_path
+                    ):
                         continue
                     video = Video(
-                        path.join(root, file),
+                        video_path,
                         sub_store_path=self.sub_store_path,
                         identifier=self.sub_identifier,
                     )
-                    videos.append(video)
+                    if not self.sub_store_path and file_names is not None:
+                        # 字幕与视频在同一目录，直接使用扫描结果
+                        video.has_subtitle = any(
+                            video.name + self.sub_identifier + sub_type in file_names
+                            for sub_type in SUB_FORMATS
+                        )
+                    yield video
         elif path.isabs(raw_path):  # video's absolute path
             v_type = path.splitext(raw_path)[-1]
-            if v_type in VIDEO_FORMATS:
-                video = Video(
+            if v_type.lower() in VIDEO_EXTENSIONS:
+                yield Video(
                     raw_path,
                     sub_store_path=self.sub_store_path,
                     identifier=self.sub_identifier,
                 )
-                videos.append(video)
         else:  # single video name, no path
             s_path = os.getcwd() if not self.sub_store_path else self.sub_store_path
-            video = Video(
-                raw_path, sub_store_path=s_path, identifier=self.sub_identifier
-            )
-            videos.append(video)
-
-        return videos
+            yield Video(raw_path, sub_store_path=s_path, identifier=self.sub_identifier)
 
+    @metrics.timed("search")
     def get_search_results(self, video):
-        results = OrderedDict()
+        if self.parallel_search and len(self.downloader) > 1:
+            return self.get_search_results_parallel(video)
+
+        results = SearchResults()
         for i, downloader in enumerate(self.downloader):
             try:
                 result = downloader.get_subtitles(video, sub_num=self.sub_num)
                 results.update(result)
             except ValueError as e:
                 print("error: " + str(e))
-            except (exceptions.Timeout, exceptions.ConnectionError):
+                results.complete = False
+            except NETWORK_ERRORS:
                 print("connect timeout, search next site.")
+                results.complete = False
                 if i == (len(self.downloader) - 1):
                     print("PLEASE CHECK YOUR NETWORK STATUS")
                     sys.exit(0)
                 else:
                     continue
-            # TODO: search all sites or exit after collecting enough results
             if len(results) >= self.sub_num:
                 break
         return results
 
+    def _enough_results(self, collected):
+        # 有分数的字幕（zimuku）需分数大于 0 才计入
+        good = 0
+        for result in collected.values():
+            good += sum(1 for sub in result.values() if sub.get("score", 1) > 0)
+        return good >= self.sub_num
+
+    def get_search_results_parallel(self, video):
+        """
+        同时在所有下载器中搜索，收集足够的字幕或超过 search_timeout 后返回，
+        未完成的搜索被取消，结果按下载器顺序合并
+
+        params:
+            video: Video object
+        return:
+            results: OrderedDict, check downloader.py
+        """
+
+        collected = dict()  # {downloader index: result}
+        failed = 0
+        executor = ThreadPoolExecutor(max_workers=len(self.downloader))
+        # 搜索线程沿用调用方的上下文，输出仍写入所在视频的分组
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run,
+                downloader.get_subtitles,
+                video,
+                sub_num=self.sub_num,
+            ): i
+            for i, downloader in enumerate(self.downloader)
+        }
+        try:
+            for future in as_completed(futures, timeout=self.search_timeout):
+                if not self._collect_result(collected, futures[future], future):
+                    failed += 1
+                if self._enough_results(collected):
+                    break
+        except FutureTimeoutError:
+            print("search timeout, use results collected.")
+        finally:
+            # 未开始的搜索直接取消，已开始的搜索结果被丢弃
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        return self._merge_results(collected, failed)
+
+    def _collect_result(self, collected, i, future):
+        """
+        收集第 i 个下载器的搜索结果，网络异常时返回 False
+        """
+        try:
+            collected[i] = future.result()
+        except ValueError as e:
+            print("error: " + str(e))
+        except NETWORK_ERRORS:
+            print("connect timeout: " + self.downloader[i].name)
+            return False
+        return True
+
+    def _merge_results(self, collected, failed):
+        if failed == len(self.downloader):
+            print("PLEASE CHECK YOUR NETWORK STATUS")
+            sys.exit(0)
+
+        results = SearchResults()
+        for i in sorted(collected.keys()):
+            results.update(collected[i])
+        results.complete = len(collected) == len(self.downloader)
+        return results
+
+    @metrics.timed("search")
+    async def aget_search_results(self, video, client):
+        """
+        get_search_results 的异步版本
+
+        params:
+            video: Video object
+            client: aiohttp.ClientSession
+        return:
+            results: OrderedDict, check downloader.py
+        """
+
+        if not (self.parallel_search and len(self.downloader) > 1):
+            results = SearchResults()
+            for i, downloader in enumerate(self.downloader):
+                try:
+                    result = await downloader.aget_subtitles(
+                        video, sub_num=self.sub_num, client=client
+                    )
+                    results.update(result)
+                except ValueError as e:
+                    print("error: " + str(e))
+                    results.complete = False
+                except NETWORK_ERRORS:
+                    print("connect timeout, search next site.")
+                    results.complete = False
+                    if i == (len(self.downloader) - 1):
+                        print("PLEASE CHECK YOUR NETWORK STATUS")
+                        sys.exit(0)
+                    else:
+                        continue
+                if len(results) >= self.sub_num:
+                    break
+            return results
+
+        collected = dict()  # {downloader index: result}
+        failed = 0
+        tasks = {
+            asyncio.ensure_future(
+                downloader.aget_subtitles(video, sub_num=self.sub_num, client=client)
+            ): i
+            for i, downloader in enumerate(self.downloader)
+        }
+        pending = set(tasks.keys())
+        loop = asyncio.get_event_loop()
+        if self.search_timeout:
+            deadline = loop.time() + self.search_timeout
+        try:
+            while pending:
+                timeout = deadline - loop.time() if self.search_timeout else None
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    print("search timeout, use results collected.")
+                    break
+                for task in done:
+                    if not self._collect_result(collected, tasks[task], task):
+                        failed += 1
+                if self._enough_results(collected):
+                    break
+        finally:
+            # 取消未完成的搜索
+            for task in pending:
+                task.cancel()
+
+        return self._merge_results(collected, failed)
+
+    def _record_search(self, video, results):
+        """
+        所有站点都搜索完成且没有结果时记录至 negative 缓存，有结果时删除记录
+        """
+        key = NegativeCache.key(video.info)
+        if results:
+            self.negative.remove(key)
+        elif results.complete:
+            self.negative.add(key)
+
+    def _check_negative(self, video):
+        """
+        return:
+            error: str, not empty if the video is in the negative cache
+        """
+        next_check = self.negative.next_check(NegativeCache.key(video.info))
+        if next_check is None:
+            return ""
+        metrics.incr("cache.negative.hits")
+        until = time.strftime("%Y-%m-%d %H:%M", time.localtime(next_check))
+        print("skipped (negative cache until %s), add --refresh to search now." % until)
+        return "no search results (cached, next check after %s). " % until
+
     def process_archive(
-        self, video, archive_data, datatype,
+        self, video, archive_data, datatype, digest=None, archive_name="",
     ):
         """
         解压字幕包，返回解压字幕名列表
 
         params:
             video: Video object
-            archive_data: binary archive data
+            archive_data: binary archive data, or a binary file
             datatype: str, archive type
+            digest: str, digest in ArchiveStore, the saved manifest is used
+            archive_name: str, name of the archive in search results
         return:
             error: str, error message
             extract_subs: list, [<subname, subtype>, ...]
@@ -152,20 +562,53 @@ class GetSubtitles(object):
             error = "unsupported file type " + datatype
             return error, []
 
-        sub_lists_dict = get_file_list(archive_data, datatype)
+        # 同一字幕包只列出一次，其余线程等待保存的列表
+        with self._archive_lock(digest):
+            manifest = self.archives.get_manifest(digest)
+            index = ArchiveIndex(archive_data, datatype, entries=manifest)
+            if manifest is None:
+                try:
+                    self.archives.set_manifest(digest, index.entries)
+                except Exception:
+                    index.close()
+                    raise
+        with index:
+            return self._extract_archive(video, index, archive_name)
+
+    def _extract_archive(self, video, index, archive_name=""):
+        """
+        从压缩包索引中选择字幕并解压，返回值同 process_archive
+        """
+
+        error = ""
+        sub_names = list(OrderedDict.fromkeys(index.namelist()))
 
-        if len(sub_lists_dict) == 0:
+        if len(sub_names) == 0:
             error = "no subtitle in this archive"
             return error, []
 
         # get subtitles to extract
         if not self.single:
-            success, sub_name = guess_subtitle(list(sub_lists_dict.keys()), video.info)
+            success, sub_name = guess_subtitle(sub_names, video.info)
             if not success:
                 error = "no guess result in auto mode"
                 return error, []
         else:
-            sub_name = choose_subtitle(list(sub_lists_dict.keys()))
+            sub_name = choose_subtitle(sub_names)
+
+        extract_subs = self._pick_subtitles(sub_names, sub_name)
+        self._write_subtitles(video, index, extract_subs)
+        if self.pending is not None:
+            self._fan_out(video, index, sub_names, extract_subs, archive_name)
+
+        return error, extract_subs
+
+    def _pick_subtitles(self, sub_names, sub_name):
+        """
+        return:
+            extract_subs: list, [<subname, subtype>, ...], with the other type
+                          of the same subtitle if self.both
+        """
 
         # build new names
         sub_title, sub_type = path.splitext(sub_name)
@@ -174,12 +617,15 @@ class GetSubtitles(object):
             another_sub_type = ".srt" if sub_type == ".ass" else ".ass"
             another_sub = sub_name.replace(sub_type, another_sub_type)
             another_sub = path.basename(another_sub)
-            for subname in list(sub_lists_dict.keys()):
+            for subname in sub_names:
                 if another_sub in subname:
                     extract_subs.append([subname, another_sub_type])
                     break
             if len(extract_subs) == 1:
                 print("no %s subtitles in this archive" % another_sub_type)
+        return extract_subs
+
+    def _write_subtitles(self, video, index, extract_subs):
 
         # delete existed subtitles
         video.delete_existed_subtitles()
@@ -188,11 +634,32 @@ class GetSubtitles(object):
         for one_sub, one_sub_type in extract_subs:
             sub_new_name = video.name + video.sub_identifier + one_sub_type
             extract_path = path.join(video.sub_store_path, sub_new_name)
-            with open(extract_path, "wb") as sub:
-                file_handler = sub_lists_dict[one_sub]
-                sub.write(file_handler.read(one_sub))
+            data = index.read(one_sub)
+            with metrics.span("write"), open(extract_path, "wb") as sub:
+                sub.write(data)
+        video.has_subtitle = True
 
-        return error, extract_subs
+    def _fan_out(self, video, index, sub_names, extract_subs, archive_name):
+        """
+        字幕包中同一季其他剧集的字幕一次分配给待处理的视频并写入，
+        这些视频不再搜索和下载
+        """
+
+        videos = self.pending.same_season(video)
+        if not videos:
+            return
+        taken = [one_sub for one_sub, _ in extract_subs]
+        assigned = assign_subtitles(sub_names, [one.info for one in videos], taken)
+        for i, sub_name in sorted(assigned.items()):
+            other = videos[i]
+            if not self.pending.claim(other, archive_name):
+                continue
+            other_subs = self._pick_subtitles(sub_names, sub_name)
+            self._write_subtitles(other, index, other_subs)
+            # 这些视频之后在 _check_video 中跳过，不再经过 _check_result
+            metrics.incr("videos.success")
+            self._record(other, None)
+            print("\nExtracted for %s: %s" % (other.name, sub_name.split("/")[-1]))
 
     def process_subtitle(self, video, sub_data, datatype):
 
@@ -202,26 +669,148 @@ class GetSubtitles(object):
         # save subtitle
         sub_name = video.name + video.sub_identifier + datatype
         extract_path = path.join(video.sub_store_path, sub_name)
-        with open(extract_path, "wb") as sub:
-            sub.write(sub_data)
+        with metrics.span("write"), open(extract_path, "wb") as sub:
+            write_data(sub, sub_data)
 
         extract_subs = [[sub_name, datatype]]
         return "", extract_subs
 
+    def _get_downloader(self, chosen_sub):
+        choice_prefix = chosen_sub[: chosen_sub.find("]") + 1]
+        return DownloaderManager.get_downloader_by_choice_prefix(choice_prefix)
+
+    def _archive_lock(self, key):
+        """ 下载链接或字幕包哈希对应的锁，key 为 None 时不加锁 """
+        if key is None or not self.archives.enabled:
+            return nullcontext()
+        with self._archive_locks_lock:
+            return self._archive_locks.setdefault(key, threading.Lock())
+
+    def _aarchive_lock(self, key):
+        if key is None or not self.archives.enabled:
+            return asyncio.Lock()  # unshared, async nullcontext needs 3.10
+        if key not in self._aarchive_locks:
+            self._aarchive_locks[key] = asyncio.Lock()
+        return self._aarchive_locks[key]
+
+    def _use_stored(self, chosen_sub, link, stored):
+        digest, datatype, file = stored
+        self.archives.add_link(link, digest)
+        print("use saved archive of '%s'." % chosen_sub.strip())
+        return datatype, file, "", digest
+
+    def download_result(self, chosen_sub, link, session, cancel=None, store=True):
+        """
+        下载字幕包，已保存的字幕包直接读取，新下载的字幕包保存至 ArchiveStore，
+        同一季各集的候选链接不同，未保存的链接先解析出下载链接再查找
+
+        params:
+            chosen_sub: str, subtitle name in search results
+            link: str, 'link' of the search result
+            session: 'session' of the search result
+            cancel: threading.Event or None, check Downloader.download_file
+            store: bool, False to leave saving to the caller, see _store_result
+        return:
+            datatype: str, archive type or subtitle type
+            data: binary data downloaded, or the saved archive file,
+                  closed by process_download
+            error: str, error message
+            digest: str, digest in ArchiveStore, None if not saved
+        """
+
+        stored = self.archives.get(link)
+        if stored is not None:
+            return self._use_stored(chosen_sub, link, stored)
+
+        downloader = self._get_downloader(chosen_sub)
+        url = link
+        if self.archives.enabled:
+            url = self._resolved[link] = downloader.resolve_link(link, session)
+        with self._archive_lock(url):
+            stored = self.archives.get(url) if url != link else None
+            if stored is not None:
+                return self._use_stored(chosen_sub, link, stored)
+            datatype, data, error = downloader.download_file(
+                chosen_sub, url, session=session, cancel=cancel
+            )
+            if not store:
+                return datatype, data, error, None
+            return self._store_result(link, datatype, data, error)
+
+    async def adownload_result(
+        self, chosen_sub, link, session, client=None, store=True
+    ):
+        """
+        download_result 的异步版本
+        """
+
+        stored = self.archives.get(link)
+        if stored is not None:
+            return self._use_stored(chosen_sub, link, stored)
+
+        downloader = self._get_downloader(chosen_sub)
+        url = link
+        if self.archives.enabled:
+            url = await downloader.aresolve_link(link, session=session, client=client)
+            self._resolved[link] = url
+        async with self._aarchive_lock(url):
+            stored = self.archives.get(url) if url != link else None
+            if stored is not None:
+                return self._use_stored(chosen_sub, link, stored)
+            datatype, data, error = await downloader.adownload_file(
+                chosen_sub, url, session=session, client=client
+            )
+            if not store:
+                return datatype, data, error, None
+            return self._store_result(link, datatype, data, error)
+
+    def _store_result(self, link, datatype, data, error):
+        """ 保存下载的字幕包，候选链接和下载链接都指向它，返回值同 download_result """
+        digest = None
+        if not error and datatype in ARCHIVE_TYPES:
+            digest = self.archives.put(link, datatype, data)
+            url = self._resolved.get(link, link)
+            if url != link:
+                self.archives.add_link(url, digest)
+        return datatype, data, error, digest
+
     def process_result(self, video, chosen_sub, link, session):
 
         # download archive
-        choice_prefix = chosen_sub[: chosen_sub.find("]") + 1]
-        downloader = DownloaderManager.get_downloader_by_choice_prefix(choice_prefix)
-        datatype, data, error = downloader.download_file(
-            chosen_sub, link, session=session
-        )
+        datatype, data, error, digest = self.download_result(chosen_sub, link, session)
         if error:
             return error, []
 
+        return self.process_download(video, chosen_sub, datatype, data, digest)
+
+    def process_download(self, video, chosen_sub, datatype, data, digest=None):
+        """
+        处理下载的字幕包或字幕，处理后关闭文件
+
+        params:
+            video: Video object
+            chosen_sub: str, subtitle name in search results
+            datatype: str, archive type or subtitle type
+            data: binary data downloaded, or a binary file
+            digest: str, digest in ArchiveStore, None if not saved
+        return:
+            error: str, error message
+            extract_subs: list, [<subname, subtype>, ...]
+        """
+
+        try:
+            return self._process_download(video, chosen_sub, datatype, data, digest)
+        finally:
+            if hasattr(data, "close"):
+                data.close()
+
+    def _process_download(self, video, chosen_sub, datatype, data, digest):
+
         # process archive or subtitles downloaded
         if datatype in ARCHIVE_TYPES:
-            error, extract_subs = self.process_archive(video, data, datatype)
+            error, extract_subs = self.process_archive(
+                video, data, datatype, digest, chosen_sub
+            )
         elif datatype in SUB_FORMATS:
             error, extract_subs = self.process_subtitle(video, data, datatype)
         else:
@@ -246,8 +835,8 @@ class GetSubtitles(object):
         # save original archive
         if self.more and datatype in ARCHIVE_TYPES:
             archive_path = path.join(video.sub_store_path, chosen_sub + datatype)
-            with open(archive_path, "wb") as f:
-                f.write(data)
+            with metrics.span("write"), open(archive_path, "wb") as f:
+                write_data(f, data)
             print("save original file.")
 
         return "", extract_subs
@@ -256,85 +845,385 @@ class GetSubtitles(object):
 
         extract_subs = []
 
+        error = self._check_negative(video)
+        if error:
+            return error, []
+
         sub_dict = self.get_search_results(video)
+        self._record_search(video, sub_dict)
 
         if len(sub_dict) == 0:
             error = "no search results. "
             return error, []
 
+        prefetcher = None
+        if self.prefetch:
+            prefetcher = DownloadPrefetcher(self.download_result, self.prefetch)
+
         # 遍历字幕包直到有猜测字幕
-        while not extract_subs and len(sub_dict) > 0:
-            exit, chosen_sub = choose_archive(
-                sub_dict, sub_num=self.sub_num, query=self.query
-            )
-            if exit:
-                break
+        try:
+            while not extract_subs and len(sub_dict) > 0:
+                exit, chosen_sub = choose_archive(
+                    sub_dict, sub_num=self.sub_num, query=self.query
+                )
+                if exit:
+                    break
 
-            try:
-                error, extract_subs = self.process_result(
-                    video,
-                    chosen_sub,
-                    sub_dict[chosen_sub]["link"],
-                    sub_dict[chosen_sub]["session"],
+                try:
+                    if prefetcher is None:
+                        error, extract_subs = self.process_result(
+                            video,
+                            chosen_sub,
+                            sub_dict[chosen_sub]["link"],
+                            sub_dict[chosen_sub]["session"],
+                        )
+                    else:
+                        datatype, data, error, digest = prefetcher.get(
+                            sub_dict, chosen_sub
+                        )
+                        if not error:
+                            if digest is None:
+                                datatype, data, error, digest = self._store_result(
+                                    sub_dict[chosen_sub]["link"], datatype, data, error
+                                )
+                            # 解压当前字幕包时下载之后的候选
+                            prefetcher.ahead(sub_dict, chosen_sub)
+                            error, extract_subs = self.process_download(
+                                video, chosen_sub, datatype, data, digest
+                            )
+                    if error:
+                        print("error: " + error + "\n")
+                except Exception as e:
+                    print("error:" + str(e))
+                finally:
+                    sub_dict.pop(chosen_sub)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+
+        return "", extract_subs
+
+    async def aprocess_video(self, video, client):
+        """
+        process_video 的异步版本，解压字幕包在线程池中执行
+        """
+
+        extract_subs = []
+
+        error = self._check_negative(video)
+        if error:
+            return error, []
+
+        sub_dict = await self.aget_search_results(video, client)
+        self._record_search(video, sub_dict)
+
+        if len(sub_dict) == 0:
+            error = "no search results. "
+            return error, []
+
+        loop = asyncio.get_event_loop()
+        # 不提前下载时只下载当前候选
+        prefetcher = DownloadPrefetcher(self.adownload_result, self.prefetch, client)
+
+        # 遍历字幕包直到有猜测字幕
+        try:
+            while not extract_subs and len(sub_dict) > 0:
+                exit, chosen_sub = choose_archive(
+                    sub_dict, sub_num=self.sub_num, query=self.query
                 )
-                if error:
-                    print("error: " + error + "\n")
-            except Exception as e:
-                print("error:" + str(e))
-            finally:
-                sub_dict.pop(chosen_sub)
+                if exit:
+                    break
+
+                try:
+                    datatype, data, error, digest = await prefetcher.aget(
+                        sub_dict, chosen_sub
+                    )
+                    if not error:
+                        if digest is None:
+                            datatype, data, error, digest = self._store_result(
+                                sub_dict[chosen_sub]["link"], datatype, data, error
+                            )
+                        prefetcher.ahead(sub_dict, chosen_sub)
+                        # keep output of the executor in the same group
+                        func = partial(
+                            contextvars.copy_context().run,
+                            self.process_download,
+                            video,
+                            chosen_sub,
+                            datatype,
+                            data,
+                            digest,
+                        )
+                        error, extract_subs = await loop.run_in_executor(None, func)
+                    if error:
+                        print("error: " + error + "\n")
+                except Exception as e:
+                    print("error:" + str(e))
+                finally:
+                    sub_dict.pop(chosen_sub)
+        finally:
+            prefetcher.close()
 
         return "", extract_subs
 
-    def start(self):
+    def _check_video(self, video):
+        """
+        打印视频信息，返回是否需要下载字幕
+        """
+
+        print("\n- Video:", video.name)  # 打印当前视频及其路径
+        print("- Video Path:", video.path)
+        print("- Subtitles Store Path:", video.sub_store_path + "\n")
+        if self.pending is not None:
+            archive_name = self.pending.start(video)
+            if archive_name is not None:
+                print("subtitle already extracted from '%s'." % archive_name.strip())
+                return False
+        if video.has_subtitle and not self.over:
+            print("subtitle already exists, add '-o' to replace it.")
+            self._record(video, None)
+            return False
+        return True
+
+    def _check_result(self, video, error, extract_subs, s_error, f_error):
+        """
+        整理处理结果，返回失败信息，成功时返回 None
+        """
+
+        # no guessed subtitle in auto mode
+        if not extract_subs and not error:
+            s_error += " failed to guess one subtitle,"
+            s_error += "use '-q' to try query mode."
+
+        if s_error and not self.debug:
+            s_error += "add --debug to get more info of the error"
+
+        if not s_error:
+            metrics.incr("videos.success")
+            self._record(video, None)
+            return None
+
+        metrics.incr("videos.failed")
+        print("ERROR:" + s_error)
+        failed = {
+            "name": video.name,
+            "path": video.path,
+            "error": s_error,
+            "trace_back": f_error,
+        }
+        self._record(video, failed)
+        return failed
+
+    def _record(self, video, failed):
+        """
+        记录视频处理结果至索引，没有搜索结果或没有匹配字幕的视频延后重试
+        """
+
+        if self.index is None:
+            return
+        no_result = ("no search results", "failed to guess")
+        next_attempt = None
+        if failed is None:
+            status = LibraryIndex.DONE
+        elif any(error in failed["error"] for error in no_result):
+            status = LibraryIndex.NO_RESULT
+            if "no search results" in failed["error"]:
+                # 与 negative 缓存使用同一计划，索引到期时搜索不会再被跳过
+                next_attempt = self.negative.next_check(NegativeCache.key(video.info))
+        else:
+            status = LibraryIndex.FAILED
+        self.index.record(
+            path.join(video.path, video.name + video.type), status, next_attempt
+        )
+
+    def process_one_video(self, video):
+        """
+        处理单个视频，打印处理信息
+
+        params:
+            video: Video object
+        return:
+            failed: dict, {'name', 'path', 'error', 'trace_back'},
+                    None if succeeded or skipped
+        """
+
+        if not self._check_video(video):
+            return None
+
+        s_error, f_error = "", ""
+        try:
+            extract_subs, error = [], ""
+            error, extract_subs = self.process_video(video)
+            s_error = error
+        except rarfile.RarCannotExec:
+            s_error += "Unrar not installed?"
+        except Exception as e:
+            s_error += str(e) + ". "
+            f_error += format_exc()
+
+        return self._check_result(video, error, extract_subs, s_error, f_error)
+
+    async def aprocess_one_video(self, video, client):
+        """
+        process_one_video 的异步版本
+        """
+
+        if not self._check_video(video):
+            return None
+
+        s_error, f_error = "", ""
+        try:
+            extract_subs, error = [], ""
+            error, extract_subs = await self.aprocess_video(video, client)
+            s_error = error
+        except rarfile.RarCannotExec:
+            s_error += "Unrar not installed?"
+        except Exception as e:
+            s_error += str(e) + ". "
+            f_error += format_exc()
+
+        return self._check_result(video, error, extract_subs, s_error, f_error)
 
-        videos = self.get_videos(self.arg_name)
+    def _process_one_grouped(self, output, video, separator):
+        with output.group():
+            failed = self.process_one_video(video)
+            print(separator)
+        return failed
 
-        for i, video in enumerate(videos):
+    async def _aprocess_one_grouped(self, output, semaphore, client, video, separator):
+        async with semaphore:
+            with output.group() if output is not None else nullcontext():
+                failed = await self.aprocess_one_video(video, client)
+                print(separator)
+        return failed
 
-            # one_video, video_info = item
+    @contextmanager
+    def _grouped_output(self, enabled):
+        """
+        需要时将 sys.stdout 替换为 GroupedOutput，结束后恢复
+
+        params:
+            enabled: bool, False 时不替换，yield None
+        """
+
+        if not enabled:
+            yield None
+            return
+        output = GroupedOutput(sys.stdout)
+        sys.stdout = output
+        try:
+            yield output
+        finally:
+            sys.stdout = output.stream
+
+    def _start_batches(self):
+        """ 为下载器设置本次运行共享的搜索结果 """
+        batch = SharedResults()
+        for downloader in self.downloader:
+            downloader.batch = batch
 
-            self.s_error = ""
-            self.f_error = ""
+    def plan_videos(self, videos):
+        """
+        按剧集和季分组视频，为下载器设置本次运行共享的搜索结果
+
+        params:
+            videos: list of Video
+        return:
+            videos: list of Video, videos of the same batch are adjacent
+        """
 
-            print("\n- Video:", video.name)  # 打印当前视频及其路径
-            print("- Video Path:", video.path)
-            print("- Subtitles Store Path:", video.sub_store_path + "\n")
+        self._start_batches()
+        # videos with subtitles are skipped, no need to group them
+        skipped, pending = [], []
+        for video in videos:
             if video.has_subtitle and not self.over:
-                print("subtitle already exists, add '-o' to replace it.")
-                continue
+                skipped.append(video)
+            else:
+                pending.append(video)
+        batches = plan_batches(pending)
+        return skipped + [video for one_batch in batches for video in one_batch]
 
-            try:
-                extract_subs, error = [], ""
-                error, extract_subs = self.process_video(video)
-                self.s_error = error
-            except rarfile.RarCannotExec:
-                self.s_error += "Unrar not installed?"
-            except Exception as e:
-                self.s_error += str(e) + ". "
-                self.f_error += format_exc()
-
-            # no guessed subtitle in auto mode
-            if not extract_subs and not error:
-                self.s_error += " failed to guess one subtitle,"
-                self.s_error += "use '-q' to try query mode."
-
-            if self.s_error and not self.debug:
-                self.s_error += "add --debug to get more info of the error"
-
-            if self.s_error:
-                self.failed_list.append(
-                    {
-                        "name": video.name,
-                        "path": video.path,
-                        "error": self.s_error,
-                        "trace_back": self.f_error,
-                    }
+    def _register(self, videos):
+        """
+        分发字幕包时，同一目录的视频全部登记为待处理后再依次返回
+        """
+
+        if self.pending is None:
+            yield from videos
+            return
+        for _, group in groupby(videos, key=lambda video: video.path):
+            group = list(group)
+            for video in group:
+                # existing subtitles are kept unless replacing them
+                if self.over or not video.has_subtitle:
+                    self.pending.add(video)
+            yield from group
+
+    def _finish_batches(self):
+        for downloader in self.downloader:
+            if downloader.batch is not None:
+                downloader.batch.clear()
+            downloader.batch = None
+
+    def start(self):
+
+        since = metrics.snapshot()
+        # 扫描到的视频立即处理，同一目录下的剧集相邻，共享一次搜索
+        self._start_batches()
+        separator = "\n========================================================"
+        videos = []
+
+        # 并发处理时每个视频的输出缓存后整体打印，提前下载的输出在取用时打印
+        with self._grouped_output(self.jobs > 1 or self.prefetch) as output:
+            if self.jobs == 1:
+                results = []
+                for video in self._register(self.iter_videos(self.arg_name)):
+                    if videos:
+                        print(separator)
+                    videos.append(video)
+                    results.append(self.process_one_video(video))
+            else:
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    futures = []
+                    for video in self._register(self.iter_videos(self.arg_name)):
+                        videos.append(video)
+                        futures.append(
+                            executor.submit(
+                                self._process_one_grouped, output, video, separator
+                            )
+                        )
+                    results = [future.result() for future in futures]
+
+        self._finish_batches()
+        return self._summary(videos, results, since)
+
+    async def astart(self):
+        """
+        start 的异步版本，所有视频在同一事件循环中处理，同时处理的视频数为 jobs
+        """
+
+        since = metrics.snapshot()
+        videos = list(self._register(self.plan_videos(self.get_videos(self.arg_name))))
+        separator = "\n========================================================"
+
+        semaphore = asyncio.Semaphore(self.jobs)
+        with self._grouped_output(self.jobs > 1) as output:
+            async with Downloader.new_aclient() as client:
+                results = await asyncio.gather(
+                    *[
+                        self._aprocess_one_grouped(
+                            output, semaphore, client, video, separator
+                        )
+                        for video in videos
+                    ]
                 )
-                print("ERROR:" + self.s_error)
-            if i == len(videos) - 1:
-                break
-            print("\n========================================================")
+
+        self._finish_batches()
+        return self._summary(videos, results, since)
+
+    def _summary(self, videos, results, since=None):
+        # keep failed list in the same order as videos
+        self.failed_list.extend(r for r in results if r is not None)
 
         if len(self.failed_list):
             print("\n===============================", end="")
@@ -350,25 +1239,31 @@ class GetSubtitles(object):
             "\ntotal: %s  success: %s  fail: %s\n"
             % (len(videos), len(videos) - len(self.failed_list), len(self.failed_list),)
         )
+        # spans and counters of this run, see getsub.metrics
+        run_metrics = metrics.summary(since)
+        if self.debug:
+            print("guessit cache: %s\n" % guessit_cache.stats())
+            print("metrics: %s\n" % json.dumps(run_metrics, indent=2))
 
         return {
             "total": len(videos),
             "success": len(videos) - len(self.failed_list),
             "fail": len(self.failed_list),
             "fail_videos": self.failed_list,
+            "metrics": run_metrics,
         }
 
 
-def main():
+def build_arg_parser(prog="GetSubtitles", name_help=None):
 
     arg_parser = argparse.ArgumentParser(
-        prog="GetSubtitles",
+        prog=prog,
         epilog="getsub %s\n\n@guoyuhang" % (__version__),
         description="download subtitles easily",
         formatter_class=argparse.RawTextHelpFormatter,
     )
     arg_parser.add_argument(
-        "name", help="the video's name or full path or a dir with videos"
+        "name", help=name_help or "the video's name or full path or a dir with videos"
     )
     arg_parser.add_argument(
         "-p",
@@ -422,13 +1317,107 @@ def main():
         action="store_true",
         help="add .zh to the subtitle's name for plex to recognize",
     )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="number of videos to process at the same time",
+    )
+    arg_parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="process videos with asyncio, needs aiohttp",
+    )
+    arg_parser.add_argument(
+        "--pool-size",
+        action="store",
+        type=int,
+        help="maximum connections kept for one site, default max(jobs, 10)",
+    )
+    arg_parser.add_argument(
+        "--cache-dir",
+        action="store",
+        default="",
+        help="directory to save cached search pages",
+    )
+    arg_parser.add_argument(
+        "--no-cache", action="store_true", help="do not use cached search pages"
+    )
+    arg_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ignore cached search pages and cache new pages",
+    )
+    arg_parser.add_argument(
+        "--parallel-search",
+        action="store_true",
+        help="search all sites at the same time",
+    )
+    arg_parser.add_argument(
+        "--search-timeout",
+        action="store",
+        type=float,
+        help="seconds to wait for search results in parallel search mode",
+    )
 
-    args = arg_parser.parse_args()
+    arg_parser.add_argument(
+        "--follow-symlinks",
+        action="store_true",
+        help="enter symlinked directories when scanning",
+    )
+    arg_parser.add_argument(
+        "--scan-workers",
+        action="store",
+        type=int,
+        default=1,
+        help="number of threads to scan top-level directories",
+    )
 
-    if args.over:
-        print("\nThe script will replace the old subtitles if exist...\n")
+    arg_parser.add_argument(
+        "--index",
+        action="store_true",
+        help="skip unchanged directories and finished videos of previous runs",
+    )
+    arg_parser.add_argument(
+        "--negative-cache",
+        action="store_true",
+        help="skip videos without search results in previous runs for a while, "
+        "on with --index and watch",
+    )
+    arg_parser.add_argument(
+        "--max-size",
+        action="store",
+        type=float,
+        help="abort downloads larger than this many MB, default 64, 0 for no limit",
+    )
+    arg_parser.add_argument(
+        "--prefetch",
+        action="store",
+        type=int,
+        default=0,
+        help="number of next candidates downloaded while extracting one "
+        "in auto mode, default 0",
+    )
+    arg_parser.add_argument(
+        "--archive-cache-size",
+        action="store",
+        type=float,
+        default=256,
+        help="MB of downloaded archives saved for other episodes, 0 to disable",
+    )
+    arg_parser.add_argument(
+        "--fan-out",
+        action="store_true",
+        help="extract subtitles of other episodes of the run from the same archive",
+    )
 
-    GetSubtitles(
+    return arg_parser
+
+
+def new_getsubtitles(args):
+    return GetSubtitles(
         args.name,
         args.query,
         args.single,
@@ -440,7 +1429,151 @@ def main():
         sub_num=args.number,
         downloader=args.downloader,
         sub_path=args.directory,
-    ).start()
+        jobs=args.jobs,
+        parallel_search=args.parallel_search,
+        search_timeout=args.search_timeout,
+        cache_dir=args.cache_dir,
+        no_cache=args.no_cache,
+        refresh=args.refresh,
+        pool_size=args.pool_size,
+        follow_symlinks=args.follow_symlinks,
+        scan_workers=args.scan_workers,
+        index=args.index,
+        max_size=args.max_size,
+        prefetch=args.prefetch,
+        archive_cache_size=args.archive_cache_size,
+        fan_out=args.fan_out,
+        negative_cache=args.negative_cache,
+    )
+
+
+def watch_main(argv):
+    """
+    getsub watch <dir>，监视目录并为新视频下载字幕
+    """
+
+    arg_parser = build_arg_parser(
+        prog="GetSubtitles watch", name_help="the directory to watch"
+    )
+    arg_parser.add_argument(
+        "--settle",
+        action="store",
+        type=float,
+        default=5,
+        help="seconds a new video must stay unchanged before downloading",
+    )
+    arg_parser.add_argument(
+        "--poll-interval",
+        action="store",
+        type=float,
+        default=10,
+        help="seconds between two scans when inotify is not available",
+    )
+    arg_parser.add_argument(
+        "--metrics-port",
+        action="store",
+        type=int,
+        help="serve Prometheus metrics at http://<host>:<port>/metrics",
+    )
+    arg_parser.add_argument(
+        "--metrics-host",
+        action="store",
+        default="127.0.0.1",
+        help="address for --metrics-port, default: 127.0.0.1, 0.0.0.0 for all",
+    )
+    arg_parser.add_argument(
+        "--statsd",
+        action="store",
+        help="send timings and counters to a statsd server, host[:port]",
+    )
+    args = arg_parser.parse_args(argv)
+    # 后台运行时无法交互
+    args.query = args.single = False
+    # 反复扫描同一目录，没有结果的视频等待一段时间后再搜索
+    args.negative_cache = True
+
+    if not path.isdir(args.name):
+        print("not a directory: " + args.name)
+        sys.exit(1)
+
+    get_subtitles = new_getsubtitles(args)
+    scanner = LibraryScanner(
+        follow_symlinks=args.follow_symlinks, pruned=get_subtitles.scanner.pruned
+    )
+    watcher = new_watcher(args.name, scanner, interval=args.poll_interval)
+    print("watching %s with %s" % (args.name, type(watcher).__name__))
+
+    exporters = []
+    if args.metrics_port is not None:
+        exporters.append(MetricsServer(args.metrics_port, host=args.metrics_host))
+        print(
+            "metrics at http://%s:%s/metrics"
+            % (args.metrics_host or "0.0.0.0", exporters[-1].port)
+        )
+    if args.statsd:
+        exporters.append(StatsdExporter(args.statsd))
+        metrics.listeners.append(exporters[-1])
+    try:
+        WatchDaemon(get_subtitles, watcher, settle=args.settle).run()
+    finally:
+        for exporter in exporters:
+            if exporter in metrics.listeners:
+                metrics.listeners.remove(exporter)
+            exporter.close()
+
+
+def negative_main(argv):
+    """
+    getsub negative list|purge，查看或删除没有搜索结果的记录
+    """
+
+    arg_parser = argparse.ArgumentParser(
+        prog="GetSubtitles negative",
+        description="list or purge videos recorded with no search results",
+    )
+    arg_parser.add_argument("action", choices=["list", "purge"])
+    arg_parser.add_argument(
+        "keys", nargs="*", help="keys to purge, purge all if not set"
+    )
+    arg_parser.add_argument(
+        "--cache-dir", action="store", default="", help="directory of cached pages"
+    )
+    args = arg_parser.parse_args(argv)
+
+    negative = NegativeCache(args.cache_dir)
+    if args.action == "list":
+        for key, attempts, checked, next_check in negative.list():
+            print(
+                "%s  attempts: %s  next check: %s"
+                % (
+                    key,
+                    attempts,
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(next_check)),
+                )
+            )
+    else:
+        count = negative.purge(args.keys or None)
+        print("%s entries purged." % count)
+    negative.close()
+
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        return watch_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "negative":
+        return negative_main(sys.argv[2:])
+
+    args = build_arg_parser().parse_args()
+
+    if args.over:
+        print("\nThe script will replace the old subtitles if exist...\n")
+
+    get_subtitles = new_getsubtitles(args)
+    if args.asyncio:
+        asyncio.run(get_subtitles.astart())
+    else:
+        get_subtitles.start()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+# coding: utf-8
+
+import re
+import time
+import socket
+import asyncio
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics:
+    """
+    进程内的耗时和计数统计，所有线程共享
+    span 记录一段代码的调用次数和总耗时，可以嵌套，例如 search 包含 zimuku.get_subtitles
+    counter 记录请求数、字节数、缓存命中数等
+
+    listeners 在每次记录时被调用，需实现 timing(name, seconds) 和 count(name, value)
+    """
+
+    def __init__(self):
+        self.listeners = []
+        self._spans = dict()  # {name: [count, seconds]}
+        self._counters = dict()  # {name: value}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self._spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+        for listener in self.listeners:
+            listener.timing(name, seconds)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        for listener in self.listeners:
+            listener.count(name, value)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """
+        装饰器，记录函数每次调用的耗时，支持协程函数
+        """
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+
+                @wraps(func)
+                async def atimed(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+
+                return atimed
+
+            @wraps(func)
+            def timed(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            return timed
+
+        return decorator
+
+    def snapshot(self):
+        """
+        return:
+            snapshot: tuple, (spans, counters), copies of current values
+        """
+        with self._lock:
+            spans = {name: tuple(span) for name, span in self._spans.items()}
+            return spans, dict(self._counters)
+
+    def summary(self, since=None):
+        """
+        params:
+            since: snapshot taken before, only changes after it are summarized
+        return:
+            summary: dict, {"spans": {name: {"count", "total_ms", "mean_ms"}},
+                            "counters": {name: value}}, JSON serializable
+        """
+        spans, counters = self.snapshot()
+        before_spans, before_counters = since or ({}, {})
+        summary = {"spans": dict(), "counters": dict()}
+        for name, (count, seconds) in sorted(spans.items()):
+            before = before_spans.get(name, (0, 0.0))
+            count, seconds = count - before[0], seconds - before[1]
+            if count:
+                summary["spans"][name] = {
+                    "count": count,
+                    "total_ms": round(seconds * 1000, 3),
+                    "mean_ms": round(seconds * 1000 / count, 3),
+                }
+        for name, value in sorted(counters.items()):
+            value -= before_counters.get(name, 0)
+            if value:
+                summary["counters"][name] = value
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+
+metrics = Metrics()
+
+
+def _metric_name(name):
+    return "getsub_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def prometheus_text(metrics=metrics):
+    """
+    Prometheus 文本格式，span 为 getsub_span_seconds_{count,sum}{span="<name>"}，
+    counter 为 getsub_<name>_total
+
+    return:
+        text: str
+    """
+
+    spans, counters = metrics.snapshot()
+    lines = [
+        "# HELP getsub_span_seconds time spent in each stage",
+        "# TYPE getsub_span_seconds summary",
+    ]
+    for name, (count, seconds) in sorted(spans.items()):
+        lines.append('getsub_span_seconds_count{span="%s"} %s' % (name, count))
+        lines.append('getsub_span_seconds_sum{span="%s"} %.6f' % (name, seconds))
+    for name, value in sorted(counters.items()):
+        lines.append("# TYPE %s_total counter" % _metric_name(name))
+        lines.append("%s_total %s" % (_metric_name(name), value))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    在后台线程中提供 http://host:port/metrics，供 Prometheus 抓取
+
+    params:
+        port: int, 0 to choose a free port
+        host: str, address to listen on, "" or "0.0.0.0" for all interfaces
+        metrics: Metrics
+    """
+
+    def __init__(self, port, host="127.0.0.1", metrics=metrics):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = prometheus_text(metrics).encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StatsdExporter:
+    """
+    每次记录时以 statsd 协议通过 UDP 发送，发送失败时忽略
+    地址只在创建时解析一次，避免每次发送都查询 DNS
+
+    params:
+        address: str, "host:port", port is 8125 if omitted
+        prefix: str, prefix of every metric
+    """
+
+    def __init__(self, address, prefix="getsub"):
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        family, socktype, proto, _, self.address = socket.getaddrinfo(
+            host.strip("[]"), int(port or 8125), type=socket.SOCK_DGRAM
+        )[0]
+        self.prefix = prefix
+        self._socket = socket.socket(family, socktype, proto)
+
+    def _send(self, line):
+        try:
+            self._socket.sendto(line.encode("utf-8"), self.address)
+        except OSError:
+            pass
+
+    def timing(self, name, seconds):
+        self._send("%s.%s:%.3f|ms" % (self.prefix, name, seconds * 1000))
+
+    def count(self, name, value):
+        self._send("%s.%s:%s|c" % (self.prefix, name, value))
+
+    def close(self):
+        self._socket.close()
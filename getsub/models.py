@@ -1,16 +1,36 @@
 # coding: utf-8
 
 import os
+from collections import OrderedDict
 from os.path import basename, dirname, abspath
 from os.path import exists, join, splitext
 
-from guessit import guessit
-
-from getsub.util import extract_name
+from getsub.util import extract_name, guess_info
 from getsub.constants import SUB_FORMATS
 
 
 class Video:
+    """
+    视频文件，名称解析结果和是否已有字幕在首次使用时才计算
+
+    params:
+        video_path: str, video path or name
+        sub_store_path: str, directory to save subtitles, video's dir if empty
+        identifier: str, suffix of subtitle name, e.g. ".zh"
+    """
+
+    __slots__ = (
+        "name",
+        "type",
+        "path",
+        "sub_store_path",
+        "sub_identifier",
+        "_has_subtitle",
+        "_extracted_name",
+        "_info",
+        "keywords",
+    )
+
     @classmethod
     def sub_exists(cls, video_name, store_path, identifier):
         sub_types = [identifier + sub_type for sub_type in SUB_FORMATS]
@@ -24,11 +44,43 @@ class Video:
         self.path = abspath(dirname(video_path))
         self.sub_store_path = abspath(sub_store_path) if sub_store_path else self.path
         self.sub_identifier = identifier
-        self.has_subtitle = Video.sub_exists(
-            self.name, self.sub_store_path, self.sub_identifier
-        )
-        self.extracted_name = extract_name(self.name)
-        self.info = guessit(self.extracted_name + self.type)
+        self._has_subtitle = None
+        self._extracted_name = None
+        self._info = None
+        self.keywords = None  # set by Downloader.get_keywords
+
+    @property
+    def has_subtitle(self):
+        if self._has_subtitle is None:
+            self._has_subtitle = Video.sub_exists(
+                self.name, self.sub_store_path, self.sub_identifier
+            )
+        return self._has_subtitle
+
+    @has_subtitle.setter
+    def has_subtitle(self, value):
+        self._has_subtitle = value
+
+    @property
+    def extracted_name(self):
+        if self._extracted_name is None:
+            self._extracted_name = extract_name(self.name)
+        return self._extracted_name
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = guess_info(self.extracted_name + self.type)
+        return self._info
+
+    @property
+    def batch_key(self):
+        """
+        同一剧集同一季的视频属于同一批次，电影返回 None
+        """
+        if self.info.get("type") != "episode":
+            return None
+        return str(self.info.get("title", "")).lower(), self.info.get("season")
 
     def delete_existed_subtitles(self):
         if not self.has_subtitle:
@@ -39,3 +91,23 @@ class Video:
 
             if exists(delete_file):
                 os.remove(delete_file)
+
+
+def plan_batches(videos):
+    """
+    按剧集名和季对视频分组，同组视频共享一次搜索结果
+    组的顺序为组内首个视频出现的顺序，电影单独成组
+
+    params:
+        videos: list of Video
+    return:
+        batches: list, [[Video, ...], ...]
+    """
+
+    batches = OrderedDict()
+    for i, video in enumerate(videos):
+        key = video.batch_key
+        if key is None:
+            key = ("movie", i)
+        batches.setdefault(key, []).append(video)
+    return list(batches.values())
@@ -0,0 +1,186 @@
+# coding: utf-8
+
+import os
+import queue
+import threading
+from os import path
+
+from getsub.constants import VIDEO_EXTENSIONS
+
+
+# NAS 和系统生成的目录，不包含视频
+PRUNED_DIRS = frozenset(
+    [
+        "@eaDir",
+        "#recycle",
+        ".@__thumb",
+        ".Trash",
+        "$RECYCLE.BIN",
+        "System Volume Information",
+        "lost+found",
+    ]
+)
+
+
+class LibraryScanner:
+    """
+    基于 os.scandir 的视频目录扫描，边扫描边返回结果
+
+    params:
+        follow_symlinks: bool, whether to enter symlinked directories,
+                         directories already visited are skipped
+        pruned: set of directory names to skip
+        workers: int, threads to scan top-level directories in parallel
+        extensions: set of lowercase video extensions
+        index: LibraryIndex or None, directories not modified since last scan
+               are read from the index instead of the disk
+    """
+
+    def __init__(
+        self,
+        follow_symlinks=False,
+        pruned=PRUNED_DIRS,
+        workers=1,
+        extensions=VIDEO_EXTENSIONS,
+        index=None,
+    ):
+        self.follow_symlinks = follow_symlinks
+        self.pruned = frozenset(pruned)
+        self.workers = max(int(workers or 1), 1)
+        self.extensions = extensions
+        self.index = index
+        self._visited = set()  # {(st_dev, st_ino)} of visited directories
+        self._lock = threading.Lock()
+
+    def _first_visit(self, dir_path):
+        """ 记录访问过的目录，跟随软链接时避免循环 """
+        if not self.follow_symlinks:
+            return True
+        try:
+            stat = os.stat(dir_path)
+        except OSError:
+            return False
+        key = (stat.st_dev, stat.st_ino)
+        with self._lock:
+            if key in self._visited:
+                return False
+            self._visited.add(key)
+        return True
+
+    def _list_dir(self, dir_path):
+        """
+        return:
+            videos: list of str, video file names, sorted
+            names: frozenset of all file names in the directory
+            sub_dirs: list of str, directories to scan, sorted
+        """
+        videos, names, sub_dirs = [], set(), []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                            if entry.name not in self.pruned:
+                                sub_dirs.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    names.add(entry.name)
+                    if path.splitext(entry.name)[-1].lower() in self.extensions:
+                        videos.append(entry.name)
+        except OSError:  # permission denied or removed during the scan
+            pass
+        videos.sort()
+        sub_dirs.sort()
+        return videos, frozenset(names), sub_dirs
+
+    def _read_dir(self, dir_path):
+        """
+        与 _list_dir 相同，目录未修改时从索引读取，names 为 None
+        """
+        if self.index is None:
+            return self._list_dir(dir_path)
+        try:
+            mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            return [], frozenset(), []
+        listing = self.index.get_dir(dir_path, mtime)
+        if listing is not None:
+            videos, sub_dirs = listing
+            return videos, None, sub_dirs
+        videos, names, sub_dirs = self._list_dir(dir_path)
+        self.index.set_dir(dir_path, mtime, videos, sub_dirs)
+        return videos, names, sub_dirs
+
+    def _walk(self, dir_path):
+        stack = [dir_path]
+        while stack:
+            dir_path = stack.pop()
+            if not self._first_visit(dir_path):
+                continue
+            videos, names, sub_dirs = self._read_dir(dir_path)
+            if videos:
+                yield dir_path, videos, names
+            stack.extend(reversed(sub_dirs))
+
+    def scan(self, root):
+        """
+        扫描目录，按目录返回其中的视频
+
+        params:
+            root: str, directory path
+        return:
+            generator of (dir_path, video_names, file_names),
+            file_names is None if the directory is read from the index
+        """
+
+        if self.index is not None:
+            root = path.abspath(root)
+        with self._lock:
+            self._visited.clear()
+        if self.workers == 1:
+            yield from self._walk(root)
+            return
+
+        if not self._first_visit(root):
+            return
+        videos, names, sub_dirs = self._read_dir(root)
+        if videos:
+            yield root, videos, names
+        yield from self._scan_parallel(sub_dirs)
+
+    def _scan_parallel(self, dir_paths):
+        # 每个线程扫描一个顶层目录，结果放入队列
+        results = queue.Queue()
+        pending = queue.Queue()
+        for dir_path in dir_paths:
+            pending.put(dir_path)
+        done = object()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        dir_path = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    for result in self._walk(dir_path):
+                        results.put(result)
+            finally:
+                results.put(done)
+
+        workers = min(self.workers, len(dir_paths))
+        threads = [
+            threading.Thread(target=worker, daemon=True) for _ in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        finished = 0
+        while finished < workers:
+            result = results.get()
+            if result is done:
+                finished += 1
+                continue
+            yield result
@@ -0,0 +1,257 @@
+# coding: utf-8
+
+import time
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from getsub.metrics import metrics
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed by the async interface
+    aiohttp = None
+
+# 重试的 HTTP 状态码
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    令牌桶限速，每秒产生 rate 个令牌，最多累积 burst 个
+
+    params:
+        rate: float, requests per second
+        burst: int, maximum requests sent at once
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        取一个令牌
+
+        return:
+            wait: float, seconds to wait before sending the request
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class CountedRetry(Retry):
+    """
+    记录重试次数的 Retry
+    """
+
+    def increment(self, *args, **kwargs):
+        metrics.incr("http.retries")
+        return super().increment(*args, **kwargs)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    发送请求前按主机限速的 HTTPAdapter，记录请求数和非 stream 响应的字节数
+    """
+
+    def __init__(self, manager, **kwargs):
+        self.manager = manager
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.manager.acquire(request.url)
+        metrics.incr("http.requests")
+        response = super().send(request, **kwargs)
+        if not kwargs.get("stream"):
+            # streamed downloads are counted by read_response
+            metrics.incr("http.bytes", len(response.content))
+        return response
+
+    def __deepcopy__(self, memo):
+        # 复制 session 时共享连接池
+        return self
+
+
+class RequestContext:
+    """
+    单个候选字幕的请求上下文，只保存下载需要的 Referer 和 cookies，
+    请求通过共享的 session 发送
+
+    params:
+        session: requests.Session
+        referer: str
+        cookies: dict, cookies sent with every request besides session's
+    """
+
+    __slots__ = ("session", "headers", "cookies")
+
+    def __init__(self, session, referer=None, cookies=None):
+        self.session = session
+        self.headers = {"Referer": referer} if referer else {}
+        self.cookies = cookies
+
+    def get(self, url, **kwargs):
+        headers = dict(self.headers)
+        headers.update(kwargs.pop("headers", None) or {})
+        if self.cookies:
+            kwargs.setdefault("cookies", self.cookies)
+        return self.session.get(url, headers=headers, **kwargs)
+
+
+class SessionManager:
+    """
+    所有下载器共享的 requests.Session，复用连接池，按主机限速，失败自动重试
+
+    params:
+        pool_connections: int, number of hosts to keep connection pools for
+        pool_maxsize: int, maximum connections kept for one host
+        retries: int, retries of failed requests
+        backoff_factor: float, sleep backoff_factor * (2 ^ retry) between retries
+        headers: dict, default headers of the session
+    """
+
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        retries=3,
+        backoff_factor=0.5,
+        headers=None,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.headers = headers or {}
+        self._buckets = dict()  # {host: TokenBucket}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def configure(self, **kwargs):
+        """
+        修改连接池参数，之后获取的 session 使用新参数
+        """
+        with self._lock:
+            for key, value in kwargs.items():
+                if not hasattr(self, key):
+                    raise AttributeError("unknown session option " + key)
+                setattr(self, key, value)
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def limit(self, url, rate, burst=1):
+        """
+        限制主机每秒请求数
+
+        params:
+            url: str, host or any url of the host
+            rate: float, requests per second
+            burst: int, maximum requests sent at once
+        """
+        self._buckets[self._host(url)] = TokenBucket(rate, burst)
+
+    @classmethod
+    def _host(cls, url):
+        return urlparse(url).netloc or url
+
+    def acquire(self, url):
+        bucket = self._buckets.get(self._host(url))
+        if bucket is not None:
+            bucket.acquire()
+
+    async def aacquire(self, url):
+        bucket = self._buckets.get(self._host(url))
+        if bucket is not None:
+            await bucket.aacquire()
+
+    def _new_session(self):
+        retry = CountedRetry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        )
+        adapter = RateLimitedAdapter(
+            self,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def backoff(self, retry):
+        """
+        第 retry 次重试前等待的秒数，与 urllib3 的 Retry 相同
+
+        return:
+            seconds: float, 0 for the first retry
+        """
+        if retry <= 1:
+            return 0
+        return self.backoff_factor * 2 ** (retry - 1)
+
+    def session(self):
+        """
+        return:
+            session: requests.Session shared by all callers
+        """
+        with self._lock:
+            if self._session is None:
+                self._session = self._new_session()
+            return self._session
+
+    def trace_config(self):
+        """
+        aiohttp 使用的限速配置，传入 aiohttp.ClientSession(trace_configs=[...])
+        """
+
+        async def on_request_start(session, context, params):
+            await self.aacquire(str(params.url))
+            metrics.incr("http.requests")
+
+        async def on_response_chunk_received(session, context, params):
+            metrics.incr("http.bytes", len(params.chunk))
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_response_chunk_received.append(on_response_chunk_received)
+        return trace_config
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -1,43 +1,607 @@
 # coding: utf-8
 
+import os
 import re
+import json
+import codecs
+import time
+import shutil
+import asyncio
 import zipfile
 import tempfile
+import threading
+import contextvars
 import subprocess
 from os import path
-from io import BytesIO
+from io import BytesIO, StringIO
+from urllib.parse import urlparse
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
 from shutil import get_terminal_size
 
 import rarfile
 from guessit import guessit
+from guessit import __version__ as guessit_version
+
+try:
+    import py7zr
+except ImportError:  # 7z archives are extracted with the 7z command instead
+    py7zr = None
 
 from getsub.constants import SUB_FORMATS, ARCHIVE_TYPES
+from getsub.metrics import metrics
+
+
+# downloads larger than this are written to a temporary file
+SPILL_SIZE = 32 * 1024 * 1024
+# downloads larger than this are aborted, subtitle archives are much smaller
+MAX_DOWNLOAD_SIZE = 64 * 1024 * 1024
 
 
 class ProgressBar:
-    def __init__(self, prefix_info, title="", total="", count_time=0):
+    def __init__(self, prefix_info, title="", total="", count_time=0, interval=0.1):
         self.title = title
         self.total = total
         self.prefix_info = prefix_info
-
-    def refresh(self, cur_len):
+        self.interval = interval  # 最短刷新间隔，单位秒
+        self._last_refresh = 0
+        self.finished = False  # 最后一行已打印，之后的 refresh 不再输出
+
+    def _progress(self, cur_len):
+        if self.total:
+            return "%.2f%%" % (cur_len / self.total * 100)
+        return "%.1fKB" % (cur_len / 1024)
+
+    def refresh(self, cur_len, end=False):
+        if self.finished:
+            return
+        end = end or bool(self.total and cur_len >= self.total)
+        now = time.monotonic()
+        if not end and now - self._last_refresh < self.interval:
+            return
+        self._last_refresh = now
         terminal_width = get_terminal_size().columns  # 获取终端宽度
-        info = "%s '%s'...  %.2f%%" % (
+        info = "%s '%s'...  %s" % (
             self.prefix_info,
             self.title,
-            cur_len / self.total * 100,
+            self._progress(cur_len),
         )
-        while len(info) > terminal_width - 20:
+        while len(info) > terminal_width - 20 and len(self.title) > 4:
             self.title = self.title[0:-4] + "..."
-            info = "%s '%s'...  %.2f%%" % (
+            info = "%s '%s'...  %s" % (
                 self.prefix_info,
                 self.title,
-                cur_len / self.total * 100,
+                self._progress(cur_len),
             )
-        end_str = "\r" if cur_len < self.total else "\n"
+        end_str = "\n" if end else "\r"
+        self.finished = end
         print(info, end=end_str)
 
 
+ContentType = namedtuple("ContentType", ["datatype", "encoding"])
+ContentType.__doc__ = """
+下载内容的类型
+
+    datatype: str, '.zip', '.rar', '.7z', a subtitle type in SUB_FORMATS,
+              'html' for web pages, None if unknown
+    encoding: str, encoding of text subtitles, None if unknown or binary
+"""
+
+SNIFF_SIZE = 2048  # bytes needed by sniff_content
+
+_srt_pattern = re.compile(rb"^\s*\d+\s*\r?\n\s*\d+:\d+:\d+[,.]\d+\s*-->")
+_sub_pattern = re.compile(rb"^\s*\{\d+\}\{\d*\}")
+_html_pattern = re.compile(rb"^\s*<(!doctype\s+html|html|head|body|script)", re.I)
+_text_boms = (
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe", "utf-16-le"),
+    (b"\xfe\xff", "utf-16-be"),
+)
+_filename_pattern = re.compile(r"filename\*?=(?:[\w-]+'[\w-]*')?\"?([^\";]+)", re.I)
+
+
+def _sniff_utf16(head):
+    """
+    没有 BOM 的 utf-16，字幕中的数字和时间轴使奇数位或偶数位有大量 0
+
+    return:
+        encoding: str, "utf-16-le" or "utf-16-be", None if not utf-16
+    """
+    if len(head) < 4:
+        return None
+    even, odd = head[0::2], head[1::2]
+    if even.count(0) == 0 and odd.count(0) >= len(odd) / 4:
+        return "utf-16-le"
+    if odd.count(0) == 0 and even.count(0) >= len(even) / 4:
+        return "utf-16-be"
+    return None
+
+
+def _sniff_encoding(head):
+    """
+    return:
+        encoding: str, None if head is not text in utf-8, gb18030 or utf-16
+        text: bytes, head without BOM, encoded as utf-8
+    """
+    for bom, encoding in _text_boms:
+        if head.startswith(bom):
+            text = head[len(bom) :]
+            if encoding.startswith("utf-16"):
+                text = codecs.getincrementaldecoder(encoding)(errors="ignore").decode(
+                    text
+                )
+                return encoding, text.encode("utf-8")
+            return encoding, text
+    for encoding in ("utf-8", "gb18030", "big5"):
+        try:
+            # 最后一个字符可能被截断，不作为最终输入解码
+            text = codecs.getincrementaldecoder(encoding)().decode(head)
+        except UnicodeDecodeError:
+            continue
+        if "\x00" in text:
+            break
+        return encoding, text.encode("utf-8")
+    encoding = _sniff_utf16(head)
+    if encoding is not None:
+        try:
+            text = codecs.getincrementaldecoder(encoding)().decode(head)
+        except UnicodeDecodeError:
+            return None, head
+        return encoding, text.encode("utf-8")
+    return None, head
+
+
+def sniff_content(head):
+    """
+    根据内容开头判断下载内容类型
+
+    params:
+        head: bytes, first bytes of the content, SNIFF_SIZE bytes is enough
+    return:
+        content_type: ContentType
+    """
+    head = bytes(head[:SNIFF_SIZE])
+    datatype = detect_archive(head)
+    if datatype is not None:
+        return ContentType(datatype, None)
+    if head.startswith(b"PG"):
+        return ContentType(".sup", None)
+
+    encoding, text = _sniff_encoding(head)
+    if encoding is None:
+        return ContentType(None, None)
+    lower = text.lower()
+    if _html_pattern.match(text):
+        return ContentType("html", encoding)
+    if b"[script info]" in lower:
+        if b"[v4+ styles]" in lower:
+            return ContentType(".ass", encoding)
+        if b"[v4 styles]" in lower:
+            return ContentType(".ssa", encoding)
+        return ContentType(".ass", encoding)
+    if _srt_pattern.match(text):
+        return ContentType(".srt", encoding)
+    if _sub_pattern.match(text):
+        return ContentType(".sub", encoding)
+    return ContentType(None, encoding)
+
+
+class DownloadBuffer:
+    """
+    下载缓冲区，已知大小时预分配内存，
+    大小未知或超过 spill_size 时使用临时文件，超过 spill_size 后写入磁盘
+
+    params:
+        content_size: int, content-length of the response, 0 if unknown
+        spill_size: int, maximum bytes kept in memory
+    """
+
+    min_chunk_size = 64 * 1024
+    max_chunk_size = 1024 * 1024
+
+    def __init__(self, content_size=0, spill_size=SPILL_SIZE):
+        self.content_size = content_size
+        self.spill_size = spill_size
+        self.size = 0
+        self.content_type = None  # ContentType, set after SNIFF_SIZE bytes
+        self._head = b""
+        if content_size and content_size <= spill_size:
+            self._buff = bytearray(content_size)
+            self._file = None
+        else:
+            self._buff = None
+            self._file = tempfile.SpooledTemporaryFile(max_size=spill_size)
+
+    @property
+    def chunk_size(self):
+        # 约 64 次读取完成，限制在 64KB 至 1MB 之间
+        chunk_size = self.content_size // 64
+        return min(max(chunk_size, self.min_chunk_size), self.max_chunk_size)
+
+    def sniff(self):
+        """
+        判断已下载内容的类型，下载完成前调用时只使用已下载的部分
+
+        return:
+            content_type: ContentType
+        """
+        if self.content_type is None:
+            self.content_type = sniff_content(self._head)
+        return self.content_type
+
+    def write(self, chunk):
+        if self.content_type is None:
+            self._head += bytes(chunk[: SNIFF_SIZE - len(self._head)])
+            if len(self._head) >= SNIFF_SIZE:
+                self.sniff()
+        end = self.size + len(chunk)
+        if self._buff is not None and end > len(self._buff):
+            # 内容比 content-length 长（如经过压缩），改用临时文件
+            self._file = tempfile.SpooledTemporaryFile(max_size=self.spill_size)
+            self._file.write(memoryview(self._buff)[: self.size])
+            self._buff = None
+        if self._buff is not None:
+            self._buff[self.size : end] = chunk
+        else:
+            self._file.write(chunk)
+        self.size = end
+
+    def getvalue(self):
+        """
+        return:
+            data: bytearray if kept in memory, else a binary file at position 0
+        """
+        if self._buff is not None:
+            if self.size < len(self._buff):
+                del self._buff[self.size :]
+            return self._buff
+        if self.size <= self.spill_size:
+            self._file.seek(0)
+            data = self._file.read()
+            self._file.close()
+            return data
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        """ 丢弃已下载的内容 """
+        self._buff = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DownloadAborted(Exception):
+    """
+    下载内容不是字幕或字幕包、超过大小限制或下载被取消
+    """
+
+
+def _check_size(size, max_size):
+    if max_size and size > max_size:
+        raise DownloadAborted(
+            "file is too large (more than %.1f MB)" % (max_size / 1024 / 1024)
+        )
+
+
+def _guess_filetype(headers, url="", title=""):
+    """
+    根据 Content-Disposition、链接或标题中的文件名猜测文件类型
+
+    return:
+        datatype: str, a type in SUB_FORMATS or ARCHIVE_TYPES, "" if unknown
+    """
+    match = _filename_pattern.search(headers.get("content-disposition") or "")
+    names = (match.group(1) if match else "", urlparse(str(url)).path, title)
+    for name in names:
+        datatype = path.splitext(name.strip())[-1].lower()
+        if datatype in SUB_FORMATS or datatype in ARCHIVE_TYPES:
+            return datatype
+    return ""
+
+
+def _check_head(buff, headers, filetype=""):
+    """
+    根据第一块数据判断是否继续下载，不等待 SNIFF_SIZE 字节
+
+    params:
+        filetype: str, result of _guess_filetype
+    """
+    content_type = buff.sniff()
+    if content_type.datatype == "html":
+        raise DownloadAborted("got a web page instead of subtitles")
+    if content_type.datatype is not None:
+        return
+    if content_type.encoding is None:
+        # VobSub 等二进制字幕无法从内容判断，使用文件名中的类型
+        if filetype in SUB_FORMATS:
+            return
+        raise DownloadAborted("got a file that is neither subtitles nor an archive")
+    if headers.get("content-type", "").lower().startswith("text/html"):
+        raise DownloadAborted("got a web page instead of subtitles")
+
+
+def read_response(response, title="", max_size=MAX_DOWNLOAD_SIZE, cancel=None):
+    """
+    读取以 stream=True 打开的 requests 响应，显示下载进度
+    内容不是字幕或字幕包、超过 max_size 或 cancel 被设置时中止下载，
+    调用方关闭响应即断开连接，不再读取剩余内容
+
+    params:
+        response: requests.Response
+        title: str, title shown in the progress bar
+        max_size: int, maximum bytes to download, 0 for no limit
+        cancel: threading.Event or None, set by other threads to stop downloading
+    return:
+        content_type: ContentType, sniffed from the first bytes
+        data: check DownloadBuffer.getvalue
+    raise:
+        DownloadAborted
+    """
+
+    content_size = int(response.headers.get("content-length") or 0)
+    _check_size(content_size, max_size)
+    filetype = _guess_filetype(response.headers, getattr(response, "url", ""), title)
+    buff = DownloadBuffer(content_size)
+    bar = ProgressBar("Get", title.strip(), content_size)
+    try:
+        for chunk in response.iter_content(chunk_size=buff.chunk_size):
+            if cancel is not None and cancel.is_set():
+                raise DownloadAborted("download cancelled")
+            buff.write(chunk)
+            metrics.incr("http.bytes", len(chunk))
+            if buff.size == len(chunk):
+                _check_head(buff, response.headers, filetype)
+            _check_size(buff.size, max_size)
+            bar.refresh(buff.size)
+    except BaseException:
+        buff.close()
+        raise
+    bar.refresh(buff.size, end=True)
+    return buff.sniff(), buff.getvalue()
+
+
+async def aread_response(response, max_size=MAX_DOWNLOAD_SIZE):
+    """
+    read_response 的异步版本，response 为 aiohttp.ClientResponse，不显示进度
+    取消下载时直接取消所在的任务
+    """
+
+    content_size = response.content_length or 0
+    _check_size(content_size, max_size)
+    filetype = _guess_filetype(response.headers, response.url)
+    buff = DownloadBuffer(content_size)
+    try:
+        async for chunk in response.content.iter_chunked(buff.chunk_size):
+            buff.write(chunk)
+            if buff.size == len(chunk):
+                _check_head(buff, response.headers, filetype)
+            _check_size(buff.size, max_size)
+    except BaseException:
+        buff.close()
+        raise
+    return buff.sniff(), buff.getvalue()
+
+
+def open_data(data):
+    """
+    return:
+        file: binary file of data, data is bytes-like or a binary file
+    """
+    if hasattr(data, "read"):
+        data.seek(0)
+        return data
+    return BytesIO(data)
+
+
+def write_data(file, data):
+    """
+    write data to file, data is bytes-like or a binary file
+    """
+    if hasattr(data, "read"):
+        data.seek(0)
+        shutil.copyfileobj(data, file)
+    else:
+        file.write(data)
+
+
+class GroupedOutput:
+    """
+    按线程或协程缓存输出，并发处理多个视频时每个视频的输出成组打印
+
+    params:
+        stream: 原始输出流，如 sys.stdout
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buff = contextvars.ContextVar("buff", default=None)
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        buff = self._buff.get()
+        if buff is not None:
+            return buff.write(text)
+        with self._lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        if self._buff.get() is None:
+            self.stream.flush()
+
+    @contextmanager
+    def capture(self):
+        """ 缓存当前线程或协程内的输出，由调用方决定何时写入 """
+        buff = StringIO()
+        token = self._buff.set(buff)
+        try:
+            yield buff
+        finally:
+            self._buff.reset(token)
+
+    @contextmanager
+    def group(self):
+        """ 缓存当前线程或协程内的输出，结束时一次性写入原始输出流 """
+        buff = StringIO()
+        try:
+            with self.capture() as buff:
+                yield
+        finally:
+            with self._lock:
+                self.stream.write(buff.getvalue())
+                self.stream.flush()
+
+
+class SharedResults:
+    """
+    按键共享计算结果，同一键只计算一次，并发调用等待首次计算完成
+    计算出错时不保存结果，下次调用重新计算
+    """
+
+    def __init__(self):
+        self._results = dict()
+        self._locks = dict()
+        self._tasks = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, func, *args):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._results:
+                self._results[key] = func(*args)
+            return self._results[key]
+
+    async def aget(self, key, coro_func, *args):
+        """ get 的异步版本，coro_func 返回 coroutine """
+        if key in self._results:
+            return self._results[key]
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_func(*args))
+            self._tasks[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._tasks.pop(key, None)
+        self._results[key] = result
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._locks.clear()
+            self._tasks.clear()
+
+
+class GuessitCache:
+    """
+    guessit 解析结果缓存，进程内按 LRU 保存最近 max_size 个结果
+    设置 store 后同时保存至 PageCache，下次运行可直接读取
+
+    结果中的非基本类型（如 Language、date）会转为字符串，
+    调用方不应修改返回的字典
+
+    params:
+        max_size: int, maximum results kept in memory
+        store: PageCache or None
+    """
+
+    provider = "guessit"
+
+    def __init__(self, max_size=4096, store=None):
+        self.max_size = max_size
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _plain(cls, value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, (list, tuple)):
+            return [cls._plain(one) for one in value]
+        return str(value)
+
+    @classmethod
+    def _store_key(cls, name):
+        return "%s:%s" % (guessit_version, name)
+
+    def guess(self, name):
+        """
+        return:
+            info: dict, result of guessit(name)
+        """
+        with self._lock:
+            info = self._results.get(name)
+            if info is not None:
+                self._results.move_to_end(name)
+                self.hits += 1
+                metrics.incr("cache.guessit.hits")
+                return info
+            self.misses += 1
+
+        info = None
+        if self.store is not None:
+            value = self.store.get(GuessitCache.provider, self._store_key(name))
+            if value is not None:
+                info = json.loads(value)
+                self.store_hits += 1
+                metrics.incr("cache.guessit.hits")
+        if info is None:
+            metrics.incr("cache.guessit.misses")
+            with metrics.span("guessit"):
+                info = {k: self._plain(v) for k, v in guessit(name).items()}
+            if self.store is not None:
+                self.store.set(
+                    GuessitCache.provider,
+                    self._store_key(name),
+                    json.dumps(info, ensure_ascii=False),
+                )
+
+        with self._lock:
+            self._results[name] = info
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return info
+
+    def stats(self):
+        """
+        return:
+            stats: dict, {'size', 'hits', 'misses', 'store_hits'}
+        """
+        return {
+            "size": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "store_hits": self.store_hits,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = self.store_hits = 0
+
+
+guessit_cache = GuessitCache()
+
+
+def guess_info(name):
+    """
+    带缓存的 guessit
+
+    params:
+        name: str, video or subtitle name
+    return:
+        info: dict
+    """
+    return guessit_cache.guess(name)
+
+
 def num_to_cn(number):
     """
     转化 1-99 的数字至中文
@@ -194,29 +758,77 @@ def choose_subtitle(subtitles):
     return subtitles[choice]
 
 
-def compute_subtitle_score(video_detail, subname, match_episode=True):
-    """
-    计算字幕分数
+# 语言和格式关键词，每个位置用前瞻匹配，重叠的关键词也能找到
+# 同一位置只取第一个匹配的关键词，较长的关键词写在前面，并包含较短关键词的标记
+SUB_KEYWORDS = (
+    ("简体&英文", ("chs", "bilingual")),
+    ("chs.eng", ("chs", "chs_eng")),
+    ("chs&eng", ("chs", "chs_eng")),
+    ("简体", ("chs",)),
+    ("chs", ("chs",)),
+    (".gb.", ("chs",)),
+    ("中英", ("bilingual",)),
+    ("简英", ("bilingual",)),
+    ("双语", ("bilingual",)),
+    ("ass", ("ass",)),
+    ("ssa", ("ass",)),
+    ("srt", ("srt",)),
+)
+SUB_KEYWORD_SCORES = {"chs": 2, "chs_eng": 2, "bilingual": 4, "ass": 2, "srt": 1}
+_sub_keyword_flags = dict(SUB_KEYWORDS)
+# 文件名中唯一的 SxxEyy，季或集与视频不同时不需要 guessit 即可排除
+_episode_pattern = re.compile(r"(?<![a-z0-9])s(\d{1,2})e(\d{1,3})(?![0-9a-z-])")
+_sub_keyword_pattern = re.compile(
+    "(?=(%s))" % "|".join(re.escape(keyword) for keyword, _ in SUB_KEYWORDS)
+)
+
+
+def _keyword_score(subname):
+    flags = set()
+    for match in _sub_keyword_pattern.finditer(subname):
+        flags.update(_sub_keyword_flags[match.group(1)])
+    return sum(SUB_KEYWORD_SCORES[flag] for flag in flags)
+
+
+def _video_context(video_detail):
+    season, episode = video_detail.get("season"), video_detail.get("episode")
+    if isinstance(season, int) and isinstance(episode, int):
+        episode_key = (season, episode)
+    else:
+        episode_key = None  # multi-episode videos are left to guessit
+    return (
+        video_detail["title"].lower(),
+        str(season),
+        str(episode),
+        str(video_detail.get("year")),
+        str(video_detail.get("type")),
+        episode_key,
+    )
 
+
+def _other_episode(context, subname):
+    episode_key = context[-1]
+    if episode_key is None or context[4] == "movie":
+        return False
+    found = _episode_pattern.findall(subname)
+    if len(found) != 1:
+        return False
+    return (int(found[0][0]), int(found[0][1])) != episode_key
+
+
+def _score_subname(context, subname, match_episode):
+    """
     params:
-        video_detail: dict, result of guessit
-        subname: str
-        match_episode: bool, whether episode number
-                       needed to match if video is a TV show
-    return:
-        score: int, return -1 if not match with videos
+        context: tuple, result of _video_context
+        subname: str, lowercase subtitle name
     """
 
-    video_name = video_detail["title"].lower()
-    season = str(video_detail.get("season"))
-    episode = str(video_detail.get("episode"))
-    year = str(video_detail.get("year"))
-    vtype = str(video_detail.get("type"))
-
-    subname = subname.lower()
+    video_name, season, episode, year, vtype, _ = context
+    if match_episode and _other_episode(context, subname):
+        return -1
     score = 0
 
-    sub_name_info = guessit(subname)
+    sub_name_info = guess_info(subname)
     if sub_name_info.get("title"):
         sub_title = sub_name_info["title"].lower()
     else:
@@ -247,42 +859,43 @@ def compute_subtitle_score(video_detail, subname, match_episode=True):
         else:
             return -1  # title and episode not match
 
-    if "简体" in subname or "chs" in subname or ".gb." in subname:
-        score += 2
-    if "繁体" in subname or "cht" in subname or ".big5." in subname:
-        pass
-    if "chs.eng" in subname or "chs&eng" in subname:
-        score += 2
-    if "中英" in subname or "简英" in subname or "双语" in subname or "简体&英文" in subname:
-        score += 4
+    return score + _keyword_score(subname)
+
+
+def compute_subtitle_score(video_detail, subname, match_episode=True):
+    """
+    计算字幕分数
 
-    score += ("ass" in subname or "ssa" in subname) * 2
-    score += ("srt" in subname) * 1
+    params:
+        video_detail: dict, result of guessit
+        subname: str
+        match_episode: bool, whether episode number
+                       needed to match if video is a TV show
+    return:
+        score: int, return -1 if not match with videos
+    """
 
-    return score
+    return _score_subname(_video_context(video_detail), subname.lower(), match_episode)
 
 
-def guess_subtitle(sublist, video_detail):
+def rank_subtitles(sublist, video_detail, match_episode=True):
     """
-    传入字幕列表，视频信息，返回得分最高字幕名
+    一次计算压缩包内所有字幕的分数，按分数从高到低排序，
+    分数相同时保持原顺序，非字幕文件被忽略
 
     params:
-        sublist: list of str
-        video_detail: result of guessit
+        sublist: list of str, file names in an archive
+        video_detail: dict, result of guessit
+        match_episode: bool, same as compute_subtitle_score
     return:
-        success: bool
-        subname: str
+        ranked: list, [(subname, score), ...]
     """
 
-    if not sublist:
-        return False, None
-
-    scores, subs = [], []
+    context = _video_context(video_detail)
+    scores = []
     for one_sub in sublist:
-        _, ftype = path.splitext(one_sub)
-        if ftype not in SUB_FORMATS:
+        if path.splitext(one_sub)[-1] not in SUB_FORMATS:
             continue
-        subs.append(one_sub)
         subname = path.split(one_sub)[-1]  # extract subtitle name
         try:
             # zipfile:/Lib/zipfile.py:1211 Historical ZIP filename encoding
@@ -290,110 +903,384 @@ def guess_subtitle(sublist, video_detail):
             subname = subname.encode("cp437").decode("gbk")
         except Exception:
             pass
-        score = compute_subtitle_score(video_detail, subname)
-        scores.append(score)
+        scores.append(
+            (one_sub, _score_subname(context, subname.lower(), match_episode))
+        )
+    return sorted(scores, key=lambda e: e[1], reverse=True)
+
+
+@metrics.timed("guess")
+def guess_subtitle(sublist, video_detail):
+    """
+    传入字幕列表，视频信息，返回得分最高字幕名
+
+    params:
+        sublist: list of str
+        video_detail: result of guessit
+    return:
+        success: bool
+        subname: str
+    """
+
+    if not sublist:
+        return False, None
+
+    ranked = rank_subtitles(sublist, video_detail)
+    if not ranked:
+        return False, None
+    subname, score = ranked[0]
+    return score > 0, subname
+
+
+@metrics.timed("guess")
+def assign_subtitles(sublist, video_details, taken=()):
+    """
+    一次为多个视频分配压缩包内的字幕，按分数从高到低分配，
+    每个字幕最多分配给一个视频，没有匹配字幕的视频不分配
+
+    params:
+        sublist: list of str
+        video_details: list of dict, results of guessit
+        taken: iterable of str, subtitles already used
+    return:
+        assigned: dict, {index of video_details: subname}
+    """
+
+    pairs = []
+    for i, video_detail in enumerate(video_details):
+        for subname, score in rank_subtitles(sublist, video_detail):
+            if score <= 0:
+                break
+            pairs.append((score, i, subname))
+    # 分数相同时靠前的视频和字幕优先
+    pairs.sort(key=lambda e: e[0], reverse=True)
 
-    max_score = max(scores)
-    max_pos = scores.index(max_score)
-    return max_score > 0, subs[max_pos]
+    assigned, used = dict(), set(taken)
+    for score, i, subname in pairs:
+        if i in assigned or subname in used:
+            continue
+        assigned[i] = subname
+        used.add(subname)
+    return assigned
 
 
+@contextmanager
 def get_file_list(data, datatype):
     """
     传入一个压缩文件控制对象，读取对应压缩文件内文件列表
+    需在 with 语句中使用，退出时关闭压缩包并删除嵌套压缩包和 7z 解压的临时文件
 
     params:
-        data: binary data of an archive file
+        data: binary data of an archive file, or a binary file
         datatype: str, file type
-    return:
+    yield:
         sub_lists_dict: dict, {subname: file_handler}
     """
 
-    sub_buff = BytesIO(data)
+    with ArchiveIndex(data, datatype) as index:
+        yield {entry.name: index.handler(entry.chain) for entry in index.entries}
+
+
+class P7ZIP:
+    """
+    7z 压缩文件，首次读取时一次解压全部文件至临时目录，之后的 read 不再解压
+
+    优先使用 py7zr 在进程内解压，未安装时调用一次 7z 命令
+
+    params:
+        file: binary file of the archive
+    """
+
+    def __init__(self, file):
+        self.file = file  # read from the start every time, not copied
+        self._sizes = None  # {name: size}
+        self._tmp_dir = None  # TemporaryDirectory of extracted files
+        # test if it is a valid 7zip file
+        self.namelist()
+
+    @classmethod
+    def _list_dir(cls, root):
+        sizes = dict()
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                file_path = path.join(dirpath, filename)
+                name = path.relpath(file_path, root).replace(os.sep, "/")
+                sizes[name] = path.getsize(file_path)
+        return sizes
+
+    @metrics.timed("archive.7z")
+    def _extract(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        out_dir = path.join(tmp_dir.name, "out")
+        try:
+            self.file.seek(0)
+            if py7zr is not None:
+                with py7zr.SevenZipFile(self.file, mode="r") as archive:
+                    archive.extractall(path=out_dir)
+            else:
+                file_path = path.join(tmp_dir.name, "archive.7z")
+                with open(file_path, "wb") as f:
+                    shutil.copyfileobj(self.file, f)
+                process = subprocess.run(
+                    ["7z", "x", "-y", "-o" + out_dir, file_path],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+                os.remove(file_path)
+                if process.returncode != 0:
+                    raise ValueError(process.stderr.decode(errors="ignore"))
+        except Exception:
+            tmp_dir.cleanup()
+            raise
+        self._tmp_dir = tmp_dir
+        if self._sizes is None:
+            self._sizes = self._list_dir(out_dir)
+
+    def _load_sizes(self):
+        if self._sizes is not None:
+            return
+        if py7zr is not None:
+            self.file.seek(0)
+            with py7zr.SevenZipFile(self.file, mode="r") as archive:
+                self._sizes = {
+                    info.filename: info.uncompressed
+                    for info in archive.list()
+                    if not info.is_directory
+                }
+        else:
+            self._extract()
+
+    def namelist(self):
+        self._load_sizes()
+        return list(self._sizes)
+
+    def getsize(self, name):
+        self._load_sizes()
+        return self._sizes[name.replace("\\", "/")]
+
+    def open(self, name):
+        """
+        return:
+            file: binary file of the extracted member
+        """
+        if self._tmp_dir is None:
+            self._extract()
+        name = name.replace("\\", "/")
+        if name not in self._sizes:
+            raise KeyError(name)
+        return open(path.join(self._tmp_dir.name, "out", name), "rb")
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def close(self):
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+
+ARCHIVE_MAGIC = (
+    (b"PK\x03\x04", ".zip"),
+    (b"PK\x05\x06", ".zip"),  # empty zip
+    (b"PK\x07\x08", ".zip"),  # spanned zip
+    (b"Rar!\x1a\x07", ".rar"),
+    (b"7z\xbc\xaf\x27\x1c", ".7z"),
+)
+
+ZIP_COMPRESSION = {
+    zipfile.ZIP_STORED: "stored",
+    zipfile.ZIP_DEFLATED: "deflated",
+    zipfile.ZIP_BZIP2: "bzip2",
+    zipfile.ZIP_LZMA: "lzma",
+}
+
+ArchiveEntry = namedtuple("ArchiveEntry", ["name", "size", "compression", "chain"])
+ArchiveEntry.__doc__ = """
+压缩包内的字幕
+
+    name: str, member name in its archive
+    size: int, uncompressed size
+    compression: str, e.g. "deflated", "rar", "7z"
+    chain: tuple, names of nested archives containing the subtitle,
+           () if in the outermost archive
+"""
+
+
+def detect_archive(head):
+    """
+    根据文件头判断压缩文件类型
+
+    params:
+        head: bytes, first bytes of the file, at least 6 bytes
+    return:
+        datatype: str, '.zip', '.rar' or '.7z', None if unknown
+    """
+
+    for magic, datatype in ARCHIVE_MAGIC:
+        if head.startswith(magic):
+            return datatype
+    return None
+
+
+def open_archive(file, datatype):
+    """
+    打开压缩文件，优先使用文件头判断的类型，无法判断时依次尝试 7z、zip、rar
+
+    params:
+        file: binary file
+        datatype: str, type guessed from the file name
+    return:
+        file_handler: ZipFile, RarFile or P7ZIP
+    """
+
+    file.seek(0)
+    datatype = detect_archive(file.read(8)) or datatype
+    file.seek(0)
 
     if datatype == ".7z":
         try:
-            sub_buff.seek(0)
-            file_handler = P7ZIP(sub_buff)
+            return P7ZIP(file)
         except Exception:
             datatype = ".zip"  # try with zipfile
     if datatype == ".zip":
         try:
-            sub_buff.seek(0)
-            file_handler = zipfile.ZipFile(sub_buff, mode="r")
+            file.seek(0)
+            return zipfile.ZipFile(file, mode="r")
         except Exception:
             datatype = ".rar"  # try with rarfile
-    if datatype == ".rar":
-        sub_buff.seek(0)
-        file_handler = rarfile.RarFile(sub_buff, mode="r")
+    file.seek(0)
+    return rarfile.RarFile(file, mode="r")
 
-    sub_lists_dict = dict()
 
-    for one_file in file_handler.namelist():
-
-        if path.splitext(one_file)[-1] in SUB_FORMATS:
-            sub_lists_dict[one_file] = file_handler
-            continue
-
-        if path.splitext(one_file)[-1] in ARCHIVE_TYPES:
-            data = file_handler.read(one_file)
-            datatype = path.splitext(one_file)[-1]
-            sub_lists_dict.update(get_file_list(data, datatype))
-
-    return sub_lists_dict
+def _members(file_handler):
+    """
+    return:
+        generator of (name, size, compression), directories excluded
+    """
 
+    if isinstance(file_handler, P7ZIP):
+        for name in file_handler.namelist():
+            yield name, file_handler.getsize(name), "7z"
+    elif isinstance(file_handler, zipfile.ZipFile):
+        for info in file_handler.infolist():
+            if not info.filename.endswith("/"):
+                compression = ZIP_COMPRESSION.get(info.compress_type, "unknown")
+                yield info.filename, info.file_size, compression
+    else:
+        for info in file_handler.infolist():
+            if not info.isdir():
+                yield info.filename, info.file_size, "rar"
 
-def run_command(cmd):
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-    )
-    output, error = process.communicate()
-    return output.decode(), error.decode(), process.returncode
 
+class ArchiveIndex:
+    """
+    一次遍历压缩包（包括嵌套的压缩包），生成字幕清单
+    嵌套的压缩包解压至临时文件，超过 spill_size 时写入磁盘，
+    遍历完成后关闭嵌套的压缩包，读取字幕时再打开字幕所在的压缩包；
+    最外层压缩包保持打开直到 close，7z 压缩包因此只解压一次
 
-class P7ZIP:
-    def __init__(self, file):
-        self.data = file.read()
-        # test if it is a valid 7zip file
-        self.namelist()
+    params:
+        data: binary data of an archive file, or a binary file
+        datatype: str, archive type guessed from the file name
+        spill_size: int, nested archives larger than this are kept on disk
+        entries: list, saved entries of the same archive, skip traversing if given
+    """
 
-    def _parse_list_output(self, output):
-        header_pattern = r"\s+Date\s+Time\s+Attr\s+Size\s+Compressed\s+Name\s+"
-        body = re.split(header_pattern, output)[-1]
-        file_names = []
-        for line in body.split("\n")[1:]:
-            if line.startswith("-----"):  # reach end
-                break
-            parts = re.split(r"\s", line.strip())
-            file_name = parts[-1].strip()
-            if path.basename(file_name) == file_name:  # root dir
-                continue
-            file_names.append(file_name)
-        return file_names
+    def __init__(self, data, datatype, spill_size=SPILL_SIZE, entries=None):
+        self.spill_size = spill_size
+        self._files = {(): open_data(data)}  # {chain: binary file}
+        self._types = {(): datatype}  # {chain: datatype}
+        self._handlers = dict()  # {chain: opened file handler}
+        if entries is not None:
+            self.entries = [
+                ArchiveEntry(name, size, compression, tuple(chain))
+                for name, size, compression, chain in entries
+            ]
+            return
+        self.entries = []  # [ArchiveEntry, ...]
+        with metrics.span("archive.list"):
+            self._index(())
+
+    def _handler(self, chain):
+        if chain not in self._handlers:
+            if chain not in self._files:
+                self._extract_nested(chain)
+            self._handlers[chain] = open_archive(self._files[chain], self._types[chain])
+        return self._handlers[chain]
+
+    def _extract_nested(self, chain):
+        nested = tempfile.SpooledTemporaryFile(max_size=self.spill_size)
+        with self._handler(chain[:-1]).open(chain[-1]) as member:
+            shutil.copyfileobj(member, nested)
+        self._files[chain] = nested
+        self._types[chain] = path.splitext(chain[-1])[-1]
+
+    def _index(self, chain):
+        file_handler = self._handler(chain)
+        for name, size, compression in _members(file_handler):
+            ext = path.splitext(name)[-1]
+            if ext in SUB_FORMATS:
+                self.entries.append(ArchiveEntry(name, size, compression, chain))
+            elif ext in ARCHIVE_TYPES:
+                self._index(chain + (name,))
+                # 嵌套的压缩包遍历后立即关闭
+                self._close_handler(chain + (name,))
+
+    def _close_handler(self, chain):
+        file_handler = self._handlers.pop(chain, None)
+        if file_handler is not None:
+            file_handler.close()
 
     def namelist(self):
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            file_path = path.join(tmp_dir, "archive.7z")
-            with open(file_path, "wb") as f:
-                f.write(self.data)
-            cmd = "7z l " + file_path
-            output, err, status = run_command(cmd)
-            if status != 0:
-                raise ValueError(err)
-            file_names = self._parse_list_output(output)
-        return file_names
-
-    def read(self, name):
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            file_path = path.join(tmp_dir, "archive.7z")
-            with open(file_path, "wb") as f:
-                f.write(self.data)
-            cmd_lists = ["7z", "e", file_path, "-o" + tmp_dir, name]
-            cmd = " ".join(cmd_lists)
-            output, err, status = run_command(cmd)
-            if status != 0:
-                raise ValueError(err)
-            sub_file_path = path.join(tmp_dir, path.basename(name))
-            with open(sub_file_path, "rb") as f:
-                sub_data = f.read()
-        return sub_data
+        """
+        return:
+            names: list of str, subtitle names in archive order
+        """
+        return [entry.name for entry in self.entries]
+
+    def find(self, name):
+        """
+        return:
+            entry: ArchiveEntry, the last subtitle with the name
+        """
+        for entry in reversed(self.entries):
+            if entry.name == name:
+                return entry
+        raise KeyError(name)
+
+    def handler(self, chain):
+        """
+        return:
+            file_handler: handler of the archive containing subtitles of chain
+        """
+        return self._handler(chain)
+
+    def read(self, entry):
+        """
+        params:
+            entry: ArchiveEntry or str, subtitle name
+        return:
+            data: bytes
+        """
+        if not isinstance(entry, ArchiveEntry):
+            entry = self.find(entry)
+        return self._handler(entry.chain).read(entry.name)
+
+    def release(self):
+        """ 关闭已打开的压缩包，之后读取时重新打开 """
+        for chain in list(self._handlers):
+            self._close_handler(chain)
+
+    def close(self):
+        self.release()
+        for chain, file in self._files.items():
+            if chain:  # the outermost file belongs to the caller
+                file.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
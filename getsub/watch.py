@@ -0,0 +1,278 @@
+# coding: utf-8
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+import threading
+import ctypes.util
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+
+from getsub.constants import VIDEO_EXTENSIONS
+from getsub.models import Video
+from getsub.util import GroupedOutput
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_event_header = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def _is_video(file_path):
+    return path.splitext(file_path)[-1].lower() in VIDEO_EXTENSIONS
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class PollingWatcher:
+    """
+    定时扫描目录，返回新出现的视频
+
+    params:
+        root: str, directory to watch
+        scanner: LibraryScanner
+        interval: float, seconds between two scans
+    """
+
+    def __init__(self, root, scanner, interval=10):
+        self.root = root
+        self.scanner = scanner
+        self.interval = interval
+        self._known = self._snapshot()
+        self._next_scan = time.monotonic() + interval
+
+    def _snapshot(self):
+        return {
+            path.join(dir_path, name)
+            for dir_path, video_names, _ in self.scanner.scan(self.root)
+            for name in video_names
+        }
+
+    def poll(self, timeout):
+        """
+        等待至多 timeout 秒
+
+        return:
+            paths: list of str, videos created or modified
+        """
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = self._snapshot()
+        new = sorted(snapshot - self._known)
+        self._known = snapshot
+        return new
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    使用 inotify 监视目录及其子目录，新建的子目录自动加入监视
+
+    params:
+        root: str, directory to watch
+        scanner: LibraryScanner, only its pruned directories are used
+    """
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, root, scanner):
+        self.root = root
+        self.scanner = scanner
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = dict()  # {wd: dir_path}
+        self._add_tree(root)
+
+    def _add_tree(self, root):
+        """
+        监视目录树
+
+        return:
+            videos: list of str, videos already in the tree
+        """
+        videos = []
+        for dir_path, dirs, files in os.walk(
+            root, followlinks=self.scanner.follow_symlinks
+        ):
+            dirs[:] = [one for one in dirs if one not in self.scanner.pruned]
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dir_path), InotifyWatcher.mask
+            )
+            if wd >= 0:
+                self._dirs[wd] = dir_path
+            videos.extend(path.join(dir_path, f) for f in files if _is_video(f))
+        return videos
+
+    def poll(self, timeout):
+        """
+        等待至多 timeout 秒
+
+        return:
+            paths: list of str, videos created or modified
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件丢失，重新扫描整个目录
+                changed.extend(self._add_tree(self.root))
+                continue
+            dir_path = self._dirs.get(wd)
+            if dir_path is None:
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            file_path = path.join(dir_path, name)
+            if mask & IN_ISDIR:
+                if name not in self.scanner.pruned:
+                    changed.extend(self._add_tree(file_path))
+            elif _is_video(name):
+                changed.append(file_path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def new_watcher(root, scanner, interval=10):
+    """
+    优先使用 inotify，不可用时定时扫描
+    """
+    try:
+        return InotifyWatcher(root, scanner)
+    except OSError:
+        return PollingWatcher(root, scanner, interval=interval)
+
+
+class WatchDaemon:
+    """
+    监视目录，新视频写入完成后下载字幕
+    同一个 GetSubtitles 对象处理所有视频，连接池和缓存在事件之间保持
+
+    params:
+        get_subtitles: GetSubtitles
+        watcher: InotifyWatcher or PollingWatcher
+        settle: float, seconds a video's size and mtime stay unchanged
+                before it is considered completely written
+        tick: float, seconds between two checks of pending videos
+    """
+
+    def __init__(self, get_subtitles, watcher, settle=5, tick=1):
+        self.get_subtitles = get_subtitles
+        self.watcher = watcher
+        self.settle = settle
+        self.tick = tick
+        self._pending = dict()  # {path: ((size, mtime), since)}
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def add(self, file_path):
+        """ 视频有变化，重新开始计时 """
+        self._pending[file_path] = None
+
+    def ready(self, now=None):
+        """
+        return:
+            paths: list of str, videos not changed for settle seconds
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        for file_path, state in list(self._pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except OSError:  # deleted or renamed
+                del self._pending[file_path]
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if state is None or state[0] != signature:
+                self._pending[file_path] = (signature, now)
+                continue
+            with self._lock:
+                running = file_path in self._running
+            if not running and now - state[1] >= self.settle:
+                del self._pending[file_path]
+                ready.append(file_path)
+        return ready
+
+    def _process(self, output, file_path):
+        gs = self.get_subtitles
+        video = Video(
+            file_path, sub_store_path=gs.sub_store_path, identifier=gs.sub_identifier
+        )
+        try:
+            with output.group():
+                failed = gs.process_one_video(video)
+                print("\n========================================================")
+            return failed
+        finally:
+            with self._lock:
+                self._running.discard(file_path)
+
+    def run(self, stop=None):
+        """
+        持续监视，直到 stop 被设置或 Ctrl-C
+
+        params:
+            stop: threading.Event or None
+        """
+        stop = stop or threading.Event()
+        output = GroupedOutput(sys.stdout)
+        sys.stdout = output
+        try:
+            with ThreadPoolExecutor(max_workers=self.get_subtitles.jobs) as executor:
+                while not stop.is_set():
+                    for file_path in self.watcher.poll(self.tick):
+                        self.add(file_path)
+                    for file_path in self.ready():
+                        with self._lock:
+                            self._running.add(file_path)
+                        executor.submit(self._process, output, file_path)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout = output.stream
+            self.watcher.close()
@@ -16,6 +16,8 @@ setup(
         "guessit==3.1.0",
         "rarfile>=3.0",
     ],
+    extras_require={"async": ["aiohttp>=3.6"], "7z": ["py7zr>=0.9"]},
+    python_requires=">=3.7",
     entry_points={"console_scripts": ["getsub = getsub.main: main"]},
     zip_safe=False,
     long_description=__doc__,
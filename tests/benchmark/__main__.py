@@ -0,0 +1,251 @@
+# coding: utf-8
+
+"""
+python -m tests.benchmark [--update-baseline] [--timing [--tolerance 1.0]]
+
+使用录制的 zimuku/zimuzu 网页和字幕包运行完整的搜索到解压流程，
+输出 getsub.metrics 记录的各阶段耗时，
+请求数、网页解析次数、压缩包列表次数等计数与 baselines.json 不同时返回 1
+
+耗时与机器和 guessit 预热有关，默认只输出，
+--timing 时各次运行的中位数比基线中位数慢 tolerance 以上返回 1
+"""
+
+import sys
+import json
+import argparse
+from os import path
+from statistics import median
+
+from tests.benchmark.scenarios import EPISODES, SCENARIOS, run_scenario
+
+baselines_path = path.join(path.dirname(path.realpath(__file__)), "baselines.json")
+# 中位数低于此值的阶段误差太大，不比较耗时
+MIN_TIMING_MS = 5.0
+
+
+def build_arg_parser():
+    arg_parser = argparse.ArgumentParser(prog="python -m tests.benchmark")
+    arg_parser.add_argument(
+        "scenarios", nargs="*", help="scenarios to run, default: all"
+    )
+    arg_parser.add_argument(
+        "--episodes", type=int, default=EPISODES, help="videos of each run"
+    )
+    arg_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="runs of each scenario, the fastest is printed",
+    )
+    arg_parser.add_argument(
+        "--latency", type=float, default=0, help="seconds added to every request"
+    )
+    arg_parser.add_argument(
+        "--baseline", default=baselines_path, help="baseline file to compare with"
+    )
+    arg_parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="save this run as the baseline instead of comparing",
+    )
+    arg_parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="also fail when the median time is slower than the baseline median",
+    )
+    arg_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        help="allowed slowdown of --timing, 1.0 means twice the baseline",
+    )
+    arg_parser.add_argument("--json", action="store_true", help="print raw results")
+    return arg_parser
+
+
+def counts(result):
+    """
+    与机器无关的计数，相同的录制文件每次运行结果相同
+
+    return:
+        counts: dict, {"success", "requests", "bytes", "spans", "counters"}
+    """
+
+    return {
+        "success": result["success"],
+        "requests": result["requests"],
+        "bytes": result["bytes"],
+        "spans": {name: span["count"] for name, span in result["spans"].items()},
+        "counters": dict(result["counters"]),
+    }
+
+
+def timings(runs):
+    """
+    各次运行耗时的中位数，与机器有关，只在 --timing 时比较
+
+    return:
+        timing: dict, {"wall_ms", "spans": {span: total_ms}}
+    """
+
+    names = sorted(set().union(*(run["spans"] for run in runs)))
+    return {
+        "wall_ms": round(median(run["wall_ms"] for run in runs), 3),
+        "spans": {
+            name: round(
+                median(run["spans"].get(name, {}).get("total_ms", 0) for run in runs),
+                3,
+            )
+            for name in names
+        },
+    }
+
+
+def print_result(name, result):
+    print(
+        "\n%s: %s/%s videos  %.1f ms  %.2f videos/s  %s requests  %s bytes"
+        % (
+            name,
+            result["success"],
+            result["videos"],
+            result["wall_ms"],
+            result["videos_per_s"],
+            result["requests"],
+            result["bytes"],
+        )
+    )
+    print("  %-24s %6s %10s %9s" % ("span", "count", "total_ms", "mean_ms"))
+    for span, stats in sorted(result["spans"].items()):
+        print(
+            "  %-24s %6s %10.2f %9.3f"
+            % (span, stats["count"], stats["total_ms"], stats["mean_ms"])
+        )
+    print("  %-24s %6s" % ("counter", "value"))
+    for counter, value in sorted(result["counters"].items()):
+        print("  %-24s %6s" % (counter, value))
+
+
+def compare(name, current, baseline):
+    """
+    return:
+        changes: list, ["scenario key: baseline -> current", ...]
+    """
+
+    changes = []
+
+    def check(label, base, value):
+        if base != value:
+            changes.append("%s %s: %s -> %s" % (name, label, base, value))
+
+    for key in ("success", "requests", "bytes"):
+        check(key, baseline[key], current[key])
+    for group in ("spans", "counters"):
+        for key in sorted(set(baseline[group]) | set(current[group])):
+            check(key, baseline[group].get(key, 0), current[group].get(key, 0))
+    return changes
+
+
+def compare_timing(name, current, baseline, tolerance):
+    """
+    只报告比基线慢 tolerance 以上的耗时，变快不报告
+
+    return:
+        changes: list, ["scenario key: baseline ms -> current ms", ...]
+    """
+
+    changes = []
+
+    def check(label, base, value):
+        if base >= MIN_TIMING_MS and value > base * (1 + tolerance):
+            changes.append("%s %s: %.1f ms -> %.1f ms" % (name, label, base, value))
+
+    check("wall_ms", baseline["wall_ms"], current["wall_ms"])
+    for key, base in sorted(baseline["spans"].items()):
+        check(key, base, current["spans"].get(key, 0))
+    return changes
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    names = args.scenarios or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            print("NO SUCH SCENARIO: %s, choose from %s" % (name, ", ".join(SCENARIOS)))
+            return 2
+
+    results, timing = dict(), dict()
+    for name in names:
+        runs = [
+            run_scenario(name, args.episodes, args.latency) for _ in range(args.repeat)
+        ]
+        result = min(runs, key=lambda run: run["wall_ms"])
+        if result["success"] != result["videos"]:
+            print("%s: %s videos failed" % (name, result["videos"] - result["success"]))
+            return 1
+        results[name] = result
+        timing[name] = timings(runs)
+        if args.json:
+            print(json.dumps({name: result}, indent=2))
+        else:
+            print_result(name, result)
+
+    current = {name: counts(result) for name, result in results.items()}
+    if args.update_baseline:
+        scenarios = {
+            name: dict(result, timing=timing[name]) for name, result in current.items()
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "episodes": args.episodes,
+                    "latency": args.latency,
+                    "scenarios": scenarios,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        print("\nbaseline saved: " + args.baseline)
+        return 0
+
+    if not path.exists(args.baseline):
+        print("\nno baseline, run with --update-baseline first")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["episodes"] != args.episodes:
+        print("\nbaseline was recorded with other --episodes, skip comparing")
+        return 0
+
+    changes, slower = [], []
+    for name, result in current.items():
+        if name in baseline["scenarios"]:
+            changes += compare(name, result, baseline["scenarios"][name])
+    if args.timing:
+        if baseline.get("latency", 0) != args.latency:
+            print("\nbaseline was recorded with other --latency, skip timing")
+        else:
+            for name, result in timing.items():
+                base = baseline["scenarios"].get(name, {}).get("timing")
+                if base is not None:
+                    slower += compare_timing(name, result, base, args.tolerance)
+    if changes:
+        print("\nCOUNTS CHANGED (run with --update-baseline if expected):")
+        for change in changes:
+            print("  " + change)
+    if slower:
+        print(
+            "\nSLOWER THAN BASELINE MEDIAN (tolerance %d%%):" % (args.tolerance * 100)
+        )
+        for change in slower:
+            print("  " + change)
+    if changes or slower:
+        return 1
+    print("\nsame counts as " + args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# coding: utf-8
+
+import re
+import json
+import time
+import threading
+from io import BytesIO
+from os import path
+from unittest import mock
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
+
+fixtures_path = path.join(path.dirname(path.realpath(__file__)), "fixtures")
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    按 fixtures/routes.json 返回录制的网页和字幕包，不访问网络
+    没有录制的链接抛出 requests.ConnectionError
+
+    params:
+        fixtures_dir: str, directory of routes.json and recorded files
+        latency: float, seconds added to every request to simulate round trips
+    """
+
+    def __init__(self, fixtures_dir=fixtures_path, latency=0):
+        super().__init__()
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        with open(path.join(fixtures_dir, "routes.json"), encoding="utf-8") as f:
+            self.routes = [
+                (re.compile(route["pattern"]), route) for route in json.load(f)
+            ]
+        self.urls = []  # requested urls in order
+        self.bytes_sent = 0
+        self._bodies = dict()  # {file: bytes}
+        self._lock = threading.Lock()
+
+    def _body(self, file):
+        if file not in self._bodies:
+            with open(path.join(self.fixtures_dir, file), "rb") as f:
+                self._bodies[file] = f.read()
+        return self._bodies[file]
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        for pattern, route in self.routes:
+            if pattern.search(request.url):
+                break
+        else:
+            raise requests.ConnectionError("no recorded response for " + request.url)
+
+        if self.latency:
+            time.sleep(self.latency)
+        body = self._body(route["file"])
+        with self._lock:
+            self.urls.append(request.url)
+            self.bytes_sent += len(body)
+        headers = dict(route.get("headers", {}))
+        headers["Content-Length"] = str(len(body))
+        raw = HTTPResponse(
+            body=BytesIO(body),
+            headers=headers,
+            status=route.get("status", 200),
+            preload_content=False,
+            decode_content=False,
+        )
+        return HTTPAdapter.build_response(self, request, raw)
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def replay(manager, adapter):
+    """
+    manager 之后创建的 session 通过 adapter 发送所有请求，
+    需在创建 GetSubtitles 之前进入
+
+    params:
+        manager: SessionManager, e.g. Downloader.sessions
+        adapter: ReplayAdapter
+    """
+
+    def new_session():
+        session = requests.Session()
+        session.headers.update(manager.headers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    with mock.patch.object(manager, "_new_session", new_session):
+        manager.configure()  # drop the current session
+        try:
+            yield adapter
+        finally:
+            manager.configure()
@@ -0,0 +1,99 @@
+# coding: utf-8
+
+import os
+import time
+import shutil
+import tempfile
+from io import StringIO
+from os import path
+from contextlib import redirect_stdout
+
+from getsub.main import GetSubtitles
+from getsub.util import guessit_cache
+from getsub.downloader import DownloaderManager
+from getsub.downloader.downloader import Downloader
+from tests.benchmark.replay import ReplayAdapter, replay
+
+EPISODES = 12  # episodes in the recorded season pack
+
+# {name: (downloader, GetSubtitles keyword arguments)}
+SCENARIOS = {
+    "zimuku": ("zimuku", {}),
+    "zimuku-jobs4": ("zimuku", {"jobs": 4}),
+    "zimuku-prefetch2": ("zimuku", {"prefetch": 2}),
+    "zimuku-fan-out": ("zimuku", {"fan_out": True}),
+    "zimuzu": ("zimuzu", {}),
+}
+
+
+def create_season(parent_dir, episodes=EPISODES):
+    """
+    return:
+        video_dir: str, directory of empty videos of the recorded season
+    """
+    video_dir = path.join(parent_dir, "The Expanse Season 1")
+    os.mkdir(video_dir)
+    for episode in range(1, episodes + 1):
+        name = "The.Expanse.S01E%02d.720p.WEB-DL.mkv" % episode
+        open(path.join(video_dir, name), "w").close()
+    return video_dir
+
+
+def run_scenario(name, episodes=EPISODES, latency=0):
+    """
+    使用录制的响应处理一季视频，缓存目录为空，guessit 缓存清空
+    spans 和 counters 为 getsub.metrics 在本次运行中的记录
+
+    params:
+        name: str, key of SCENARIOS
+        episodes: int, number of videos, at most EPISODES
+        latency: float, seconds added to every request
+    return:
+        result: dict, {"videos", "success", "wall_ms", "videos_per_s",
+                       "requests", "bytes", "spans", "counters"}
+    """
+
+    downloader, kwargs = SCENARIOS[name]
+    work_dir = tempfile.mkdtemp()
+    try:
+        video_dir = create_season(work_dir, episodes)
+        guessit_cache.clear()
+        adapter = ReplayAdapter(latency=latency)
+        with replay(Downloader.sessions, adapter):
+            with redirect_stdout(StringIO()):
+                gs = GetSubtitles(
+                    video_dir,
+                    False,  # query
+                    False,  # single
+                    False,  # more
+                    False,  # both
+                    False,  # over
+                    False,  # plex
+                    False,  # debug
+                    5,  # sub_num
+                    downloader,
+                    "",  # sub_path
+                    cache_dir=path.join(work_dir, "cache"),
+                    **kwargs
+                )
+                start = time.perf_counter()
+                summary = gs.start()
+                wall = time.perf_counter() - start
+            for store in (gs.cache, gs.negative, gs.archives):
+                store.close()
+            guessit_cache.store = None
+            for downloader in DownloaderManager.downloaders:
+                downloader.cache = None
+    finally:
+        shutil.rmtree(work_dir)
+
+    return {
+        "videos": summary["total"],
+        "success": summary["success"],
+        "wall_ms": round(wall * 1000, 3),
+        "videos_per_s": round(summary["total"] / wall, 2),
+        "requests": len(adapter.urls),
+        "bytes": adapter.bytes_sent,
+        "spans": summary["metrics"]["spans"],
+        "counters": summary["metrics"]["counters"],
+    }
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+import unittest
+from io import StringIO
+from contextlib import redirect_stdout
+
+import requests
+
+from getsub.downloader.downloader import Downloader
+from tests.benchmark.replay import ReplayAdapter, replay
+from tests.benchmark.scenarios import SCENARIOS, run_scenario
+from tests.benchmark.__main__ import main, compare_timing
+
+
+class TestReplay(unittest.TestCase):
+    def test_unknown_url(self):
+        with replay(Downloader.sessions, ReplayAdapter()):
+            with self.assertRaises(requests.ConnectionError):
+                Downloader.sessions.session().get("http://example.com/")
+
+    def test_scenarios(self):
+        # 所有场景都能完整运行，各阶段都有记录
+        for name, (downloader, _) in SCENARIOS.items():
+            with self.subTest(scenario=name):
+                result = run_scenario(name, episodes=3)
+                self.assertEqual(result["success"], 3)
+                for span in ("search", "guess", "write", "archive.list"):
+                    self.assertIn(span, result["spans"])
+                for span in ("get_subtitles", "download_file", "parse"):
+                    self.assertIn("%s.%s" % (downloader, span), result["spans"])
+
+    def test_baseline(self):
+        # 请求数和各阶段次数与 baselines.json 相同
+        with redirect_stdout(StringIO()) as output:
+            code = main(["--repeat", "1"])
+        self.assertEqual(code, 0, output.getvalue())
+
+    def test_compare_timing(self):
+        baseline = {"wall_ms": 100.0, "spans": {"search": 40.0, "write": 1.0}}
+        faster = {"wall_ms": 50.0, "spans": {"search": 20.0, "write": 0.5}}
+        self.assertEqual(compare_timing("s", faster, baseline, 1.0), [])
+        # 基线很短的阶段不比较
+        slower = {"wall_ms": 150.0, "spans": {"search": 90.0, "write": 9.0}}
+        self.assertEqual(
+            compare_timing("s", slower, baseline, 1.0),
+            ["s search: 40.0 ms -> 90.0 ms"],
+        )
+        self.assertEqual(len(compare_timing("s", slower, baseline, 0.2)), 2)
+
+    def test_baseline_timing(self):
+        # 基线中保存了耗时中位数，--timing 可以比较
+        with redirect_stdout(StringIO()) as output:
+            code = main(["zimuku", "--repeat", "1", "--timing", "--tolerance", "100"])
+        self.assertEqual(code, 0, output.getvalue())
+        self.assertNotIn("skip timing", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
 # coding: utf-8
 
 from getsub.main import GetSubtitles
+from getsub.downloader import DownloaderManager
+from getsub.util import guessit_cache
 
 
 def get_function(
@@ -16,7 +18,13 @@ def get_function(
     sub_num=1,
     downloader=None,
     sub_path="",
+    jobs=1,
+    parallel_search=False,
+    search_timeout=None,
+    cache_dir=None,
 ):
+    # 默认不使用缓存，测试不写入 ~/.cache/getsub
+    # 传入临时目录 cache_dir 时使用缓存，测试结束后需调用 reset_caches
     obj = GetSubtitles(
         name,
         query,
@@ -29,5 +37,18 @@ def get_function(
         sub_num,
         downloader,
         sub_path,
+        jobs=jobs,
+        parallel_search=parallel_search,
+        search_timeout=search_timeout,
+        cache_dir=cache_dir or "",
+        no_cache=cache_dir is None,
     )
     return getattr(obj, func)
+
+
+def reset_caches():
+    """ 清除 GetSubtitles 设置的全局缓存，之后的测试不受影响 """
+    guessit_cache.store = None
+    guessit_cache.clear()
+    for downloader in DownloaderManager.downloaders:
+        downloader.cache = None
@@ -0,0 +1,202 @@
+# coding: utf-8
+
+import sys
+import time
+import shutil
+import asyncio
+import unittest
+import tempfile
+from os import path
+from io import StringIO
+from unittest import mock
+from collections import OrderedDict
+
+from getsub.cache import NegativeCache
+from getsub.index import LibraryIndex
+from getsub.models import Video
+from getsub.util import GroupedOutput
+from tests.unit.getsubtitles import get_function as get_f, reset_caches
+
+
+def get_function(**kwargs):
+    return get_f("get_search_results", **kwargs)
+
+
+class FakeDownloader:
+    def __init__(self, name, subs, delay=0, error=None):
+        self.name = name
+        self.subs = subs
+        self.delay = delay
+        self.error = error
+        self.called = False
+
+    def get_subtitles(self, video, sub_num=5):
+        self.called = True
+        print("Searching %s..." % self.name)
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return OrderedDict((key, {"lan": 4, "score": 1}) for key in self.subs)
+
+    async def aget_subtitles(self, video, sub_num=5, client=None):
+        self.called = True
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return OrderedDict((key, {"lan": 4, "score": 1}) for key in self.subs)
+
+
+class TestGetSearchResults(unittest.TestCase):
+    def build(self, downloaders, **kwargs):
+        get_search_results = get_function(**kwargs)
+        get_search_results.__self__.downloader = downloaders
+        return get_search_results
+
+    def test_sequential_stops_early(self):
+        second = FakeDownloader("b", ["b1"])
+        get_search_results = self.build(
+            [FakeDownloader("a", ["a1", "a2"]), second], sub_num=2
+        )
+        self.assertEqual(list(get_search_results(None)), ["a1", "a2"])
+        self.assertFalse(second.called)
+
+    def test_parallel_merge_in_downloader_order(self):
+        get_search_results = self.build(
+            [FakeDownloader("a", ["a1"], delay=0.1), FakeDownloader("b", ["b1"])],
+            sub_num=5,
+            parallel_search=True,
+        )
+        self.assertEqual(list(get_search_results(None)), ["a1", "b1"])
+
+    def test_parallel_deadline(self):
+        get_search_results = self.build(
+            [FakeDownloader("a", ["a1"], delay=1), FakeDownloader("b", ["b1"])],
+            sub_num=5,
+            parallel_search=True,
+            search_timeout=0.2,
+        )
+        start = time.time()
+        self.assertEqual(list(get_search_results(None)), ["b1"])
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_parallel_enough_results(self):
+        get_search_results = self.build(
+            [FakeDownloader("a", ["a1"], delay=1), FakeDownloader("b", ["b1", "b2"])],
+            sub_num=2,
+            parallel_search=True,
+        )
+        start = time.time()
+        self.assertEqual(list(get_search_results(None)), ["b1", "b2"])
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_parallel_provider_error(self):
+        get_search_results = self.build(
+            [
+                FakeDownloader("a", [], error=ValueError("needs updates")),
+                FakeDownloader("b", ["b1"]),
+            ],
+            parallel_search=True,
+        )
+        self.assertEqual(list(get_search_results(None)), ["b1"])
+
+    def test_parallel_output_grouped(self):
+        get_search_results = self.build(
+            [FakeDownloader("a", ["a1"]), FakeDownloader("b", ["b1"])],
+            parallel_search=True,
+        )
+        output = GroupedOutput(StringIO())
+        with mock.patch.object(sys, "stdout", output), output.capture() as buff:
+            get_search_results(None)
+        # 搜索线程的输出属于调用方所在视频的分组
+        self.assertIn("Searching a...", buff.getvalue())
+        self.assertIn("Searching b...", buff.getvalue())
+        self.assertEqual(output.stream.getvalue(), "")
+
+
+class TestNegativeResults(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build(self, downloaders):
+        process_video = get_f("process_video")
+        process_video.__self__.downloader = downloaders
+        process_video.__self__.negative = NegativeCache(self.cache_dir)
+        return process_video
+
+    def test_skip_search(self):
+        video = Video("Show.S01E01.720p.mkv")
+        downloader = FakeDownloader("a", [])
+        process_video = self.build([downloader])
+        self.assertEqual(process_video(video), ("no search results. ", []))
+        downloader.called = False
+        with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+            error, _ = process_video(video)
+        self.assertIn("cached", error)
+        self.assertIn("skipped (negative cache until ", stdout.getvalue())
+        self.assertFalse(downloader.called)
+
+    def test_off_by_default(self):
+        # 一次性运行不跳过之前没有结果的视频
+        gs = get_f("process_video", cache_dir=self.cache_dir).__self__
+        try:
+            self.assertTrue(gs.cache.enabled)
+            self.assertFalse(gs.negative.enabled)
+        finally:
+            reset_caches()
+
+    def test_index_follows_negative_schedule(self):
+        video = Video("Show.S01E01.720p.mkv")
+        process_video = self.build([FakeDownloader("a", [])])
+        gs = process_video.__self__
+        gs.index = LibraryIndex(self.cache_dir, backoff=60)
+        with mock.patch.object(gs, "process_video", process_video):
+            gs.process_one_video(video)
+        next_check = gs.negative.next_check(NegativeCache.key(video.info))
+        video_path = path.join(video.path, video.name + video.type)
+        # 索引不会在 negative 记录到期前重试
+        self.assertFalse(gs.index.is_due(video_path, now=next_check - 1))
+        self.assertTrue(gs.index.is_due(video_path, now=next_check))
+        gs.index.close()
+
+    def test_failed_search_not_recorded(self):
+        video = Video("Show.S01E01.720p.mkv")
+        downloaders = [
+            FakeDownloader("a", [], error=ValueError("needs updates")),
+            FakeDownloader("b", []),
+        ]
+        process_video = self.build(downloaders)
+        process_video(video)
+        self.assertEqual(process_video.__self__.negative.list(), [])
+
+
+class TestAGetSearchResults(unittest.TestCase):
+    def run_search(self, downloaders, **kwargs):
+        get_search_results = get_f("aget_search_results", **kwargs)
+        get_search_results.__self__.downloader = downloaders
+        return asyncio.run(get_search_results(None, None))
+
+    def test_sequential_stops_early(self):
+        second = FakeDownloader("b", ["b1"])
+        results = self.run_search(
+            [FakeDownloader("a", ["a1", "a2"]), second], sub_num=2
+        )
+        self.assertEqual(list(results), ["a1", "a2"])
+        self.assertFalse(second.called)
+
+    def test_parallel_deadline_cancels_late_provider(self):
+        start = time.time()
+        results = self.run_search(
+            [FakeDownloader("a", ["a1"], delay=5), FakeDownloader("b", ["b1"])],
+            sub_num=5,
+            parallel_search=True,
+            search_timeout=0.2,
+        )
+        self.assertEqual(list(results), ["b1"])
+        self.assertLess(time.time() - start, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
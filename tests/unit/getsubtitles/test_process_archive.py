@@ -4,7 +4,9 @@ import os
 from os import path
 import copy
 import shutil
+import zipfile
 import unittest
+from io import BytesIO
 from unittest import mock
 
 import rarfile
@@ -12,6 +14,7 @@ import rarfile
 from tests import create_test_directory
 from tests.unit import assets_path
 from tests.unit.getsubtitles import get_function as get_f
+from getsub.main import PendingVideos
 from getsub.models import Video
 
 
@@ -138,6 +141,39 @@ class TestProcessArchive(unittest.TestCase):
             and "sub1.zh.srt" not in os.listdir(TestProcessArchive.test_dir)
         )
 
+    def test_fan_out(self):
+        names = ["Show.S01E0%d.mkv" % i for i in (1, 2, 3)]
+        create_test_directory(
+            {name: None for name in names + ["Other.S01E02.mkv"]},
+            parent_dir=TestProcessArchive.test_dir,
+        )
+        data = BytesIO()
+        with zipfile.ZipFile(data, "w") as archive:
+            for i in (3, 2, 1):
+                archive.writestr("pack/Show.S01E0%d.chs.srt" % i, "sub%d" % i)
+        process_archive = get_function()
+        gs = process_archive.__self__
+        gs.pending = PendingVideos()
+        videos = [
+            Video(path.join(TestProcessArchive.test_dir, name))
+            for name in names + ["Other.S01E02.mkv"]
+        ]
+        list(gs._register(videos))
+        gs.pending.start(videos[0])
+
+        err, subnames = process_archive(
+            videos[0], data.getvalue(), ".zip", archive_name="[zimuku]pack"
+        )
+        self.assertEqual(err, "")
+        for i in (1, 2, 3):
+            sub_path = path.join(TestProcessArchive.test_dir, "Show.S01E0%d.srt" % i)
+            with open(sub_path) as f:
+                self.assertEqual(f.read(), "sub%d" % i)
+        self.assertFalse(gs._check_video(videos[1]))
+        self.assertFalse(gs._check_video(videos[2]))
+        # 其他剧集不分配
+        self.assertTrue(gs._check_video(videos[3]))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,163 @@
+# coding: utf-8
+
+import time
+import shutil
+import asyncio
+import unittest
+import tempfile
+import threading
+from unittest import mock
+
+from getsub.main import SearchResults
+from getsub.models import Video
+from tests.unit.getsubtitles import get_function, reset_caches
+
+
+class FakeDownloader:
+    def __init__(self, delay=0.2, datatype=".srt"):
+        self.delay = delay
+        self.datatype = datatype
+        self.started = []
+        self.cancels = []
+        self._lock = threading.Lock()
+
+    def resolve_link(self, link, session=None):
+        return link
+
+    async def aresolve_link(self, link, session=None, client=None):
+        return link
+
+    def download_file(self, name, link, session=None, cancel=None):
+        with self._lock:
+            self.started.append(name)
+            self.cancels.append(cancel)
+        time.sleep(self.delay)
+        return self.datatype, name.encode(), ""
+
+    async def adownload_file(self, name, link, session=None, client=None):
+        self.started.append(name)
+        await asyncio.sleep(self.delay)
+        return self.datatype, name.encode(), ""
+
+
+def fake_process_download(video, chosen_sub, datatype, data, digest=None):
+    # 只有 c 能猜测到字幕
+    if chosen_sub == "c":
+        return "", [("c.srt", ".srt")]
+    return "", []
+
+
+class TestPrefetch(unittest.TestCase):
+    def tearDown(self):
+        reset_caches()
+
+    def run_video(self, names, prefetch, asyncio_mode=False, gs=None, **kwargs):
+        gs = gs or get_function("process_video").__self__
+        gs.prefetch = prefetch
+        downloader = FakeDownloader(**kwargs)
+        results = SearchResults(
+            (name, {"link": name, "session": None, "lan": 4}) for name in names
+        )
+        video = Video("Show.S01E01.mkv")
+        with mock.patch.object(
+            gs, "_check_negative", return_value=""
+        ), mock.patch.object(gs, "_record_search"), mock.patch.object(
+            gs, "_get_downloader", return_value=downloader
+        ), mock.patch.object(
+            gs, "process_download", side_effect=fake_process_download
+        ):
+            start = time.monotonic()
+            if asyncio_mode:
+                with mock.patch.object(
+                    gs, "aget_search_results", mock.AsyncMock(return_value=results)
+                ):
+                    result = asyncio.run(gs.aprocess_video(video, None))
+            else:
+                with mock.patch.object(gs, "get_search_results", return_value=results):
+                    result = gs.process_video(video)
+            return result, time.monotonic() - start, downloader
+
+    def test_off_by_default(self):
+        self.assertEqual(get_function("process_video").__self__.prefetch, 0)
+
+    def test_sequential(self):
+        result, elapsed, downloader = self.run_video(["a", "b", "c"], prefetch=0)
+        self.assertEqual(result, ("", [("c.srt", ".srt")]))
+        self.assertGreaterEqual(elapsed, 0.6)
+        self.assertEqual(downloader.started, ["a", "b", "c"])
+
+    def test_prefetch(self):
+        result, elapsed, downloader = self.run_video(
+            ["a", "b", "c", "d", "e"], prefetch=2
+        )
+        self.assertEqual(result, ("", [("c.srt", ".srt")]))
+        self.assertLess(elapsed, 0.55)
+        # 第一个候选下载完成、开始解压时才提前下载之后的候选
+        self.assertEqual(downloader.started[0], "a")
+        self.assertEqual(sorted(downloader.started[1:3]), ["b", "c"])
+        # 找到字幕后取消提前开始的下载，排队中的下载不再开始
+        self.assertLessEqual(set(downloader.started), set("abcde"))
+        self.assertTrue(all(cancel.is_set() for cancel in downloader.cancels))
+
+    def test_unused_not_saved(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        gs = get_function("process_video", cache_dir=cache_dir).__self__
+        self.run_video(["a", "b", "c", "d", "e"], prefetch=2, gs=gs, datatype=".zip")
+        time.sleep(0.3)  # 等待被取消的下载结束
+        for name in ("a", "b", "c"):
+            self.assertIsNotNone(gs.archives.get(name))
+        for name in ("d", "e"):
+            self.assertIsNone(gs.archives.get(name))
+        gs.archives.close()
+
+    def test_aprefetch(self):
+        result, elapsed, downloader = self.run_video(
+            ["a", "b", "c"], prefetch=2, asyncio_mode=True
+        )
+        self.assertEqual(result, ("", [("c.srt", ".srt")]))
+        self.assertLess(elapsed, 0.55)
+
+
+class TestArchiveStore(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        reset_caches()
+        shutil.rmtree(self.cache_dir)
+
+    def download(self, links, resolve=lambda link: link):
+        gs = get_function("process_video", cache_dir=self.cache_dir).__self__
+        downloader = mock.Mock()
+        downloader.resolve_link.side_effect = lambda link, session: resolve(link)
+        downloader.download_file.return_value = (".zip", b"season pack", "")
+        with mock.patch.object(gs, "_get_downloader", return_value=downloader):
+            results = [gs.download_result("[zimuku]pack", link, None) for link in links]
+        gs.archives.close()
+        return downloader, results
+
+    def test_download_once(self):
+        downloader, (first, second) = self.download(["link", "link"])
+        self.assertEqual(downloader.download_file.call_count, 1)
+        self.assertEqual(downloader.resolve_link.call_count, 1)
+        self.assertEqual(first[:3], (".zip", b"season pack", ""))
+        datatype, file, error, digest = second
+        with file:
+            self.assertEqual(file.read(), b"season pack")
+        self.assertEqual((datatype, error, digest), (".zip", "", first[3]))
+
+    def test_same_download_link(self):
+        # 同一季各集的详情页不同，解析出的下载链接相同
+        downloader, results = self.download(
+            ["detail1", "detail2", "detail3"], resolve=lambda link: "download"
+        )
+        self.assertEqual(downloader.download_file.call_count, 1)
+        self.assertEqual(downloader.download_file.call_args[0][1], "download")
+        self.assertEqual(len({result[3] for result in results}), 1)
+        for _, data, _, _ in results[1:]:
+            data.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
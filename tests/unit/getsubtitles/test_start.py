@@ -0,0 +1,146 @@
+# coding: utf-8
+
+import os
+import sys
+import json
+import asyncio
+import shutil
+import unittest
+from os import path
+from unittest import mock
+
+from tests import create_test_directory
+from tests.unit.getsubtitles import get_function as get_f
+from getsub.main import PendingVideos
+
+
+def get_function(**kwargs):
+    return get_f("start", **kwargs)
+
+
+def fake_process_video(video):
+    if video.name.startswith("fail"):
+        return "no search results. ", []
+    return "", [[video.name + ".ass", ".ass"]]
+
+
+async def fake_aprocess_video(video, client):
+    await asyncio.sleep(0)
+    return fake_process_video(video)
+
+
+class TestStart(unittest.TestCase):
+
+    test_dir = path.join(os.getcwd(), "TESTSTART")
+    test_dir_structure = {
+        "fail1.mkv": None,
+        "ok1.mkv": None,
+        "fail2.mkv": None,
+        "ok2.mkv": None,
+        "done.mkv": None,
+        "done.ass": None,
+    }
+
+    def setUp(self):
+        create_test_directory(
+            TestStart.test_dir_structure, parent_dir=TestStart.test_dir
+        )
+
+    def tearDown(self):
+        shutil.rmtree(TestStart.test_dir)
+
+    def run_start(self, jobs, with_metrics=False):
+        start = get_function(name=TestStart.test_dir, jobs=jobs)
+        with mock.patch.object(
+            start.__self__, "process_video", side_effect=fake_process_video
+        ):
+            result = start()
+        # 耗时和缓存命中数每次运行都不同
+        run_metrics = result.pop("metrics")
+        return (result, run_metrics) if with_metrics else result
+
+    def test_sequential(self):
+        result = self.run_start(jobs=1)
+        self.assertEqual((result["total"], result["success"]), (5, 3))
+        names = sorted(one["name"] for one in result["fail_videos"])
+        self.assertEqual(names, ["fail1", "fail2"])
+
+    def test_metrics(self):
+        _, run_metrics = self.run_start(jobs=4, with_metrics=True)
+        self.assertEqual(run_metrics["counters"]["videos.success"], 2)
+        self.assertEqual(run_metrics["counters"]["videos.failed"], 2)
+        json.dumps(run_metrics)  # serializable
+
+    def test_concurrent_same_result(self):
+        sequential = self.run_start(jobs=1)
+        concurrent = self.run_start(jobs=4)
+        self.assertEqual(sequential, concurrent)
+
+    def test_asyncio_same_result(self):
+        sequential = self.run_start(jobs=1)
+        astart = get_f("astart", name=TestStart.test_dir, jobs=4)
+        with mock.patch.object(
+            astart.__self__, "aprocess_video", side_effect=fake_aprocess_video
+        ):
+            result = asyncio.run(astart())
+        result.pop("metrics")
+        self.assertEqual(sequential, result)
+
+    def test_stdout_not_replaced(self):
+        # 依次处理时直接输出，不替换 sys.stdout
+        stdout = sys.stdout
+        seen = []
+
+        def process_video(video):
+            seen.append(sys.stdout)
+            return fake_process_video(video)
+
+        async def aprocess_video(video, client):
+            return process_video(video)
+
+        start = get_function(name=TestStart.test_dir, jobs=1)
+        with mock.patch.object(
+            start.__self__, "process_video", side_effect=process_video
+        ):
+            start()
+        astart = get_f("astart", name=TestStart.test_dir, jobs=1)
+        with mock.patch.object(
+            astart.__self__, "aprocess_video", side_effect=aprocess_video
+        ):
+            asyncio.run(astart())
+        self.assertEqual(len(seen), 8)
+        self.assertTrue(all(output is stdout for output in seen))
+        self.assertIs(sys.stdout, stdout)
+
+    def test_fan_out_metrics(self):
+        names = ["Show.S01E0%d" % i for i in (1, 2, 3)]
+        fan_out_dir = path.join(TestStart.test_dir, "fan_out")
+        create_test_directory(
+            {name + ".mkv": None for name in names}, parent_dir=fan_out_dir
+        )
+        start = get_function(name=fan_out_dir)
+        gs = start.__self__
+        gs.pending = PendingVideos()
+        sub_names = [name + ".srt" for name in names]
+
+        def process_video(video):
+            extract_subs = [[video.name + ".srt", ".srt"]]
+            gs._fan_out(video, None, sub_names, extract_subs, "[zimuku]pack")
+            return "", extract_subs
+
+        with mock.patch.object(
+            gs, "process_video", side_effect=process_video
+        ) as process, mock.patch.object(gs, "_write_subtitles"):
+            result = start()
+        self.assertEqual(process.call_count, 1)
+        self.assertEqual(result["success"], 3)
+        # 分配给其他剧集的字幕也计入成功数
+        self.assertEqual(result["metrics"]["counters"]["videos.success"], 3)
+
+    def test_interactive_mode_not_concurrent(self):
+        start = get_function(name=TestStart.test_dir, query=True, jobs=4)
+        self.assertEqual(start.__self__.jobs, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+# coding: utf-8
+
+import os
+import time
+import shutil
+import unittest
+import tempfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from getsub.cache import PageCache, NegativeCache, ArchiveStore
+from getsub.downloader.downloader import Downloader
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_and_set(self):
+        cache = PageCache(self.cache_dir)
+        self.assertIsNone(cache.get("zimuku", "search:show.s01"))
+        cache.set("zimuku", "search:show.s01", "html")
+        self.assertEqual(cache.get("zimuku", "search:show.s01"), "html")
+        self.assertIsNone(cache.get("zimuzu", "search:show.s01"))
+        cache.close()
+        # persistent between runs
+        self.assertEqual(
+            PageCache(self.cache_dir).get("zimuku", "search:show.s01"), "html"
+        )
+
+    def test_ttl(self):
+        cache = PageCache(self.cache_dir, ttls={"zimuku": 0.05})
+        cache.set("zimuku", "key", "html")
+        cache.set("zimuzu", "key", "html")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("zimuku", "key"))
+        self.assertEqual(cache.get("zimuzu", "key"), "html")
+
+    def test_lru_eviction(self):
+        cache = PageCache(self.cache_dir, max_size=35)
+        for key in ("a", "b", "c"):
+            cache.set("zimuku", key, "x" * 10)
+            time.sleep(0.01)
+        cache.get("zimuku", "a")
+        cache.set("zimuku", "d", "x" * 10)
+        self.assertEqual(cache.get("zimuku", "a"), "x" * 10)
+        self.assertIsNone(cache.get("zimuku", "b"))
+        self.assertEqual(cache.get("zimuku", "d"), "x" * 10)
+
+    def test_disabled_and_refresh(self):
+        PageCache(self.cache_dir, enabled=False).set("zimuku", "key", "html")
+        self.assertIsNone(PageCache(self.cache_dir).get("zimuku", "key"))
+        refresh = PageCache(self.cache_dir, refresh=True)
+        refresh.set("zimuku", "key", "html")
+        self.assertIsNone(refresh.get("zimuku", "key"))
+        self.assertEqual(PageCache(self.cache_dir).get("zimuku", "key"), "html")
+
+    def test_search_cache_key(self):
+        self.assertEqual(
+            Downloader.search_cache_key("The%20Show.s01"),
+            Downloader.search_cache_key("the show s01 "),
+        )
+
+
+class TestConnect(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_shared_database(self):
+        # 同一数据库的多个连接同时写入
+        pages = PageCache(self.cache_dir)
+        negative = NegativeCache(self.cache_dir)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = []
+            for i in range(20):
+                futures.append(executor.submit(pages.set, "zimuku", str(i), "html"))
+                futures.append(executor.submit(negative.add, str(i)))
+            for future in futures:
+                future.result()
+        self.assertEqual(len(negative.list()), 20)
+        conn = pages._connect()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertGreater(conn.execute("PRAGMA busy_timeout").fetchone()[0], 0)
+        pages.close()
+        negative.close()
+
+
+class TestNegativeCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key(self):
+        self.assertEqual(
+            NegativeCache.key(
+                {"title": "The  Expanse", "season": 1, "episode": 2, "type": "episode"}
+            ),
+            "the expanse:s1e2",
+        )
+        self.assertEqual(
+            NegativeCache.key({"title": "Pulp Fiction", "year": 1994, "type": "movie"}),
+            "pulp fiction:1994",
+        )
+
+    def test_interval_doubles(self):
+        cache = NegativeCache(self.cache_dir, interval=100, max_interval=300)
+        now = time.time()
+        self.assertIsNone(cache.next_check("key"))
+        cache.add("key")
+        self.assertAlmostEqual(cache.next_check("key"), now + 100, delta=5)
+        cache.add("key")
+        self.assertAlmostEqual(cache.next_check("key"), now + 200, delta=5)
+        cache.add("key")
+        cache.add("key")
+        self.assertAlmostEqual(cache.next_check("key"), now + 300, delta=5)
+        self.assertIsNone(cache.next_check("key", now=now + 400))
+        self.assertIsNone(NegativeCache(self.cache_dir, refresh=True).next_check("key"))
+
+    def test_list_and_purge(self):
+        cache = NegativeCache(self.cache_dir)
+        for key in ("a", "b", "c"):
+            cache.add(key)
+        self.assertEqual([row[0] for row in cache.list()], ["a", "b", "c"])
+        self.assertEqual(cache.purge(["a", "x"]), 1)
+        cache.remove("b")
+        self.assertEqual([row[0] for row in cache.list()], ["c"])
+        self.assertEqual(cache.purge(), 1)
+        self.assertEqual(cache.list(), [])
+
+
+class TestArchiveStore(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    @staticmethod
+    def read(store, link):
+        stored = store.get(link)
+        if stored is None:
+            return None
+        digest, datatype, file = stored
+        with file:
+            return digest, datatype, file.read()
+
+    def test_get_and_put(self):
+        store = ArchiveStore(self.cache_dir)
+        self.assertIsNone(self.read(store, "link1"))
+        digest = store.put("link1", ".zip", bytearray(b"season pack"))
+        self.assertEqual(self.read(store, "link1"), (digest, ".zip", b"season pack"))
+        # 内容相同的字幕包只保存一份
+        self.assertEqual(store.put("link2", ".zip", BytesIO(b"season pack")), digest)
+        self.assertEqual(os.listdir(store.archive_dir), [digest + ".zip"])
+        store.close()
+        self.assertEqual(self.read(ArchiveStore(self.cache_dir), "link2")[0], digest)
+        for store in (
+            ArchiveStore(self.cache_dir, refresh=True),
+            ArchiveStore(self.cache_dir, ttl=-1),
+        ):
+            self.assertIsNone(self.read(store, "link2"))
+
+    def test_add_link(self):
+        store = ArchiveStore(self.cache_dir)
+        digest = store.put("detail", ".zip", b"season pack")
+        store.add_link("download", digest)
+        self.assertEqual(self.read(store, "download"), (digest, ".zip", b"season pack"))
+        store.add_link("other", None)
+        self.assertIsNone(self.read(store, "other"))
+        store.close()
+
+    def test_manifest(self):
+        store = ArchiveStore(self.cache_dir)
+        digest = store.put("link", ".zip", b"data")
+        self.assertIsNone(store.get_manifest(digest))
+        store.set_manifest(digest, [["a.srt", 10, "deflated", []]])
+        self.assertEqual(store.get_manifest(digest), [["a.srt", 10, "deflated", []]])
+
+    def test_lru_eviction(self):
+        store = ArchiveStore(self.cache_dir, max_size=25)
+        for link in ("a", "b"):
+            store.put(link, ".zip", link.encode() * 10)
+            time.sleep(0.01)
+        self.read(store, "a")
+        store.set_manifest(self.read(store, "b")[0], [])
+        time.sleep(0.01)
+        self.read(store, "a")
+        store.put("c", ".zip", b"c" * 10)
+        self.assertIsNotNone(self.read(store, "a"))
+        self.assertIsNone(self.read(store, "b"))
+        self.assertIsNotNone(self.read(store, "c"))
+        self.assertEqual(len(os.listdir(store.archive_dir)), 2)
+
+    def test_disabled(self):
+        store = ArchiveStore(self.cache_dir, max_size=0)
+        self.assertIsNone(store.put("link", ".zip", b"data"))
+        self.assertIsNone(self.read(store, "link"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,15 @@
 # coding: utf-8
 
+import shutil
+import asyncio
+import tempfile
 import unittest
+from unittest import mock
+from getsub.cache import PageCache
 from getsub.models import Video
-from getsub.util import num_to_cn
-from getsub.downloader.downloader import Downloader
+from getsub.util import num_to_cn, SharedResults
+from getsub.downloader.downloader import Downloader, aiohttp
+from getsub.downloader.zimuku import ZimukuDownloader
 
 
 class TestDownloader(unittest.TestCase):
@@ -39,5 +45,148 @@ class TestDownloader(unittest.TestCase):
             self.assertEqual(Downloader.get_keywords(video), r)
 
 
+def parse(html):
+    # 验证码页面没有字幕表格
+    if html == "captcha":
+        raise AttributeError("'NoneType' object has no attribute 'find_all'")
+    return html.upper()
+
+
+class TestParsedPages(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.downloader = ZimukuDownloader()
+        self.downloader.cache = PageCache(self.cache_dir)
+
+    def tearDown(self):
+        self.downloader.cache.close()
+        self.downloader.cache = None
+        shutil.rmtree(self.cache_dir)
+
+    def test_cache_parsed_page(self):
+        result = self.downloader.get_parsed("page:a", lambda: "table", parse)
+        self.assertEqual(result, "TABLE")
+        self.assertEqual(self.downloader.get_cached("page:a"), "table")
+
+    def test_bad_page_not_cached(self):
+        with self.assertRaises(AttributeError):
+            self.downloader.get_parsed("page:a", lambda: "captcha", parse)
+        self.assertIsNone(self.downloader.get_cached("page:a"))
+
+    def test_bad_cached_page_refetched(self):
+        self.downloader.set_cached("page:a", "captcha")
+        result = self.downloader.get_parsed("page:a", lambda: "table", parse)
+        self.assertEqual(result, "TABLE")
+        self.assertEqual(self.downloader.get_cached("page:a"), "table")
+
+
+class TestZimukuLinks(unittest.TestCase):
+    def test_detail_link(self):
+        self.assertTrue(
+            ZimukuDownloader._is_detail_link("http://www.zimuku.la/detail/1.html")
+        )
+        self.assertFalse(
+            ZimukuDownloader._is_detail_link("http://www.zimuku.la/dld/1.html")
+        )
+
+
+class TestZimukuBatch(unittest.TestCase):
+    def test_season_searched_once(self):
+        downloader = ZimukuDownloader()
+        calls = []
+        rows = [
+            ("Show.S01E01.720p.chs.srt", 4, "http://www.zimuku.la/detail/1.html"),
+            ("Show.S01E02.720p.chs.srt", 4, "http://www.zimuku.la/detail/2.html"),
+        ]
+
+        def fake_search_pages(session, keyword, info_dict):
+            calls.append(keyword)
+            return "episode", [("http://www.zimuku.la/subs/1.html", rows)]
+
+        downloader._search_pages = fake_search_pages
+        downloader.batch = SharedResults()
+        try:
+            for i in (1, 2):
+                video = Video("Show.S01E0%d.720p.mkv" % i)
+                subs = downloader.get_subtitles(video, sub_num=10)
+                self.assertEqual(
+                    list(subs), ["[ZIMUKU]Show.S01E0%d.720p.chs.srt" % i]
+                )
+        finally:
+            downloader.batch = None
+        self.assertEqual(calls, ["Show.s01"])
+
+
+class FakeResponse:
+    def __init__(self, text, status=200):
+        self.status = status
+        self._text = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def text(self):
+        return self._text
+
+
+class FakeClient:
+    """ 按顺序返回 responses，Exception 在请求时抛出 """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append((url, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class TestZimukuAsync(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Downloader.sessions, "backoff_factor", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve_with_referer_and_retry(self):
+        client = FakeClient(
+            [
+                aiohttp.ClientConnectionError(),
+                FakeResponse("", status=503),
+                FakeResponse('<a id="down1" href="/dld/1.html">'),
+                FakeResponse('<a rel="nofollow" href="/download/1.zip">'),
+            ]
+        )
+        headers = {"Referer": "http://www.zimuku.la/subs/1.html"}
+        link = asyncio.run(
+            ZimukuDownloader()._aget_archive_dowload_link(
+                client, "http://www.zimuku.la/detail/1.html", headers=headers
+            )
+        )
+        self.assertEqual(link, "http://www.zimuku.la/download/1.zip")
+        self.assertEqual(
+            [url for url, _ in client.requests],
+            ["http://www.zimuku.la/detail/1.html"] * 3
+            + ["http://www.zimuku.la/dld/1.html"],
+        )
+        self.assertTrue(all(h == headers for _, h in client.requests))
+
+    def test_give_up_after_retries(self):
+        retries = Downloader.sessions.retries
+        client = FakeClient([asyncio.TimeoutError()] * (retries + 1))
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(Downloader.aget_text(client, "http://www.zimuku.la/"))
+        self.assertEqual(len(client.requests), retries + 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,92 @@
+# coding: utf-8
+
+import os
+import time
+import shutil
+import unittest
+import tempfile
+from os import path
+from unittest import mock
+
+from getsub.index import LibraryIndex
+from getsub.scanner import LibraryScanner
+from tests import create_test_directory
+
+
+class TestLibraryIndex(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.index = LibraryIndex(self.cache_dir, backoff=100, max_backoff=300)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_status(self):
+        self.assertTrue(self.index.is_due("/tv/a.mkv"))
+        self.index.record("/tv/a.mkv", LibraryIndex.DONE)
+        self.assertFalse(self.index.is_due("/tv/a.mkv"))
+        self.index.record("/tv/b.mkv", LibraryIndex.FAILED)
+        self.assertTrue(self.index.is_due("/tv/b.mkv"))
+
+    def test_backoff(self):
+        now = time.time()
+        self.index.record("/tv/a.mkv", LibraryIndex.NO_RESULT)
+        self.assertFalse(self.index.is_due("/tv/a.mkv", now=now + 50))
+        self.assertTrue(self.index.is_due("/tv/a.mkv", now=now + 150))
+        self.index.record("/tv/a.mkv", LibraryIndex.NO_RESULT)
+        self.assertFalse(self.index.is_due("/tv/a.mkv", now=now + 150))
+        self.assertTrue(self.index.is_due("/tv/a.mkv", now=now + 250))
+        for _ in range(5):
+            self.index.record("/tv/a.mkv", LibraryIndex.NO_RESULT)
+        self.assertTrue(self.index.is_due("/tv/a.mkv", now=now + 350))
+
+    def test_next_attempt(self):
+        now = time.time()
+        self.index.record("/tv/a.mkv", LibraryIndex.NO_RESULT, now + 1000)
+        self.assertFalse(self.index.is_due("/tv/a.mkv", now=now + 150))
+        self.assertTrue(self.index.is_due("/tv/a.mkv", now=now + 1000))
+
+    def test_changed_dir_rechecks_done_videos(self):
+        self.index.set_dir("/tv", 1.0, ["a.mkv"], [])
+        self.index.record("/tv/a.mkv", LibraryIndex.DONE)
+        self.assertEqual(self.index.get_dir("/tv", 1.0), (["a.mkv"], []))
+        self.assertIsNone(self.index.get_dir("/tv", 2.0))
+        self.index.set_dir("/tv", 2.0, ["a.mkv"], [])
+        self.assertTrue(self.index.is_due("/tv/a.mkv"))
+
+
+class TestScanWithIndex(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.root = path.join(self.cache_dir, "library")
+        create_test_directory(
+            {"show": ["Show.S01E01.mkv"], "movie": ["Movie.2019.avi"]},
+            parent_dir=self.root,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_skip_unchanged_dirs(self):
+        scanner = LibraryScanner(index=LibraryIndex(self.cache_dir))
+        first = {d: v for d, v, _ in scanner.scan(self.root)}
+        with mock.patch.object(
+            scanner, "_list_dir", wraps=scanner._list_dir
+        ) as list_dir:
+            second = {d: v for d, v, _ in scanner.scan(self.root)}
+            list_dir.assert_not_called()
+            self.assertEqual(first, second)
+            open(path.join(self.root, "show", "Show.S01E02.mkv"), "w").close()
+            os.utime(path.join(self.root, "show"), (0, time.time() + 10))
+            third = {d: v for d, v, _ in scanner.scan(self.root)}
+            list_dir.assert_called_once_with(path.join(self.root, "show"))
+        self.assertEqual(
+            third[path.join(self.root, "show")],
+            ["Show.S01E01.mkv", "Show.S01E02.mkv"],
+        )
+        scanner.index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import socket
+import asyncio
+import unittest
+from unittest import mock
+from urllib.request import urlopen
+
+from getsub.metrics import Metrics, MetricsServer, StatsdExporter, prometheus_text
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_span(self):
+        with self.metrics.span("search"):
+            pass
+
+        @self.metrics.timed("search")
+        def search():
+            return 1
+
+        @self.metrics.timed("download")
+        async def download():
+            return 2
+
+        self.assertEqual(search(), 1)
+        self.assertEqual(asyncio.run(download()), 2)
+        spans = self.metrics.summary()["spans"]
+        self.assertEqual(spans["search"]["count"], 2)
+        self.assertEqual(spans["download"]["count"], 1)
+
+    def test_summary_since(self):
+        self.metrics.incr("http.requests", 3)
+        self.metrics.observe("search", 0.5)
+        since = self.metrics.snapshot()
+        self.metrics.incr("http.requests")
+        self.metrics.incr("http.bytes", 100)
+        summary = self.metrics.summary(since)
+        self.assertEqual(summary["counters"], {"http.requests": 1, "http.bytes": 100})
+        self.assertEqual(summary["spans"], {})
+
+    def test_prometheus_text(self):
+        self.metrics.incr("cache.page.hits", 2)
+        self.metrics.observe("search", 0.25)
+        text = prometheus_text(self.metrics)
+        self.assertIn('getsub_span_seconds_count{span="search"} 1\n', text)
+        self.assertIn('getsub_span_seconds_sum{span="search"} 0.250000\n', text)
+        self.assertIn("getsub_cache_page_hits_total 2\n", text)
+
+    def test_metrics_server(self):
+        self.metrics.incr("http.requests")
+        server = MetricsServer(0, metrics=self.metrics)
+        self.assertEqual(server._server.server_address[0], "127.0.0.1")
+        try:
+            url = "http://127.0.0.1:%s/metrics" % server.port
+            with urlopen(url, timeout=5) as response:
+                text = response.read().decode("utf-8")
+        finally:
+            server.close()
+        self.assertIn("getsub_http_requests_total 1\n", text)
+
+    def test_statsd(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        exporter = StatsdExporter("127.0.0.1:%s" % receiver.getsockname()[1])
+        self.metrics.listeners.append(exporter)
+        try:
+            self.metrics.incr("http.requests", 2)
+            self.metrics.observe("search", 0.01)
+            lines = [receiver.recv(1024).decode("utf-8") for _ in range(2)]
+        finally:
+            exporter.close()
+            receiver.close()
+        self.assertEqual(lines, ["getsub.http.requests:2|c", "getsub.search:10.000|ms"])
+
+    def test_statsd_resolved_once(self):
+        real_getaddrinfo = socket.getaddrinfo
+        with mock.patch("socket.getaddrinfo", wraps=real_getaddrinfo) as getaddrinfo:
+            exporter = StatsdExporter("localhost:8125")
+            self.metrics.listeners.append(exporter)
+            try:
+                for _ in range(3):
+                    self.metrics.incr("http.requests")
+            finally:
+                exporter.close()
+        self.assertEqual(getaddrinfo.call_count, 1)
+        self.assertEqual(exporter.address[1], 8125)
+
+
+if __name__ == "__main__":
+    unittest.main()
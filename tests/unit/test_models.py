@@ -0,0 +1,51 @@
+# coding: utf-8
+
+import unittest
+from unittest import mock
+
+from getsub.models import Video, plan_batches
+
+
+class TestVideo(unittest.TestCase):
+    def test_lazy_info(self):
+        with mock.patch("getsub.models.guess_info", return_value={}) as guess:
+            video = Video("Show.S01E01.720p.mkv")
+            self.assertFalse(video.has_subtitle)
+            guess.assert_not_called()
+            self.assertEqual(video.info, {})
+            self.assertEqual(video.info, {})
+            guess.assert_called_once_with(video.extracted_name + ".mkv")
+
+    def test_slots(self):
+        video = Video("Show.S01E01.720p.mkv")
+        with self.assertRaises(AttributeError):
+            video.other = 1
+
+
+class TestPlanBatches(unittest.TestCase):
+    def test_group_by_season(self):
+        names = (
+            "Show.S01E01.720p.mkv",
+            "Movie.2019.1080p.mkv",
+            "Other.S01E01.720p.mkv",
+            "Show.S01E02.720p.mkv",
+            "Show.S02E01.720p.mkv",
+            "Another.Movie.2018.1080p.mkv",
+        )
+        videos = [Video(name) for name in names]
+        batches = plan_batches(videos)
+        batches = [[v.name for v in batch] for batch in batches]
+        self.assertEqual(
+            batches,
+            [
+                ["Show.S01E01.720p", "Show.S01E02.720p"],
+                ["Movie.2019.1080p"],
+                ["Other.S01E01.720p"],
+                ["Show.S02E01.720p"],
+                ["Another.Movie.2018.1080p"],
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# coding: utf-8
+
+import os
+import shutil
+import unittest
+import tempfile
+from os import path
+
+from getsub.scanner import LibraryScanner
+from tests import create_test_directory
+
+
+class TestLibraryScanner(unittest.TestCase):
+
+    test_dir_structure = {
+        "show": ["Show.S01E01.mkv", "Show.S01E01.ass", "Show.S01E02.MP4", "notes"],
+        "movie": ["Movie.2019.avi"],
+        "@eaDir": ["thumb.mkv"],
+        "empty": [],
+        "top.mkv": None,
+    }
+
+    def setUp(self):
+        self.root = path.join(tempfile.mkdtemp(), "library")
+        create_test_directory(
+            TestLibraryScanner.test_dir_structure, parent_dir=self.root
+        )
+
+    def tearDown(self):
+        shutil.rmtree(path.dirname(self.root))
+
+    def scan(self, **kwargs):
+        return {
+            path.relpath(dir_path, self.root): (videos, names)
+            for dir_path, videos, names in LibraryScanner(**kwargs).scan(self.root)
+        }
+
+    def test_scan(self):
+        result = self.scan()
+        self.assertEqual(set(result), {".", "show", "movie"})
+        self.assertEqual(result["show"][0], ["Show.S01E01.mkv", "Show.S01E02.MP4"])
+        self.assertIn("Show.S01E01.ass", result["show"][1])
+        self.assertEqual(result["."][0], ["top.mkv"])
+
+    def test_parallel_scan(self):
+        self.assertEqual(self.scan(workers=4), self.scan())
+
+    def test_symlink_loop(self):
+        os.symlink(self.root, path.join(self.root, "show", "loop"))
+        self.assertEqual(set(self.scan()), {".", "show", "movie"})
+        self.assertEqual(set(self.scan(follow_symlinks=True)), {".", "show", "movie"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# coding: utf-8
+
+import time
+import copy
+import unittest
+from unittest import mock
+
+from getsub.session import TokenBucket, SessionManager, RequestContext
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            bucket.acquire()
+        # two requests at once, then one every 0.05s
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class TestSessionManager(unittest.TestCase):
+    def test_shared_session(self):
+        manager = SessionManager(pool_maxsize=3, headers={"User-Agent": "test"})
+        session = manager.session()
+        self.assertIs(session, manager.session())
+        self.assertEqual(session.headers["User-Agent"], "test")
+        adapter = session.get_adapter("http://www.zimuku.la")
+        self.assertEqual(adapter._pool_maxsize, 3)
+        # copied sessions share the connection pool
+        self.assertIs(copy.deepcopy(session).get_adapter("http://a.com"), adapter)
+
+    def test_backoff(self):
+        manager = SessionManager(backoff_factor=0.5)
+        self.assertEqual([manager.backoff(i) for i in (1, 2, 3)], [0, 1, 2])
+
+    def test_configure(self):
+        manager = SessionManager()
+        session = manager.session()
+        manager.configure(pool_maxsize=20)
+        self.assertIsNot(session, manager.session())
+        self.assertEqual(
+            manager.session().get_adapter("http://a.com")._pool_maxsize, 20
+        )
+        with self.assertRaises(AttributeError):
+            manager.configure(unknown=1)
+
+    def test_limit_by_host(self):
+        manager = SessionManager()
+        manager.limit("http://www.zimuku.la", rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(3):
+            manager.acquire("http://www.zimuku.la/search?q=a")
+            manager.acquire("http://other.com/")
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class TestRequestContext(unittest.TestCase):
+    def test_get_with_referer(self):
+        session = mock.Mock()
+        context = RequestContext(session, referer="http://a.com/1", cookies={"k": "v"})
+        context.get("http://a.com/2", stream=True, headers={"Accept": "*/*"})
+        session.get.assert_called_once_with(
+            "http://a.com/2",
+            headers={"Referer": "http://a.com/1", "Accept": "*/*"},
+            stream=True,
+            cookies={"k": "v"},
+        )
+
+    def test_no_referer(self):
+        session = mock.Mock()
+        RequestContext(session).get("http://a.com/2")
+        session.get.assert_called_once_with("http://a.com/2", headers={})
+
+
+if __name__ == "__main__":
+    unittest.main()
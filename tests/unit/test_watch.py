@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import os
+import time
+import shutil
+import unittest
+import tempfile
+import threading
+from os import path
+from unittest import mock
+
+from getsub.scanner import LibraryScanner
+from getsub.watch import WatchDaemon, PollingWatcher, InotifyWatcher, _load_libc
+from tests.unit.getsubtitles import get_function
+
+
+class FakeWatcher:
+    def __init__(self, events):
+        self.events = list(events)
+
+    def poll(self, timeout):
+        time.sleep(0.01)
+        return [self.events.pop(0)] if self.events else []
+
+    def close(self):
+        pass
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(path.join(self.root, "show"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def create(self, name, content=""):
+        file_path = path.join(self.root, "show", name)
+        with open(file_path, "w") as f:
+            f.write(content)
+        return file_path
+
+    def test_debounce(self):
+        file_path = self.create("Show.S01E01.mkv")
+        daemon = WatchDaemon(None, FakeWatcher([]), settle=5)
+        daemon.add(file_path)
+        self.assertEqual(daemon.ready(now=0), [])
+        self.assertEqual(daemon.ready(now=3), [])
+        self.create("Show.S01E01.mkv", "more data")  # still being written
+        self.assertEqual(daemon.ready(now=6), [])
+        self.assertEqual(daemon.ready(now=10), [])
+        self.assertEqual(daemon.ready(now=11), [file_path])
+        self.assertEqual(daemon.ready(now=20), [])
+
+    def test_polling_watcher(self):
+        self.create("Show.S01E01.mkv")
+        watcher = PollingWatcher(self.root, LibraryScanner(), interval=0)
+        file_path = self.create("Show.S01E02.mkv")
+        self.create("Show.S01E02.ass")
+        self.assertEqual(watcher.poll(0), [file_path])
+        self.assertEqual(watcher.poll(0), [])
+
+    @unittest.skipIf(_load_libc() is None, "inotify is not available")
+    def test_inotify_watcher(self):
+        watcher = InotifyWatcher(self.root, LibraryScanner())
+        file_path = self.create("Show.S01E01.mkv")
+        os.mkdir(path.join(self.root, "new"))
+        changed = watcher.poll(1)
+        new_path = path.join(self.root, "new", "Movie.2019.mp4")
+        open(new_path, "w").close()
+        changed += watcher.poll(1)
+        watcher.close()
+        self.assertIn(file_path, changed)
+        self.assertIn(new_path, changed)
+
+    def test_run(self):
+        file_path = self.create("Show.S01E01.mkv")
+        stop = threading.Event()
+        get_subtitles = get_function("start", jobs=2).__self__
+
+        def process_one_video(video):
+            processed.append(path.join(video.path, video.name + video.type))
+            stop.set()
+
+        processed = []
+        daemon = WatchDaemon(get_subtitles, FakeWatcher([file_path]), settle=0)
+        with mock.patch.object(
+            get_subtitles, "process_one_video", side_effect=process_one_video
+        ):
+            daemon.run(stop)
+        self.assertEqual(processed, [file_path])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding: utf-8
+
+import unittest
+from os import path
+from io import BytesIO
+from unittest import mock
+
+from tests.unit import assets_path
+from getsub.util import ArchiveIndex, ArchiveEntry, detect_archive, open_archive
+
+
+class TestArchiveIndex(unittest.TestCase):
+    def load(self, name):
+        with open(path.join(assets_path, name), "rb") as f:
+            return f.read()
+
+    def test_detect_archive(self):
+        self.assertEqual(detect_archive(self.load("archive.zip")[:8]), ".zip")
+        self.assertEqual(detect_archive(self.load("empty.zip")[:8]), ".zip")
+        self.assertEqual(detect_archive(self.load("archive.rar")[:8]), ".rar")
+        self.assertEqual(detect_archive(self.load("archive.7z")[:8]), ".7z")
+        self.assertIsNone(detect_archive(b"<html>"))
+
+    def test_manifest(self):
+        # 文件扩展名错误时按文件头判断
+        index = ArchiveIndex(self.load("archive.zip"), ".rar")
+        self.assertEqual(
+            index.entries,
+            [
+                ArchiveEntry("archive/sub4.sub", 100, "deflated", ()),
+                ArchiveEntry("dir1/sub1.ass", 100, "deflated", ("archive/dir1.zip",)),
+                ArchiveEntry(
+                    "dir2/sub2.ass",
+                    100,
+                    "deflated",
+                    ("archive/dir1.zip", "dir1/dir2.zip"),
+                ),
+                ArchiveEntry("dir3/sub.srt", 100, "deflated", ("archive/dir3.zip",)),
+                ArchiveEntry(
+                    "dir3/dir4/sub.ass", 100, "deflated", ("archive/dir3.zip",)
+                ),
+            ],
+        )
+        index.close()
+
+    def test_read_nested_on_demand(self):
+        index = ArchiveIndex(BytesIO(self.load("archive.7z")), ".7z")
+        # 遍历完成后只保留最外层压缩包
+        self.assertEqual(set(index._handlers), {()})
+        self.assertEqual(len(index.read("dir2/sub2.ass")), 100)
+        self.assertEqual(index.read("archive/sub4.sub").decode().strip(), "sub")
+        self.assertEqual(
+            set(index._handlers), {(), ("archive/dir1.zip", "dir1/dir2.zip")}
+        )
+        index.close()
+        self.assertEqual(index._handlers, {})
+
+    def test_root_opened_once(self):
+        # 没有 py7zr 时每次打开 7z 压缩包都要解压一次
+        data = BytesIO(self.load("archive.7z"))
+        with mock.patch("getsub.util.open_archive", wraps=open_archive) as opened:
+            index = ArchiveIndex(data, ".7z")
+            self.assertEqual(index.read("archive/sub4.sub").decode().strip(), "sub")
+            index.close()
+        roots = [call for call in opened.call_args_list if call[0][0] is data]
+        self.assertEqual(len(roots), 1)
+
+    def test_saved_entries(self):
+        entries = ArchiveIndex(self.load("archive.zip"), ".zip").entries
+        manifest = [list(entry[:3]) + [list(entry.chain)] for entry in entries]
+        index = ArchiveIndex(self.load("archive.zip"), ".zip", entries=manifest)
+        self.assertEqual(index.entries, entries)
+        self.assertEqual(index._handlers, {})
+        self.assertEqual(len(index.read("dir2/sub2.ass")), 100)
+        index.close()
+
+    def test_empty_archive(self):
+        self.assertEqual(ArchiveIndex(self.load("empty.zip"), ".zip").entries, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
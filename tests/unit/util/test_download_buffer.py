@@ -0,0 +1,143 @@
+# coding: utf-8
+
+import unittest
+import threading
+from io import StringIO
+from os import path
+from contextlib import redirect_stdout
+
+from requests.structures import CaseInsensitiveDict
+
+from tests.unit import assets_path
+from getsub.util import DownloadBuffer, DownloadAborted, open_data, write_data
+from getsub.util import read_response
+
+
+class TestDownloadBuffer(unittest.TestCase):
+    def test_known_size(self):
+        buff = DownloadBuffer(content_size=6)
+        buff.write(b"abc")
+        buff.write(b"def")
+        self.assertEqual(bytes(buff.getvalue()), b"abcdef")
+
+    def test_shorter_than_content_length(self):
+        buff = DownloadBuffer(content_size=10)
+        buff.write(b"abc")
+        self.assertEqual(bytes(buff.getvalue()), b"abc")
+
+    def test_longer_than_content_length(self):
+        buff = DownloadBuffer(content_size=4)
+        buff.write(b"abc")
+        buff.write(b"def")
+        self.assertEqual(bytes(buff.getvalue()), b"abcdef")
+
+    def test_unknown_size(self):
+        buff = DownloadBuffer()
+        buff.write(b"abc")
+        buff.write(b"def")
+        self.assertEqual(buff.getvalue(), b"abcdef")
+
+    def test_spill_to_file(self):
+        buff = DownloadBuffer(content_size=8, spill_size=4)
+        buff.write(b"abcd")
+        buff.write(b"efgh")
+        data = buff.getvalue()
+        self.assertTrue(hasattr(data, "read"))
+        self.assertEqual(open_data(data).read(), b"abcdefgh")
+
+    def test_chunk_size(self):
+        self.assertEqual(DownloadBuffer().chunk_size, DownloadBuffer.min_chunk_size)
+        self.assertEqual(
+            DownloadBuffer(content_size=100 * 1024 * 1024).chunk_size,
+            DownloadBuffer.max_chunk_size,
+        )
+
+    def test_write_data(self):
+        buff = DownloadBuffer(content_size=8, spill_size=4)
+        buff.write(b"abcdefgh")
+        target = open_data(b"")
+        write_data(target, buff.getvalue())
+        self.assertEqual(target.getvalue(), b"abcdefgh")
+
+
+class FakeResponse:
+    def __init__(self, chunks, headers=None):
+        self.chunks = chunks
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.read = 0
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+class TestReadResponse(unittest.TestCase):
+    def setUp(self):
+        with open(path.join(assets_path, "archive.zip"), "rb") as f:
+            self.archive = f.read()
+
+    def test_archive(self):
+        response = FakeResponse([self.archive[:100], self.archive[100:]])
+        content_type, data = read_response(response)
+        self.assertEqual(content_type.datatype, ".zip")
+        self.assertEqual(bytes(data), self.archive)
+
+    def test_progress_printed_once(self):
+        response = FakeResponse(
+            [self.archive[:100], self.archive[100:]],
+            {"Content-Length": str(len(self.archive))},
+        )
+        with redirect_stdout(StringIO()) as output:
+            read_response(response, "pack")
+        self.assertEqual(output.getvalue().count("100.00%"), 1)
+
+    def test_abort_web_page(self):
+        response = FakeResponse(
+            [b"<html><body>captcha</body></html>", b"rest"],
+            {"Content-Type": "text/html"},
+        )
+        with self.assertRaises(DownloadAborted):
+            read_response(response)
+        self.assertEqual(response.read, 1)
+
+    def test_abort_unknown_binary(self):
+        response = FakeResponse([b"\x00\x00\x00\x18ftypmp42", b"rest"])
+        with self.assertRaises(DownloadAborted):
+            read_response(response)
+        self.assertEqual(response.read, 1)
+
+    def test_binary_subtitle(self):
+        # VobSub 的 .sub 是二进制数据，根据文件名继续下载
+        vobsub = [b"\x00\x00\x01\xba\x44\x00\x04\x00\x04\x01", b"rest"]
+        response = FakeResponse(
+            vobsub, {"Content-Disposition": 'attachment; filename="S01E01.sub"'}
+        )
+        content_type, data = read_response(response)
+        self.assertIsNone(content_type.encoding)
+        self.assertEqual(bytes(data), b"".join(vobsub))
+        response = FakeResponse(vobsub)
+        response.url = "http://example.com/files/S01E01.sub?token=1"
+        self.assertEqual(bytes(read_response(response)[1]), b"".join(vobsub))
+
+    def test_abort_too_large(self):
+        response = FakeResponse([self.archive], {"Content-Length": "100000000"})
+        with self.assertRaises(DownloadAborted):
+            read_response(response, max_size=1024)
+        self.assertEqual(response.read, 0)
+        # 没有 content-length 时按已下载大小判断
+        response = FakeResponse([self.archive[:600], self.archive[600:], b"x" * 600])
+        with self.assertRaises(DownloadAborted):
+            read_response(response, max_size=len(self.archive))
+        self.assertEqual(response.read, 3)
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        response = FakeResponse([self.archive])
+        with self.assertRaises(DownloadAborted):
+            read_response(response, cancel=cancel)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,7 +15,6 @@ class TestGetFileList(unittest.TestCase):
     def test_zip_archive(self):
         with open(path.join(assets_path, "archive.zip"), "rb") as f:
             data = f.read()
-        sub_lists = get_file_list(data, ".zip")
         result = {
             "archive/sub4.sub": zipfile.ZipFile,
             "dir1/sub1.ass": zipfile.ZipFile,
@@ -23,13 +22,13 @@ class TestGetFileList(unittest.TestCase):
             "dir3/sub.srt": zipfile.ZipFile,
             "dir3/dir4/sub.ass": zipfile.ZipFile,
         }
-        for sub, handler in sub_lists.items():
-            self.assertTrue(isinstance(handler, result[sub]))
+        with get_file_list(data, ".zip") as sub_lists:
+            for sub, handler in sub_lists.items():
+                self.assertTrue(isinstance(handler, result[sub]))
 
     def test_rar_archive(self):
         with open(path.join(assets_path, "archive.rar"), "rb") as f:
             data = f.read()
-        sub_lists = get_file_list(data, ".rar")
         result = {
             "dir3/sub.srt": rarfile.RarFile,
             "dir3/dir4/sub.ass": rarfile.RarFile,
@@ -37,13 +36,13 @@ class TestGetFileList(unittest.TestCase):
             "dir1/sub1.ass": zipfile.ZipFile,
             "dir2/sub2.ass": zipfile.ZipFile,
         }
-        for sub, handler in sub_lists.items():
-            self.assertTrue(isinstance(handler, result[sub]))
+        with get_file_list(data, ".rar") as sub_lists:
+            for sub, handler in sub_lists.items():
+                self.assertTrue(isinstance(handler, result[sub]))
 
     def test_7z_archive(self):
         with open(path.join(assets_path, "archive.7z"), "rb") as f:
             data = f.read()
-        sub_lists = get_file_list(data, ".7z")
         result = {
             "dir1/sub1.ass": zipfile.ZipFile,
             "dir2/sub2.ass": zipfile.ZipFile,
@@ -51,8 +50,15 @@ class TestGetFileList(unittest.TestCase):
             path.join("dir3", "sub.srt"): P7ZIP,
             path.join("archive", "sub4.sub"): P7ZIP,
         }
-        for sub, handler in sub_lists.items():
-            self.assertTrue(isinstance(handler, result[sub]))
+        with get_file_list(data, ".7z") as sub_lists:
+            for sub, handler in sub_lists.items():
+                self.assertTrue(isinstance(handler, result[sub]))
+            handler = sub_lists[path.join("dir3", "sub.srt")]
+            handler.read(path.join("dir3", "sub.srt"))
+            tmp_dir = handler._tmp_dir.name
+            self.assertTrue(path.isdir(tmp_dir))
+        # 7z 解压的临时目录在退出时删除
+        self.assertFalse(path.exists(tmp_dir))
 
 
 if __name__ == "__main__":
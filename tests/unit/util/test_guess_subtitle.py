@@ -2,7 +2,8 @@
 
 import unittest
 
-from getsub.util import guess_subtitle, compute_subtitle_score
+from getsub.util import guess_subtitle, compute_subtitle_score, rank_subtitles
+from getsub.util import assign_subtitles
 
 
 class TestGuessSubtitle(unittest.TestCase):
@@ -70,6 +71,22 @@ class TestGuessSubtitle(unittest.TestCase):
                 score,
             )
 
+    def test_rank_subtitles(self):
+        sublist = ["dir/"] + [sub for sub, _ in TestGuessSubtitle.test_episode_subs]
+        ranked = rank_subtitles(sublist, TestGuessSubtitle.test_episode_info)
+        self.assertEqual(
+            ranked,
+            sorted(
+                TestGuessSubtitle.test_episode_subs, key=lambda e: e[1], reverse=True
+            ),
+        )
+
+    def test_rank_overlapping_keywords(self):
+        # "ass" 和 "srt" 在 "assrt" 中重叠
+        subname = "the.walking.dead.s10e01.assrt.srt"
+        ranked = rank_subtitles([subname], TestGuessSubtitle.test_episode_info)
+        self.assertEqual(ranked, [(subname, 4)])
+
     def test_guess_with_empty_list(self):
         success, subname = guess_subtitle([], {})
         self.assertEqual((success, subname), (False, None))
@@ -86,6 +103,25 @@ class TestGuessSubtitle(unittest.TestCase):
         )
         self.assertEqual((success, subname), TestGuessSubtitle.test_archive_result2)
 
+    def test_assign_subtitles(self):
+        sublist = [
+            "The.Walking.Dead.S10E02.srt",
+            "The.Walking.Dead.S10E01.srt",
+            "The.Walking.Dead.S10E03.srt",
+        ]
+        details = [
+            dict(TestGuessSubtitle.test_episode_info, episode=episode)
+            for episode in (1, 2, 4)
+        ]
+        self.assertEqual(
+            assign_subtitles(sublist, details),
+            {0: "The.Walking.Dead.S10E01.srt", 1: "The.Walking.Dead.S10E02.srt"},
+        )
+        self.assertEqual(
+            assign_subtitles(sublist, details, taken=[sublist[1]]),
+            {1: "The.Walking.Dead.S10E02.srt"},
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
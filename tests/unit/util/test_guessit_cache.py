@@ -0,0 +1,55 @@
+# coding: utf-8
+
+import shutil
+import unittest
+import tempfile
+
+from getsub.cache import PageCache
+from getsub.util import GuessitCache
+
+
+class TestGuessitCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_hit_and_miss(self):
+        cache = GuessitCache()
+        info = cache.guess("the.expanse.s01e02.720p.mkv")
+        self.assertEqual(info["title"], "the expanse")
+        self.assertEqual(info["season"], 1)
+        self.assertIs(cache.guess("the.expanse.s01e02.720p.mkv"), info)
+        self.assertEqual(
+            cache.stats(), {"size": 1, "hits": 1, "misses": 1, "store_hits": 0}
+        )
+
+    def test_plain_values(self):
+        info = GuessitCache().guess("Movie.2019.1080p.BluRay.x264.chs.eng.mkv")
+        for value in info.values():
+            self.assertIsInstance(value, (bool, int, float, str, list))
+
+    def test_lru(self):
+        cache = GuessitCache(max_size=2)
+        cache.guess("a.s01e01.mkv")
+        cache.guess("b.s01e01.mkv")
+        cache.guess("a.s01e01.mkv")
+        cache.guess("c.s01e01.mkv")  # drops b
+        cache.guess("a.s01e01.mkv")
+        cache.guess("b.s01e01.mkv")
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_store(self):
+        store = PageCache(self.cache_dir)
+        info = GuessitCache(store=store).guess("the.expanse.s01e02.720p.mkv")
+        cache = GuessitCache(store=store)
+        self.assertEqual(cache.guess("the.expanse.s01e02.720p.mkv"), info)
+        self.assertEqual(cache.store_hits, 1)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
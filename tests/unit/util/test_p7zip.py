@@ -1,6 +1,7 @@
 # coding: utf-8
 
 import unittest
+from unittest import mock
 from os import path
 from io import BytesIO
 
@@ -30,6 +31,14 @@ class TestP7ZIP(unittest.TestCase):
         data = p7zip.read("archive/sub4.sub")
         self.assertEqual(data.decode().strip(), "sub")
 
+    def test_extract_once(self):
+        with open(path.join(assets_path, "archive.7z"), "rb") as f:
+            p7zip = P7ZIP(BytesIO(f.read()))
+        with mock.patch.object(P7ZIP, "_extract", wraps=p7zip._extract) as extract:
+            for name in p7zip.namelist():
+                self.assertTrue(p7zip.read(name))
+        self.assertEqual(extract.call_count, 1)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,53 @@
+# coding: utf-8
+
+import time
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from getsub.util import SharedResults
+
+
+class TestSharedResults(unittest.TestCase):
+    def test_compute_once(self):
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            time.sleep(0.05)
+            return value * 2
+
+        shared = SharedResults()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(
+                executor.map(lambda _: shared.get("key", compute, 21), range(4))
+            )
+        self.assertEqual(results, [42] * 4)
+        self.assertEqual(calls, [21])
+
+    def test_error_not_saved(self):
+        shared = SharedResults()
+        with self.assertRaises(ValueError):
+            shared.get("key", int, "a")
+        self.assertEqual(shared.get("key", int, "1"), 1)
+
+    def test_async_compute_once(self):
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value * 2
+
+        async def run():
+            shared = SharedResults()
+            return await asyncio.gather(
+                *[shared.aget("key", compute, 21) for _ in range(4)]
+            )
+
+        self.assertEqual(asyncio.run(run()), [42] * 4)
+        self.assertEqual(calls, [21])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+import unittest
+from os import path
+
+from tests.unit import assets_path
+from getsub.util import ContentType, DownloadBuffer, sniff_content
+from getsub.downloader.downloader import Downloader
+
+SRT = "1\r\n00:00:01,000 --> 00:00:02,000\r\n你好，世界\r\n\r\n"
+ASS = "[Script Info]\nTitle: 测试\n\n[V4+ Styles]\nFormat: Name\n"
+
+
+class TestSniffContent(unittest.TestCase):
+    def test_archive(self):
+        for name in ("archive.zip", "archive.rar", "archive.7z"):
+            with open(path.join(assets_path, name), "rb") as f:
+                self.assertEqual(
+                    sniff_content(f.read()),
+                    ContentType(path.splitext(name)[1], None),
+                )
+
+    def test_subtitle(self):
+        self.assertEqual(
+            sniff_content(SRT.encode("utf-8")), ContentType(".srt", "utf-8")
+        )
+        self.assertEqual(
+            sniff_content(SRT.encode("gbk")), ContentType(".srt", "gb18030")
+        )
+        self.assertEqual(
+            sniff_content(ASS.encode("utf-8-sig")), ContentType(".ass", "utf-8-sig")
+        )
+        self.assertEqual(sniff_content(ASS.encode("utf-16")).datatype, ".ass")
+        self.assertEqual(sniff_content(b"{1}{50}hello").datatype, ".sub")
+        # 没有 BOM 的 utf-16
+        self.assertEqual(
+            sniff_content(SRT.encode("utf-16-le")), ContentType(".srt", "utf-16-le")
+        )
+        self.assertEqual(
+            sniff_content(SRT.encode("utf-16-be")), ContentType(".srt", "utf-16-be")
+        )
+
+    def test_html(self):
+        page = b"\n<!DOCTYPE html><html><body>login</body></html>"
+        self.assertEqual(sniff_content(page), ContentType("html", "utf-8"))
+        self.assertEqual(
+            Downloader.check_content(sniff_content(page), ".rar"),
+            (None, "got a web page instead of subtitles"),
+        )
+
+    def test_unknown(self):
+        self.assertEqual(sniff_content(b"\x00\x01\x02"), ContentType(None, None))
+        # 无法判断时使用响应头或链接中的类型
+        self.assertEqual(
+            Downloader.check_content(sniff_content(b"hello"), ".srt"), (".srt", "")
+        )
+
+    def test_download_buffer(self):
+        buff = DownloadBuffer()
+        data = (SRT * 200).encode("utf-8")
+        buff.write(data[:10])
+        self.assertIsNone(buff.content_type)
+        buff.write(data[10:])
+        self.assertEqual(buff.content_type, ContentType(".srt", "utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()